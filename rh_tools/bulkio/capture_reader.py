@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+"""
+Random access to recorded bulkio captures.
+
+A capture is described by the packet index and metadata written next to
+it (see rh_tools.bulkio.stream_recorder): the position and bulkio
+timestamp of every packet, and the SRIs.  CaptureReader finds the packet
+holding a given time with a binary search of the index and returns the
+samples as a view of a memory-mapped segment, so only the pages of the
+requested time range are read from disk.
+
+Bluefiles (i.e. from sb.FileSink) have no packet boundaries, but their
+header holds the start time, the sample spacing and the sample format.
+index_bluefile writes the same index and metadata for a bluefile, split
+in fixed size blocks, so it can be read by CaptureReader as well.
+
+Example
+-------
+>>> from rh_tools.bulkio.capture_reader import CaptureReader
+>>> cap = CaptureReader("/tmp/out1.bin")
+>>> samples = cap.time_slice(1500000000.25, 1500000000.5)
+
+Index a bluefile recorded by rh_tools.bulkio.record_waveform
+
+>>> python -m rh_tools.bulkio.capture_reader /tmp/out2.bin --bluefile
+"""
+from collections import OrderedDict
+import json
+import os
+import struct
+import numpy
+from rh_tools.bulkio.stream_recorder import INDEX_DTYPE, capture_files
+
+# bluefile format letter to sample type
+BLUEFILE_TYPES = {
+    "B": numpy.int8,
+    "I": numpy.int16,
+    "L": numpy.int32,
+    "X": numpy.int64,
+    "F": numpy.float32,
+    "D": numpy.float64,
+}
+
+# seconds between the bluefile (J1950) and unix epochs
+J1950_TO_UNIX = 631152000.0
+
+def read_bluefile_header(filename):
+    """Read the fields of a bluefile header (type 1000) needed for indexing
+
+    Parameters
+    ----------
+    filename : str
+        The bluefile
+
+    Returns
+    -------
+    header : dict
+        data_start, data_size (bytes), format, timecode (J1950 seconds),
+        xstart, xdelta and the data endianness ("<" or ">")
+    """
+    with open(filename, "rb") as fid:
+        hcb = fid.read(512)
+    if len(hcb) < 512 or hcb[:4] != b"BLUE":
+        raise ValueError("%s is not a bluefile"%filename)
+    head = "<" if hcb[4:8] == b"EEEI" else ">"
+    data = "<" if hcb[8:12] == b"EEEI" else ">"
+    data_start, data_size = struct.unpack(head + "dd", hcb[32:48])
+    file_type, = struct.unpack(head + "i", hcb[48:52])
+    timecode, = struct.unpack(head + "d", hcb[56:64])
+    xstart, xdelta = struct.unpack(head + "dd", hcb[256:272])
+    return {
+        "data_start": int(data_start),
+        "data_size": int(data_size),
+        "type": file_type,
+        "format": hcb[52:54].decode("ascii"),
+        "timecode": timecode,
+        "xstart": xstart,
+        "xdelta": xdelta,
+        "endian": data,
+    }
+
+def index_bluefile(filename, block=65536):
+    """Write the packet index and metadata of a bluefile
+
+    Only the header is read.  The data is split in blocks of samples,
+    the time of each block follows from the start time and xdelta.
+
+    Parameters
+    ----------
+    filename : str
+        The bluefile
+
+    block : int
+        Number of samples per index entry
+
+    Returns
+    -------
+    packets : int
+        Number of index entries
+    """
+    header = read_bluefile_header(filename)
+    if header["format"][1] not in BLUEFILE_TYPES:
+        raise ValueError("Unsupported bluefile format %s"%header["format"])
+    dtype = numpy.dtype(BLUEFILE_TYPES[header["format"][1]])
+    dtype = dtype.newbyteorder(header["endian"])
+    step = 2 if header["format"][0] == "C" else 1
+
+    elements = header["data_size"] // dtype.itemsize
+    offsets = numpy.arange(0, elements, block * step, dtype=numpy.uint64)
+    index = numpy.zeros(len(offsets), dtype=INDEX_DTYPE)
+    index["offset"] = offsets
+    index["count"] = numpy.minimum(block * step, elements - offsets)
+    times = header["timecode"] - J1950_TO_UNIX +\
+        offsets.astype(numpy.float64) / step * header["xdelta"]
+    index["twsec"] = numpy.floor(times)
+    index["tfsec"] = times - index["twsec"]
+
+    index_file, meta_file = capture_files(filename)
+    index.tofile(index_file)
+    meta = OrderedDict([
+        ("dtype", dtype.str),
+        ("segments", [os.path.basename(filename)]),
+        ("data_offset", header["data_start"]),
+        ("sri", [OrderedDict([("xstart", header["xstart"]),
+            ("xdelta", header["xdelta"]), ("mode", step - 1)])]),
+        ("packets", len(index)),
+        ("elements", int(elements)),
+        ("queue_flushes", 0),
+    ])
+    with open(meta_file, "w") as fid:
+        json.dump(meta, fid, indent=2)
+    return len(index)
+
+class CaptureReader(object):
+    """Seek into a capture by time
+
+    Parameters
+    ----------
+    filename : str
+        The capture (the base name given to the recorder, or the bluefile)
+    """
+    def __init__(self, filename):
+        index_file, meta_file = capture_files(filename)
+        with open(meta_file, "r") as fid:
+            meta = json.load(fid)
+        directory = os.path.dirname(filename)
+        self.dtype = numpy.dtype(str(meta["dtype"]))
+        self.segments = [os.path.join(directory, name)
+            for name in meta["segments"]]
+        self.data_offset = meta.get("data_offset", 0)
+        self.sri = meta.get("sri", [])
+        # number of input queue flushes (each dropped a whole queue)
+        self.flushes = meta.get("queue_flushes", 0)
+        self.index = numpy.fromfile(index_file, dtype=INDEX_DTYPE)
+        self.times = self.index["twsec"] + self.index["tfsec"]
+        self._maps = {}
+
+    def segment(self, ind):
+        """Memory map of a segment (read only, opened once)"""
+        if ind not in self._maps:
+            self._maps[ind] = numpy.memmap(self.segments[ind],
+                dtype=self.dtype, mode="r", offset=self.data_offset)
+        return self._maps[ind]
+
+    def sri_of(self, packet):
+        """The SRI dictionary of a packet ({} if not recorded)"""
+        if not self.sri:
+            return {}
+        return self.sri[min(int(self.index["sri"][packet]), len(self.sri) - 1)]
+
+    def locate(self, t):
+        """Find the element recorded at a time
+
+        Parameters
+        ----------
+        t : float
+            Time in seconds (twsec + tfsec)
+
+        Returns
+        -------
+        packet : int
+            The index entry holding t (the first/last entry if t is
+            before/after the capture)
+
+        segment : int
+
+        element : int
+            Position of the element in the segment
+        """
+        if not len(self.index):
+            raise ValueError("Empty capture")
+        packet = max(int(numpy.searchsorted(self.times, t, side="right")) - 1,
+            0)
+        rec = self.index[packet]
+        sri = self.sri_of(packet)
+        xdelta = sri.get("xdelta", 0)
+        step = 2 if sri.get("mode", 0) else 1
+        within = 0
+        if xdelta > 0 and t > self.times[packet]:
+            # tolerate the rounding of t - packet time
+            within = int((t - self.times[packet]) / xdelta + 1e-6) * step
+        within = min(within, int(rec["count"]))
+        return packet, int(rec["segment"]), int(rec["offset"]) + within
+
+    def time_slice(self, start, stop):
+        """The samples recorded between two times
+
+        Parameters
+        ----------
+        start, stop : float
+            Time range in seconds (twsec + tfsec)
+
+        Returns
+        -------
+        samples : numpy.ndarray
+            A memory-mapped view when the range is in one segment,
+            otherwise a copy of the parts of each segment
+        """
+        _, seg_0, elem_0 = self.locate(start)
+        _, seg_1, elem_1 = self.locate(stop)
+        if seg_0 == seg_1:
+            return self.segment(seg_0)[elem_0:elem_1]
+        parts = [self.segment(seg_0)[elem_0:]]
+        parts += [self.segment(ind)[:] for ind in range(seg_0 + 1, seg_1)]
+        parts.append(self.segment(seg_1)[:elem_1])
+        return numpy.concatenate(parts)
+
+    def packets(self, start, stop):
+        """The index entries overlapping a time range"""
+        first = self.locate(start)[0]
+        last = self.locate(stop)[0]
+        return self.index[first:last + 1]
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="Index and describe a capture")
+    parser.add_argument("file", help="The capture (or bluefile)")
+    parser.add_argument("--bluefile", action="store_true",
+        help="Write the index of a bluefile first")
+    parser.add_argument("--block", default=65536, type=int,
+        help="Samples per index entry of a bluefile")
+    args = parser.parse_args()
+
+    if args.bluefile:
+        print("Indexed %d blocks"%index_bluefile(args.file, args.block))
+    cap = CaptureReader(args.file)
+    print("%d packets in %d segments, %d queue flushes"%(len(cap.index),
+        len(cap.segments), cap.flushes))
+    if len(cap.index):
+        print("Time range %.6f - %.6f"%(cap.times[0], cap.times[-1]))
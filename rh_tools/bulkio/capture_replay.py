@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+"""
+Replay a recorded capture into a bulkio input port.
+
+CaptureReplay plays a capture written by rh_tools.bulkio.record_waveform
+(segmented capture or bluefile), or a raw file of samples, out of an
+in-process bulkio output port.  It behaves as a sandbox component, so a
+scene can use it as a source:
+
+>>> "components": {
+>>>     "Replay": {
+>>>         "key": "rh_tools.capture_replay",
+>>>         "val": {"file": "/tmp/out1.bin", "speed": 4.0,
+>>>             "packet_size": 16384}
+>>>     },
+>>>     ...
+>>> },
+>>> "connections": [["Replay", "dataOut", "Filter", "dataFloat_in"]]
+
+Its only port is the output port "dataOut", a local port that can only be
+the uses side of a connection.
+
+Packets are read ahead by a background thread (two packets by default,
+double buffering) and converted to the bulkio payload there, so the
+pushing thread only waits on pacing and on the receiver.  Pacing is real
+time (speed 1), N times real time (speed N) or as fast as possible
+(speed 0).  The achieved samples per second is reported on stop.
+"""
+from collections import OrderedDict
+import itertools
+import math
+import os
+import sys
+import threading
+import time
+import numpy
+from rh_tools.bulkio.capture_reader import CaptureReader, index_bluefile
+from rh_tools.bulkio.stream_recorder import capture_files
+if sys.version_info.major == 2:
+    import Queue as queue
+else:
+    import queue
+
+# sample type (kind + size) to bulkio output port class
+OUT_PORT_TYPES = {
+    "i1": "OutCharPort",
+    "u1": "OutOctetPort",
+    "i2": "OutShortPort",
+    "u2": "OutUShortPort",
+    "i4": "OutLongPort",
+    "u4": "OutULongPort",
+    "f4": "OutFloatPort",
+    "f8": "OutDoublePort",
+}
+
+_END = object()
+
+def open_capture(filename, dtype=None, xdelta=1., mode=0):
+    """Open a capture for replay
+
+    Parameters
+    ----------
+    filename : str
+        A capture with an index (see capture_reader), a bluefile (indexed
+        if needed) or, when dtype is specified, a raw file of samples
+
+    dtype : str or None
+        Sample type of a raw file (i.e. "float32")
+
+    xdelta : float
+        Sample spacing of a raw file
+
+    mode : int
+        1 if a raw file holds complex (interleaved) samples
+
+    Returns
+    -------
+    segments : list
+        The memory-mapped samples, in order
+
+    sri : dict
+        xdelta, mode (and anything else recorded)
+
+    start : float
+        Time of the first sample (twsec + tfsec), 0 for a raw file
+    """
+    _, meta_file = capture_files(filename)
+    if not os.path.exists(meta_file):
+        if dtype is not None:
+            data = numpy.memmap(filename, dtype=numpy.dtype(dtype), mode="r")
+            return [data], {"xdelta": xdelta, "mode": mode}, 0.
+        index_bluefile(filename)
+    cap = CaptureReader(filename)
+    segments = [cap.segment(ind) for ind in range(len(cap.segments))
+        if os.path.getsize(cap.segments[ind]) > cap.data_offset]
+    start = float(cap.times[0]) if len(cap.index) else 0.
+    return segments, dict(cap.sri_of(0)), start
+
+def iter_blocks(segments, packet_size):
+    """Split the segments in packets
+
+    Parameters
+    ----------
+    segments : list
+        Arrays of samples
+
+    packet_size : int
+        Number of elements per packet (the last packet may be shorter)
+
+    Returns
+    -------
+    blocks : generator
+        Views of the segments, or a copy for packets across segments
+    """
+    carry = None
+    for data in segments:
+        start = 0
+        if carry is not None:
+            start = packet_size - len(carry)
+            carry = numpy.concatenate([carry, data[:start]])
+            if len(carry) < packet_size:
+                continue
+            yield carry
+            carry = None
+        while start + packet_size <= len(data):
+            yield data[start:start + packet_size]
+            start += packet_size
+        if start < len(data):
+            carry = numpy.array(data[start:])
+    if carry is not None and len(carry):
+        yield carry
+
+def prefetch(blocks, depth=2, convert=numpy.array):
+    """Read blocks ahead in a background thread
+
+    Parameters
+    ----------
+    blocks : iterable
+        The blocks (i.e. memory-mapped views)
+
+    depth : int
+        Number of blocks read ahead (2 is double buffering)
+
+    convert : callable
+        Applied to each block in the background thread (the default copy
+        pages the samples in from disk)
+
+    Returns
+    -------
+    blocks : generator
+        The converted blocks.  Errors of the background thread are raised
+        here.
+    """
+    buf = queue.Queue(maxsize=max(depth, 1))
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buf.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fill():
+        try:
+            for block in blocks:
+                if not put(convert(block)):
+                    return
+        except Exception as e:
+            put(e)
+        put(_END)
+
+    thread = threading.Thread(target=fill)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item = buf.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+def pace(blocks, sample_rate, speed=1., step=1):
+    """Release blocks at a multiple of real time
+
+    The release time of each block is computed from the start time and
+    the number of samples before it, so pacing does not drift.
+
+    Parameters
+    ----------
+    blocks : iterable
+        The blocks
+
+    sample_rate : float
+        Samples per second of the capture
+
+    speed : float
+        1 for real time, N for N times real time, 0 for as fast as possible
+
+    step : int
+        Elements per sample (2 for complex)
+
+    Returns
+    -------
+    blocks : generator
+        (block, index of its first sample)
+    """
+    tic = time.time()
+    sent = 0
+    for block in blocks:
+        if speed > 0 and sample_rate > 0:
+            delay = tic + sent / (sample_rate * speed) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        yield block, sent
+        sent += len(block) // step
+
+class CaptureReplay(object):
+    """Replay a capture out of an in-process bulkio output port
+
+    Configured with a dictionary of properties (see configure), started
+    and stopped like a sandbox component.
+
+    Parameters
+    ----------
+    instanceName : str
+        Name of the instance (used as the default stream id)
+    """
+    DEFAULTS = OrderedDict([
+        ("file", ""),           # capture, bluefile or raw file
+        ("speed", 1.0),         # 1 real time, N times real time, 0 AFAP
+        ("packet_size", 8192),  # elements per packet
+        ("loop", 1),            # number of passes, 0 repeats until stopped
+        ("prefetch", 2),        # packets read ahead
+        ("stream_id", ""),      # default to the instance name
+        ("dtype", None),        # raw file only: sample type
+        ("xdelta", 1.0),        # raw file only: sample spacing
+        ("mode", 0),            # raw file only: 1 for complex samples
+    ])
+
+    # the output (uses) port, the only port of the replay
+    PORT_NAME = "dataOut"
+
+    def __init__(self, instanceName="capture_replay", **props):
+        self.name = instanceName
+        self.props = OrderedDict(self.DEFAULTS)
+        self.configure(props)
+        self.port = None
+        self.samples = 0
+        self.packets = 0
+        self.elapsed = 0.
+        self.error = None
+        self._capture = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def configure(self, props):
+        """Update the properties (keys of DEFAULTS)"""
+        for key in props:
+            if str(key) not in self.DEFAULTS:
+                raise ValueError("Unknown capture replay property %s"%key)
+            self.props[str(key)] = props[key]
+        self._capture = None
+
+    def _prepare(self):
+        """Open the capture and create the output port"""
+        if self._capture is None:
+            props = self.props
+            self._capture = open_capture(props["file"], props["dtype"],
+                props["xdelta"], props["mode"])
+        if self.port is None:
+            import bulkio
+            dtype = self._capture[0][0].dtype
+            key = "%s%d"%(dtype.kind, dtype.itemsize)
+            self.port = getattr(bulkio, OUT_PORT_TYPES[key])(self.PORT_NAME)
+        return self._capture
+
+    def getPort(self, name):
+        """The output port, to connect as a sandbox port
+
+        The port is a local bulkio output port (a Python object, not an
+        object reference), so the replay can only be the uses side of a
+        connection: ``[replay_id, "dataOut", provides_id, provides_port]``.
+
+        Parameters
+        ----------
+        name : str
+            The name of the port (PORT_NAME)
+
+        Raises
+        ------
+        ValueError  If the replay has no port of that name
+        """
+        if str(name) != self.PORT_NAME:
+            raise ValueError("%s has no port %s (only the uses port %s)"%(
+                self.name, str(name), self.PORT_NAME))
+        self._prepare()
+        return self.port
+
+    def start(self):
+        """Start the replay in a background thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._prepare()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        import bulkio
+        segments, sri_dict, start = self._capture
+        props = self.props
+        xdelta = float(sri_dict.get("xdelta") or 1.)
+        step = 2 if sri_dict.get("mode", 0) else 1
+        stream_id = str(props["stream_id"] or self.name)
+        packet_size = max(int(props["packet_size"]) // step, 1) * step
+
+        sri = bulkio.sri.create(stream_id, 1. / xdelta)
+        sri.xdelta = xdelta
+        sri.mode = step - 1
+        self.port.pushSRI(sri)
+
+        # char/octet ports take a string, the others a list
+        if segments[0].dtype.itemsize == 1:
+            convert = lambda block: block.tobytes()
+        else:
+            convert = lambda block: block.tolist()
+        if int(props["loop"]) > 0:
+            passes = range(int(props["loop"]))
+        else:
+            passes = itertools.count()
+        blocks = prefetch(itertools.chain.from_iterable(
+            iter_blocks(segments, packet_size) for _ in passes),
+            int(props["prefetch"]), convert)
+
+        tic = time.time()
+        t = start
+        try:
+            for data, first in pace(blocks, 1. / xdelta,
+                    float(props["speed"]), step):
+                if self._stop.is_set():
+                    break
+                t = start + first * xdelta
+                whole = math.floor(t)
+                self.port.pushPacket(data,
+                    bulkio.timestamp.create(whole, t - whole), False,
+                    stream_id)
+                self.samples += len(data) // step
+                self.packets += 1
+                self.elapsed = time.time() - tic
+            empty = b"" if segments[0].dtype.itemsize == 1 else []
+            whole = math.floor(t)
+            self.port.pushPacket(empty, bulkio.timestamp.create(whole,
+                t - whole), True, stream_id)
+        except Exception as e:
+            self.error = e
+            print("Replay of %s failed: %s"%(props["file"], str(e)))
+        finally:
+            blocks.close()
+            self.elapsed = time.time() - tic
+
+    def stats(self):
+        """Replay statistics
+
+        Returns
+        -------
+        stats : dict
+            samples, packets, elapsed (sec), rate (samples/sec achieved)
+            and speed (achieved rate over the capture sample rate)
+        """
+        rate = self.samples / self.elapsed if self.elapsed > 0 else 0.
+        speed = 0.
+        if self._capture is not None:
+            speed = rate * float(self._capture[1].get("xdelta") or 1.)
+        return {"samples": self.samples, "packets": self.packets,
+            "elapsed": self.elapsed, "rate": rate, "speed": speed}
+
+    def stop(self):
+        """Stop the replay and report the achieved rate"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            stats = self.stats()
+            print("%s: replayed %d samples in %d packets, "%(self.name,
+                stats["samples"], stats["packets"]) +\
+                "%.0f samples/sec (x%.2f real time)"%(stats["rate"],
+                stats["speed"]))
+
+    def releaseObject(self):
+        """Stop the replay (as sandbox components)"""
+        self.stop()
@@ -21,9 +21,15 @@ In this example, waveform1 and waveform2 are on the REDHAWK_DEV
 domain.  The third parameter of ports ("*In") describes the type
 of port and is the name of the input port of the file sink to
 connect.  Finally, the last element of each port is the file to
-store in.  Currently the files are stored as bluefiles.
+store in.  By default the files are stored as bluefiles.  With --segment
+the ports are recorded by StreamRecorder into rotating memory-mapped
+segments with a packet index (see rh_tools.bulkio.stream_recorder).
+Bluefiles are indexed from their header when the recording ends, so both
+can be sliced by time with rh_tools.bulkio.capture_reader.
 """
 from ossie.utils import redhawk, sb
+from rh_tools.bulkio.capture_reader import index_bluefile
+from rh_tools.bulkio.stream_recorder import StreamRecorder
 from rh_tools.domain.domain_tools import find_waveform
 import uuid
 import sys
@@ -32,7 +38,7 @@ if sys.version_info.major == 2:
 else:
     prompt = input
 
-def listen_waveform_ports(domain, waveform_ports):
+def listen_waveform_ports(domain, waveform_ports, recorder_kwargs=None):
     """Listen to message events on specific waveform ports on domain
 
     Parameters
@@ -46,6 +52,12 @@ def listen_waveform_ports(domain, waveform_ports):
         PORT_DATA_TYPE should match an input port of the sb.FileSink
         {"floatIn", "shortIn", "octetIn"}
 
+    recorder_kwargs : dict or None
+        If specified, record with a StreamRecorder (created with these
+        keyword arguments, i.e. rotate_bytes, rotate_seconds) instead of
+        a FileSink.  PORT_DATA_TYPE is then a key of
+        stream_recorder.PORT_TYPES.
+
     Returns
     -------
     my_msgs : dict
@@ -58,6 +70,7 @@ def listen_waveform_ports(domain, waveform_ports):
 
     # ------------------------  prepare variables  --------------------------
     my_sink_list = {}
+    my_files = {}
 
     # add a message sink per port
     for (c_name, c_port, c_type, c_file) in waveform_ports:
@@ -77,7 +90,10 @@ def listen_waveform_ports(domain, waveform_ports):
             port_inst = c_wave.getPort(c_port)
 
             # ---------------  connect to message sink  ---------------------
-            f_sink = sb.FileSink(filename=c_file, midasFile=True)
+            if recorder_kwargs is None:
+                f_sink = sb.FileSink(filename=c_file, midasFile=True)
+            else:
+                f_sink = StreamRecorder(c_type, c_file, **recorder_kwargs)
             port_inst.connectPort(\
                 f_sink.getPort(c_type),
                 "conn_"+ str(uuid.uuid1()))
@@ -86,6 +102,7 @@ def listen_waveform_ports(domain, waveform_ports):
             # track sink
             key = c_name + ":" + c_port
             my_sink_list[key] = f_sink
+            my_files[key] = c_file
         except:
             print("Failed to connect to port:\t%s:%s"%(c_name, c_port))
 
@@ -103,6 +120,17 @@ def listen_waveform_ports(domain, waveform_ports):
         except Exception as e:
             print("Failed to release sink: %s"%str(e))
 
+        if isinstance(my_sink_list[key], StreamRecorder):
+            rec = my_sink_list[key].recorder
+            print("%s: %d packets, %d elements in %d segments, "%(key,
+                rec.packets, rec.elements, len(rec.files)) +\
+                "%d input queue flushes"%rec.flushes)
+        else:
+            try:
+                index_bluefile(my_files[key])
+            except Exception as e:
+                print("Failed to index %s: %s"%(my_files[key], str(e)))
+
 
 if __name__ == "__main__":
     # --------------------  parse command-line arguments  -------------------
@@ -110,6 +138,12 @@ if __name__ == "__main__":
     import json
     parser = ArgumentParser(description=__doc__)
     parser.add_argument("json", help="JSon specification")
+    parser.add_argument("--segment", action="store_true",
+        help="Record into memory-mapped segments with a packet index")
+    parser.add_argument("--rotate_mb", default=0, type=float,
+        help="Start a new segment after this many MB (with --segment)")
+    parser.add_argument("--rotate_sec", default=0, type=float,
+        help="Start a new segment after this many seconds (with --segment)")
     args = parser.parse_args()
 
     # -----------------------  begin processing  ----------------------------
@@ -121,4 +155,11 @@ if __name__ == "__main__":
         assert specs.get("ports") is not None, "Expecting a ports field"
 
         # listen to messages
-        listen_waveform_ports(specs["domain"], specs["ports"])
+        recorder_kwargs = None
+        if args.segment:
+            recorder_kwargs = {
+                "rotate_bytes": int(args.rotate_mb * 2 ** 20),
+                "rotate_seconds": args.rotate_sec,
+            }
+        listen_waveform_ports(specs["domain"], specs["ports"],
+            recorder_kwargs=recorder_kwargs)
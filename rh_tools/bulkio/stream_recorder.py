@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+"""
+Record a bulkio stream into memory-mapped segment files.
+
+A capture ``/tmp/out.bin`` is stored as:
+
+* ``/tmp/out_0000.bin``, ``/tmp/out_0001.bin``, ... the raw samples.  Each
+  segment is a numpy.memmap, packets are copied into it through a view (no
+  intermediate file buffering).  A new segment is started when the current
+  one reaches rotate_bytes or is older than rotate_seconds.
+* ``/tmp/out.idx`` one INDEX_DTYPE record per packet: segment, offset and
+  number of elements, timestamp, SRI number and flags.
+* ``/tmp/out.json`` the sample type, the segment files, every SRI received
+  and the packet/drop counts.
+
+SegmentedRecorder only deals with files, StreamRecorder pulls packets from
+an in-process bulkio input port in a background thread.
+"""
+from collections import OrderedDict
+import json
+import os
+import threading
+import time
+import numpy
+from rh_tools.message.message_writer import segment_filename
+
+# input port name to (bulkio port class, sample type)
+PORT_TYPES = {
+    "charIn": ("InCharPort", numpy.int8),
+    "octetIn": ("InOctetPort", numpy.uint8),
+    "shortIn": ("InShortPort", numpy.int16),
+    "ushortIn": ("InUShortPort", numpy.uint16),
+    "longIn": ("InLongPort", numpy.int32),
+    "ulongIn": ("InULongPort", numpy.uint32),
+    "floatIn": ("InFloatPort", numpy.float32),
+    "doubleIn": ("InDoublePort", numpy.float64),
+}
+
+# packet flags
+FLAG_EOS = 1
+FLAG_SRI_CHANGED = 2
+FLAG_QUEUE_FLUSHED = 4
+
+INDEX_DTYPE = numpy.dtype([
+    ("segment", numpy.uint32),
+    ("offset", numpy.uint64),   # first element in the segment
+    ("count", numpy.uint32),    # number of elements
+    ("twsec", numpy.float64),
+    ("tfsec", numpy.float64),
+    ("sri", numpy.uint32),      # position in the SRI list of the metadata
+    ("flags", numpy.uint8),
+])
+
+def capture_files(filename):
+    """The index and metadata files of a capture
+
+    Returns
+    -------
+    index_file : str
+
+    meta_file : str
+    """
+    base = os.path.splitext(filename)[0]
+    return base + ".idx", base + ".json"
+
+def sri_to_dict(sri):
+    """Convert a BULKIO.StreamSRI to a dictionary (keywords as values)"""
+    out = OrderedDict()
+    for field in ("streamID", "hversion", "xstart", "xdelta", "xunits",
+            "subsize", "ystart", "ydelta", "yunits", "mode", "blocking"):
+        if hasattr(sri, field):
+            out[field] = getattr(sri, field)
+    keywords = OrderedDict()
+    for kw in getattr(sri, "keywords", []):
+        try:
+            keywords[kw.id] = kw.value.value()
+        except Exception:
+            keywords[kw.id] = str(kw.value)
+    out["keywords"] = keywords
+    return out
+
+class SegmentedRecorder(object):
+    """Write packets into memory-mapped segment files
+
+    Parameters
+    ----------
+    filename : str
+        Base name of the capture (see the module documentation)
+
+    dtype : numpy.dtype
+        The sample type
+
+    rotate_bytes : int
+        Start a new segment when a segment reaches this size.  0 keeps a
+        single segment, grown by grow_bytes when full.
+
+    rotate_seconds : float
+        Start a new segment after this many seconds (0 to disable)
+
+    grow_bytes : int
+        Size reserved at a time when rotate_bytes is 0
+    """
+    def __init__(self, filename, dtype, rotate_bytes=0, rotate_seconds=0,
+            grow_bytes=64 * 2 ** 20):
+        self.filename = filename
+        self.dtype = numpy.dtype(dtype)
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.grow_bytes = grow_bytes
+        self.index_file, self.meta_file = capture_files(filename)
+
+        self.files = []
+        self.sri = []
+        self.packets = 0
+        self.elements = 0
+        self.flushes = 0
+        self._map = None
+        self._used = 0
+        self._opened = 0
+        self._index = open(self.index_file, "wb")
+
+    # ---------------------------  segments  --------------------------------
+    def _open_segment(self, min_elements):
+        self._close_segment()
+        name = segment_filename(self.filename, len(self.files))
+        size = self.rotate_bytes or self.grow_bytes
+        elements = max(size // self.dtype.itemsize, min_elements, 1)
+        self._map = numpy.memmap(name, dtype=self.dtype, mode="w+",
+            shape=(elements,))
+        self._used = 0
+        self._opened = time.time()
+        self.files.append(name)
+        # a crash leaves a readable capture up to the previous segment
+        self._index.flush()
+        self._write_meta()
+
+    def _grow_segment(self, min_elements):
+        """Extend the current segment (no rotation)"""
+        elements = max(len(self._map) + self.grow_bytes // self.dtype.itemsize,
+            self._used + min_elements)
+        self._map.flush()
+        self._map = numpy.memmap(self.files[-1], dtype=self.dtype,
+            mode="r+", shape=(elements,))
+
+    def _close_segment(self):
+        if self._map is None:
+            return
+        self._map.flush()
+        self._map = None
+        # drop the unused reserved space
+        with open(self.files[-1], "r+b") as fid:
+            fid.truncate(self._used * self.dtype.itemsize)
+
+    def _reserve(self, count):
+        """Make room for count elements, rotating as needed"""
+        if self._map is None:
+            self._open_segment(count)
+        elif self.rotate_seconds and\
+                time.time() - self._opened >= self.rotate_seconds:
+            self._open_segment(count)
+        elif self._used + count > len(self._map):
+            if self.rotate_bytes:
+                self._open_segment(count)
+            else:
+                self._grow_segment(count)
+
+    # -----------------------------  write  ---------------------------------
+    def add_sri(self, sri):
+        """Record a new SRI (dictionary), returning its number"""
+        self.sri.append(sri)
+        self._write_meta()
+        return len(self.sri) - 1
+
+    def write(self, data, twsec=0., tfsec=0., sri_changed=False, eos=False,
+            queue_flushed=False):
+        """Write a packet
+
+        Parameters
+        ----------
+        data : array-like, bytes
+            The samples.  A bytes/str buffer is viewed as the sample type
+            without conversion.
+
+        twsec, tfsec : float
+            The packet timestamp (whole and fractional seconds)
+
+        sri_changed, eos, queue_flushed : bool
+            Packet flags.  queue_flushed means the input queue of the port
+            was flushed before this packet: every packet queued at that
+            time was dropped (bulkio does not report how many).
+        """
+        if isinstance(data, (bytes, bytearray)):
+            samples = numpy.frombuffer(data, dtype=self.dtype)
+        else:
+            samples = numpy.asarray(data, dtype=self.dtype)
+        count = len(samples)
+        if count:
+            self._reserve(count)
+            self._map[self._used:self._used + count] = samples
+        offset = self._used
+
+        flags = (FLAG_EOS if eos else 0) |\
+            (FLAG_SRI_CHANGED if sri_changed else 0) |\
+            (FLAG_QUEUE_FLUSHED if queue_flushed else 0)
+        record = numpy.array([(max(len(self.files) - 1, 0), offset, count,
+            twsec, tfsec, max(len(self.sri) - 1, 0), flags)],
+            dtype=INDEX_DTYPE)
+        self._index.write(record.tobytes())
+
+        self._used += count
+        self.packets += 1
+        self.elements += count
+        if queue_flushed:
+            self.flushes += 1
+
+    def _write_meta(self):
+        meta = OrderedDict([
+            ("dtype", self.dtype.str),
+            ("segments", [os.path.basename(name) for name in self.files]),
+            ("sri", self.sri),
+            ("packets", self.packets),
+            ("elements", self.elements),
+            ("queue_flushes", self.flushes),
+        ])
+        # write then rename, a crash never leaves a partial file
+        tmp = self.meta_file + ".tmp"
+        with open(tmp, "w") as fid:
+            json.dump(meta, fid, indent=2, default=str)
+        os.rename(tmp, self.meta_file)
+
+    def close(self):
+        """Flush and truncate the last segment, write the metadata"""
+        self._close_segment()
+        if not self._index.closed:
+            self._index.close()
+        self._write_meta()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def _unpack_packet(packet):
+    """(data, T, EOS, SRI, sriChanged, inputQueueFlushed) of a packet
+
+    getPacket returns a tuple in older bulkio versions and an object
+    with named fields in newer ones.
+    """
+    if isinstance(packet, tuple):
+        data, T, EOS, stream_id, SRI, sri_changed, flushed = packet[:7]
+        return data, T, EOS, SRI, sri_changed, flushed
+    return packet.dataBuffer, packet.T, packet.EOS, packet.SRI,\
+        packet.sriChanged, packet.inputQueueFlushed
+
+class StreamRecorder(object):
+    """In-process bulkio sink recording into a SegmentedRecorder
+
+    Parameters
+    ----------
+    port_type : str
+        The input port name (key of PORT_TYPES, i.e. "floatIn")
+
+    filename : str
+        Base name of the capture
+
+    timeout : float
+        Seconds getPacket waits for data (bounds the time to stop)
+
+    kwargs :
+        Passed to SegmentedRecorder (rotate_bytes, rotate_seconds)
+    """
+    def __init__(self, port_type, filename, timeout=0.1, **kwargs):
+        # bulkio is only needed for live recording, not for the file format
+        import bulkio
+        from omniORB import CORBA
+
+        class_name, dtype = PORT_TYPES[port_type]
+        self.port_type = port_type
+        self.port = getattr(bulkio, class_name)(port_type)
+        self.recorder = SegmentedRecorder(filename, dtype, **kwargs)
+        self.timeout = timeout
+        self.error = None
+
+        # activate the servant so remote uses ports can connect to it
+        orb = CORBA.ORB_init()
+        poa = orb.resolve_initial_references("RootPOA")
+        poa._get_the_POAManager().activate()
+        self._object_id = poa.activate_object(self.port)
+        self._poa = poa
+        self.ref = poa.id_to_reference(self._object_id)
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def getPort(self, name=None):
+        """The CORBA reference of the input port (as sb components)"""
+        return self.ref
+
+    def start(self):
+        """Start pulling packets"""
+        self._thread.start()
+
+    def _run(self):
+        recorder = self.recorder
+        sri_id = None
+        try:
+            while not self._stop.is_set():
+                packet = self.port.getPacket(self.timeout)
+                if packet is None:
+                    continue
+                data, T, EOS, SRI, sri_changed, flushed = _unpack_packet(packet)
+                if data is None:
+                    continue
+                if SRI is not None and (sri_changed or sri_id is None):
+                    sri_id = recorder.add_sri(sri_to_dict(SRI))
+                recorder.write(data, T.twsec if T else 0.,
+                    T.tfsec if T else 0., sri_changed, EOS, flushed)
+        except Exception as e:
+            self.error = e
+            print("Stream recorder %s failed: %s"%(recorder.filename, str(e)))
+
+    def stop(self):
+        """Stop pulling packets, close the files and the port"""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.recorder.close()
+        try:
+            self._poa.deactivate_object(self._object_id)
+        except Exception as e:
+            print("Failed to deactivate port: %s"%str(e))
+
+    def releaseObject(self):
+        """Alias of stop (as sb components)"""
+        self.stop()
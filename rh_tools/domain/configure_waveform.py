@@ -1,4 +1,3 @@
-import json
 from rh_tools.scene import utils
 from rh_tools.domain import domain_tools
 from ossie.utils import redhawk
@@ -40,9 +39,7 @@ if __name__ == "__main__":
 
 
     # ------------------------  extract config  -----------------------------
-    with open(args.config) as fid:
-        config = json.load(fid)
-    config = utils.convert_dict(config)
+    config = utils.load_json(args.config)
 
     # get waveform
     wfm_inst = domain_tools.find_waveform_from_domain(args.domain, args.waveform)
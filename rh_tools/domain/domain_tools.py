@@ -1,15 +1,338 @@
+"""
+Helper functions for finding waveforms and event channels on a domain.
+
+Attaching to a domain and listing its applications or event channels are
+CORBA round trips.  The lookups in this module share a process-wide
+DomainSession per domain name: the domain is attached once, and the
+applications and event channels are indexed by name.  An index is rebuilt
+when it is older than the session ttl, when a name is not found (it may
+have been launched since; a name still missing afterwards is not looked
+up again until the index expires), when a call on the cached domain
+fails and, for sessions created with verify, when the cached object no
+longer exists.
+
+wait_for_domain polls a freshly launched domain until its device managers
+and devices are registered.
+"""
+from collections import OrderedDict
+import os
+import threading
+import time
 from ossie.utils import redhawk
-def find_event_channel_from_domain(domain, name):
-    try:
-        dom = redhawk.attach(domain)
-        for evt in dom.eventChannels:
-            if evt.name == name:
-                return evt
 
-        # no match
+# seconds before the application/event channel indices are rebuilt
+DEFAULT_TTL = 30.0
+
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+def exists(obj):
+    """Whether the CORBA object behind a (wrapped) object still exists
+
+    Objects without _non_existent are assumed to exist.
+    """
+    for target in (getattr(obj, "ref", None), obj):
+        non_existent = getattr(target, "_non_existent", None)
+        if non_existent is not None:
+            try:
+                return not non_existent()
+            except Exception:
+                return False
+    return True
+
+class DomainSession(object):
+    """Cached handle and name indices for one domain
+
+    A cached object is returned without a remote call.  A caller whose
+    call on it fails (OBJECT_NOT_EXIST, TRANSIENT) should invalidate the
+    session and look it up again, or use verify to probe it on every
+    lookup.  Names not found are remembered until the indices expire.
+
+    Parameters
+    ----------
+    domain : str
+        The name of the domain
+
+    ttl : float
+        Seconds before the indices are rebuilt.  0 rebuilds on every lookup.
+
+    verify : bool
+        Check that a cached object still exists (one CORBA round trip per
+        lookup) and list the domain again if it does not
+    """
+    def __init__(self, domain, ttl=DEFAULT_TTL, verify=False):
+        self.name = domain
+        self.ttl = ttl
+        self.verify = verify
+        self._dom = None
+        self._indices = {}
+        # kind -> names not found since the index was built
+        self._missing = {}
+        self._lock = threading.RLock()
+
+    @property
+    def dom(self):
+        """The attached domain (attach on first use)"""
+        with self._lock:
+            if self._dom is None:
+                self._dom = redhawk.attach(self.name)
+            return self._dom
+
+    def invalidate(self, reattach=False):
+        """Drop the indices (and the domain handle if reattach)"""
+        with self._lock:
+            self._indices = {}
+            self._missing = {}
+            if reattach:
+                self._dom = None
+
+    def _index(self, kind, refresh=False):
+        """Get the name index for "apps" or "eventChannels"
+
+        Returns
+        -------
+        index : OrderedDict
+            Dictionary of name to object in domain listing order
+        """
+        with self._lock:
+            entry = self._indices.get(kind)
+            if refresh or entry is None or time.time() - entry[0] > self.ttl:
+                index = OrderedDict()
+                for obj in getattr(self.dom, kind):
+                    index.setdefault(obj.name, obj)
+                entry = self._indices[kind] = (time.time(), index)
+                self._missing[kind] = set()
+            return entry[1]
+
+    def _find(self, kind, name, match):
+        for attempt in range(2):
+            try:
+                with self._lock:
+                    index = self._index(kind, refresh=attempt > 0)
+                    missing = self._missing[kind]
+                    if name in missing:
+                        # not found since the index was built
+                        return None
+                obj = index.get(name)
+                if obj is None:
+                    obj = match(index, name)
+                    if obj is not None:
+                        # remember the partial match for the next lookup
+                        index[name] = obj
+                if obj is not None and attempt == 0 and self.verify and\
+                        not exists(obj):
+                    # released since the index was built, list again
+                    continue
+                if obj is not None:
+                    return obj
+                if attempt > 0:
+                    with self._lock:
+                        missing.add(name)
+            except Exception:
+                if attempt > 0:
+                    raise
+                # the cached domain may be stale, attach again
+                self.invalidate(reattach=True)
         return None
+
+    def find_waveform(self, name):
+        """Find a waveform by name (see find_waveform)"""
+        return self._find("apps", name,
+            lambda index, name: find_waveform(index.values(), name))
+
+    def find_event_channel(self, name):
+        """Find an event channel by exact name"""
+        return self._find("eventChannels", name, lambda index, name: None)
+
+def get_session(domain, ttl=None, verify=None):
+    """Get the process-wide DomainSession for a domain
+
+    Parameters
+    ----------
+    domain : str
+        The name of the domain
+
+    ttl : float or None
+        If specified, update the ttl of the session.
+
+    verify : bool or None
+        If specified, update whether the session checks that cached
+        objects still exist.
+
+    Returns
+    -------
+    session : DomainSession
+    """
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(domain)
+        if session is None:
+            session = _SESSIONS[domain] = DomainSession(domain)
+    if ttl is not None:
+        session.ttl = ttl
+    if verify is not None:
+        session.verify = verify
+    return session
+
+def attach(domain):
+    """Attach to a domain, reusing the cached handle
+
+    Parameters
+    ----------
+    domain : str
+        The name of the domain
+
+    Returns
+    -------
+    dom : ossie.utils.redhawk.core.Domain
+    """
+    return get_session(domain).dom
+
+def invalidate(domain=None):
+    """Forget the cached handle and indices
+
+    Parameters
+    ----------
+    domain : str or None
+        The name of the domain.  If None, forget every domain.
+    """
+    with _SESSIONS_LOCK:
+        if domain is None:
+            _SESSIONS.clear()
+        else:
+            _SESSIONS.pop(domain, None)
+
+def device_manager_name(dev_mgr):
+    """The node name of a requested device manager
+
+    Parameters
+    ----------
+    dev_mgr : str
+        Either the node name ("GPP_node") or the path of its DCD file
+        ("/nodes/GPP_node/DeviceManager.dcd.xml")
+
+    Returns
+    -------
+    name : str
+    """
+    dev_mgr = str(dev_mgr).rstrip("/")
+    if dev_mgr.endswith(".xml"):
+        dev_mgr = os.path.dirname(dev_mgr)
+    return os.path.basename(dev_mgr)
+
+def missing_device_managers(dom, device_managers):
+    """List the requested device managers that are not ready
+
+    A device manager is ready once it is registered with the domain and
+    has registered at least one device.
+
+    Parameters
+    ----------
+    dom : ossie.utils.redhawk.core.Domain
+        The attached domain
+
+    device_managers : list
+        The requested device managers (see device_manager_name)
+
+    Returns
+    -------
+    missing : list
+        Description of the device managers not ready
+    """
+    registered = {}
+    for dev_mgr in dom.devMgrs:
+        for attr in ("label", "name"):
+            name = getattr(dev_mgr, attr, None)
+            if name:
+                registered[str(name)] = dev_mgr
+
+    missing = []
+    for dev_mgr in device_managers:
+        name = device_manager_name(dev_mgr)
+        if name not in registered:
+            missing.append("device manager %s"%name)
+        elif not registered[name].devs:
+            missing.append("devices of %s"%name)
+    return missing
+
+def wait_for_domain(domain, device_managers=None, timeout=60., interval=0.1,
+        max_interval=2.):
+    """Wait until a domain and its device managers are registered
+
+    Polls with exponential backoff (interval doubles up to max_interval)
+    until the domain manager is reachable and each requested device
+    manager has registered its devices.
+
+    Parameters
+    ----------
+    domain : str
+        The name of the domain
+
+    device_managers : list or None
+        The device managers to wait for (see device_manager_name)
+
+    timeout : float
+        Maximum number of seconds to wait
+
+    interval : float
+        Seconds before the first retry
+
+    max_interval : float
+        Maximum seconds between retries
+
+    Returns
+    -------
+    dom : ossie.utils.redhawk.core.Domain
+        The attached domain (from the session cache)
+
+    Raises
+    ------
+    RuntimeError    If the domain is not ready before the timeout
+    """
+    device_managers = device_managers or []
+    deadline = time.time() + timeout
+    delay = interval
+    while True:
+        try:
+            if domain not in redhawk.scan():
+                missing = ["domain manager %s"%domain]
+            else:
+                dom = attach(domain)
+                missing = missing_device_managers(dom, device_managers)
+        except Exception as e:
+            # not reachable yet, do not keep a stale handle
+            invalidate(domain)
+            missing = ["domain manager %s (%s)"%(domain, str(e))]
+
+        if not missing:
+            return dom
+        now = time.time()
+        if now >= deadline:
+            raise RuntimeError("Domain %s not ready after %.1f sec, "%(
+                domain, timeout) + "waiting on %s"%", ".join(missing))
+        time.sleep(min(delay, deadline - now))
+        delay = min(2 * delay, max_interval)
+
+def find_event_channel_from_domain(domain, name):
+    """Find an event channel by name on a given domain
+
+    Parameters
+    ----------
+    domain : str
+        The name of the domain
+
+    name : str
+        Name of the event channel
+
+    Returns
+    -------
+    output : event channel or None
+        If no match (or the domain is not reachable), return None
+    """
+    try:
+        return get_session(domain).find_event_channel(name)
     except:
         return None
+
 def find_waveform_from_domain(domain, name):
     """Find a waveform by name on a given domain
 
@@ -34,8 +357,7 @@ def find_waveform_from_domain(domain, name):
         matches
     """
     try:
-        dom = redhawk.attach(domain)
-        return find_waveform(dom.apps, name)
+        return get_session(domain).find_waveform(name)
     except:
         return None
 
@@ -66,4 +388,4 @@ def find_waveform(waveforms, name):
     for wvfm in waveforms:
         if name in wvfm.name:
             return wvfm
-    return None
\ No newline at end of file
+    return None
@@ -0,0 +1,262 @@
+"""
+Columnar storage of recorded messages.
+
+Messages are stored column by column in a NumPy ``.npz`` archive instead of
+as a list of per-message dictionaries.  Each column is keyed by the message
+id and field name (``msg::field``), matching the keys produced by
+``ossie.properties.prop_to_dict``.  An extra ``msg::__index__`` column holds
+the position of each message in the recording, so messages of different
+types can be put back in arrival order.
+
+The archive is written incrementally in row groups (``rg00000/msg::field``,
+``rg00001/msg::field``, ...), so only one row group is held in memory while
+recording.  ``load_columnar`` concatenates the row groups of every column,
+giving one array per field that can be analyzed without re-parsing JSON.
+
+Example
+-------
+>>> writer = ColumnarMessageWriter("/tmp/msgs.npz", batch_size=10000)
+>>> writer.write({"my_msg": {"my_msg::field": 1.0}})
+>>> writer.close()
+>>> cols = load_columnar(writer.files)
+>>> cols["my_msg::field"].mean()
+"""
+from collections import OrderedDict
+import io
+import zipfile
+import numpy
+from rh_tools.message.message_writer import StreamingMessageWriter
+
+INDEX_FIELD = "__index__"
+
+def column_name(msg_id, field):
+    """The column name of a message field
+
+    Parameters
+    ----------
+    msg_id : str
+        The message id
+
+    field : str
+        The field name, with or without the "msg_id::" prefix
+
+    Returns
+    -------
+    name : str
+        The column name ("msg_id::field")
+    """
+    if "::" in field:
+        return field
+    return "%s::%s"%(msg_id, field)
+
+def to_array(values):
+    """Convert a list of field values to an array
+
+    Scalars become a typed 1-D array.  Sequence fields of equal length become
+    a 2-D array.  Anything else falls back to an object array.
+    """
+    try:
+        arr = numpy.asarray(values)
+    except ValueError:
+        # ragged sequences
+        arr = None
+    if arr is None or arr.dtype.kind == "O" or arr.shape[:1] != (len(values),):
+        arr = numpy.empty(len(values), dtype=object)
+        arr[:] = [val for val in values]
+    return arr
+
+class RowGroup(object):
+    """Accumulate messages into columns
+
+    Parameters
+    ----------
+    start_index : int
+        The index of the first message of this row group in the recording
+    """
+    def __init__(self, start_index=0):
+        self.columns = OrderedDict()
+        self.num_rows = 0
+        self._counts = {}
+        self._index = start_index
+
+    def append(self, msg):
+        """Add a message ({msg_id: {field: value}}) to the row group"""
+        for msg_id in msg:
+            fields = msg[msg_id]
+            count = self._counts.get(msg_id, 0)
+            self._append(column_name(msg_id, INDEX_FIELD), count, self._index)
+            for field in fields:
+                self._append(column_name(msg_id, field), count, fields[field])
+            self._counts[msg_id] = count + 1
+
+            # pad fields missing from this message
+            for key in self.columns:
+                if key.startswith(msg_id + "::") and\
+                        len(self.columns[key]) == count:
+                    self.columns[key].append(None)
+        self._index += 1
+        self.num_rows += 1
+
+    def _append(self, key, count, value):
+        col = self.columns.get(key)
+        if col is None:
+            # new field, pad earlier messages
+            col = self.columns[key] = [None] * count
+        col.append(value)
+
+    def arrays(self):
+        """The columns of the row group as arrays"""
+        return OrderedDict(
+            (key, to_array(self.columns[key])) for key in self.columns)
+
+class ColumnarMessageWriter(StreamingMessageWriter):
+    """Write messages to a columnar .npz archive in row groups
+
+    See StreamingMessageWriter for the queue, fsync and rotation parameters.
+
+    Parameters
+    ----------
+    batch_size : int
+        Number of messages per row group
+    """
+    def __init__(self, filename, batch_size=10000, **kwargs):
+        self.batch_size = batch_size
+        self._zip = None
+        self._group = None
+        self._num_groups = 0
+        self._num_rows = 0
+        super(ColumnarMessageWriter, self).__init__(filename, **kwargs)
+
+    def _open_file(self, filename):
+        fid = open(filename, "wb")
+        self._zip = zipfile.ZipFile(fid, "w", allowZip64=True)
+        self._num_groups = 0
+        self._group = RowGroup(self._num_rows)
+        return fid
+
+    def _write_message(self, fid, msg):
+        self._group.append(msg)
+        self._num_rows += 1
+        if self._group.num_rows >= self.batch_size:
+            self._write_group()
+
+    def _close_file(self, fid):
+        self._write_group()
+        self._zip.close()
+        self._zip = None
+
+    def _write_group(self):
+        if not self._group.num_rows:
+            return
+        arrays = self._group.arrays()
+        for key in arrays:
+            buf = io.BytesIO()
+            numpy.lib.format.write_array(buf, arrays[key])
+            self._zip.writestr("rg%05d/%s.npy"%(self._num_groups, key),
+                buf.getvalue())
+        self._num_groups += 1
+        self._group = RowGroup(self._num_rows)
+
+def write_columnar(msgs, filename, batch_size=10000):
+    """Write a list of messages to a columnar .npz archive
+
+    Parameters
+    ----------
+    msgs : list
+        List of messages (dictionaries of {msg_id: {field: value}})
+
+    filename : str
+        The output file
+
+    batch_size : int
+        Number of messages per row group
+    """
+    writer = ColumnarMessageWriter(filename, batch_size=batch_size,
+        fsync_interval=0)
+    for msg in msgs:
+        writer.write(msg)
+    writer.close()
+    if writer.error is not None:
+        raise writer.error
+
+def _padding(num_rows):
+    """Object column of num_rows missing values"""
+    arr = numpy.empty(num_rows, dtype=object)
+    arr[:] = None
+    return arr
+
+def _concatenate(parts):
+    """Concatenate the row groups of a column
+
+    Row groups whose rows have different shapes (a sequence field whose
+    length changed, or padding of a sequence field) are joined into an
+    object column of one value per row.
+    """
+    if len(set(part.shape[1:] for part in parts)) <= 1:
+        return numpy.concatenate(parts)
+    arr = numpy.empty(sum(len(part) for part in parts), dtype=object)
+    row = 0
+    for part in parts:
+        for value in (part.tolist() if part.ndim > 1 else part):
+            # element-wise, so sequences are not broadcast
+            arr[row] = value
+            row += 1
+    return arr
+
+def load_columnar(filenames, columns=None):
+    """Load a columnar archive written by ColumnarMessageWriter
+
+    A field absent from a row group (i.e. first seen in a later one) is
+    padded with None for the messages of that group, so every column of a
+    message id has as many rows as its ``__index__`` column.  A sequence
+    field whose rows have different shapes across row groups is loaded as
+    an object column of lists.
+
+    Parameters
+    ----------
+    filenames : str or list
+        The archive (or list of rotated segments) to load
+
+    columns : list or None
+        If specified, only load these columns ("msg::field")
+
+    Returns
+    -------
+    cols : OrderedDict
+        Dictionary of column name to the array of all its values
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+
+    # row groups in file order, each a dictionary of column to array
+    groups = []
+    keys = []
+    for filename in filenames:
+        with numpy.load(filename, allow_pickle=True) as npz:
+            # row group names are zero padded, so sorting keeps file order
+            group_name = None
+            for name in sorted(npz.files):
+                prefix, key = name.split("/", 1)
+                if prefix != group_name:
+                    group_name = prefix
+                    groups.append({})
+                is_index = key.endswith("::" + INDEX_FIELD)
+                if columns is None or key in columns or is_index:
+                    groups[-1][key] = npz[name]
+                    if key not in keys:
+                        keys.append(key)
+
+    cols = OrderedDict()
+    for key in keys:
+        if columns is not None and key not in columns:
+            # index only loaded to count the rows
+            continue
+        index_key = column_name(key.split("::", 1)[0], INDEX_FIELD)
+        parts = []
+        for group in groups:
+            if key in group:
+                parts.append(group[key])
+            elif index_key in group:
+                parts.append(_padding(len(group[index_key])))
+        cols[key] = _concatenate(parts)
+    return cols
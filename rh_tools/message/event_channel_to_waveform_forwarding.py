@@ -1,17 +1,32 @@
 #!/usr/bin/env python
 """
-This module is used to listen to a given event channel and
-forward messages to a specific waveform input message port.
+This module is used to listen to event channels and forward messages
+to waveform input message ports.
 
 Notes
 -----
 The configuration file will be JSON with the fields
 * domain (name of the domain)
+* routes (list of routes), each with the fields
+    * event_channel (source of message to forward)
+    * msg_id (ID, or list of IDs, of the messages to forward.
+      Forward every message if not specified)
+    * destinations (list of [waveform, port] to forward towards)
+
+A single route can also be given with the fields
 * event_channel (source of message to forward)
 * waveform (waveform to forward towards)
 * port (port of the waveform to forward)
 * msg_id (ID of the messages expected)
 
+Each event channel is subscribed once.  The routes of a channel are
+compiled into a dispatch table from message id to destinations, so each
+message is filtered and fanned out with a single dictionary lookup.
+
+Received events are queued and forwarded by worker threads in batches
+(see Forwarder).  The queue size, overflow policy, batch size and number
+of workers are set from the command line.
+
 Example
 -------
 Specify the event channel to listen and forward messages to the
@@ -24,64 +39,325 @@ specified waveform port on the given domain
 >>>     "port":"message_in",
 >>>     "msg_id":"message_id"
 >>> }
+
+Forward two message types from one channel to different waveforms, and
+everything on a second channel to a logger waveform
+
+>>> {
+>>>     "domain":"REDHAWK_DEV",
+>>>     "routes":[
+>>>         {"event_channel":"chan_a", "msg_id":"track",
+>>>          "destinations":[["tracker", "track_in"], ["display", "msg_in"]]},
+>>>         {"event_channel":"chan_a", "msg_id":["status", "alarm"],
+>>>          "destinations":[["display", "msg_in"]]},
+>>>         {"event_channel":"chan_b",
+>>>          "destinations":[["logger", "msg_in"]]}
+>>>     ]
+>>> }
 """
 from ossie.utils import redhawk, sb
 from ossie.events import Subscriber, Publisher
 from rh_tools.domain import domain_tools as DT
+from rh_tools.message.send_message import MessageSender
+from rh_tools.message.event_decoder import interpret_event, EventDecoder
+from collections import OrderedDict
+import sys
+import threading
 import uuid
 from omniORB import CORBA, any
 from pprint import pprint
+if sys.version_info.major == 2:
+    import Queue as queue
+    prompt = raw_input
+else:
+    import queue
+    prompt = input
 
-def interpret_event(data):
-    """Interpret the message event
+# sentinel placed on the queue to stop the forwarding workers
+_STOP = object()
 
-    This is used to convert the Corba.Any structure to a
-    Python dictionary
+def build_dispatch_table(routes):
+    """Compile routes into a dispatch table
 
     Parameters
     ----------
-    data : msg event on event channel
-        This is an object returned by the callback function
-        supplied to the Subscriber of the event channel.
+    routes : list
+        List of (msg_ids, destinations).  msg_ids is a message id, a list
+        of message ids, or None to match any message.  destinations is a
+        list of message senders.
 
     Returns
     -------
-    out_list : list
-        List of dictionaries.
+    table : dict
+        Dictionary of message id to the list of destinations.  The None
+        key holds the destinations of messages with any other id.
+    """
+    wildcard = []
+    explicit = OrderedDict()
+    for msg_ids, dests in routes:
+        if msg_ids is None:
+            wildcard += [dest for dest in dests if dest not in wildcard]
+            continue
+        if not isinstance(msg_ids, (list, tuple)):
+            msg_ids = [msg_ids]
+        for msg_id in msg_ids:
+            c_dests = explicit.setdefault(str(msg_id), [])
+            c_dests += [dest for dest in dests if dest not in c_dests]
+
+    table = {None: wildcard}
+    for msg_id in explicit:
+        table[msg_id] = explicit[msg_id] +\
+            [dest for dest in wildcard if dest not in explicit[msg_id]]
+    return table
+
+class Forwarder(object):
+    """Forward events received on an event channel to a message port
+
+    The subscriber callback (forward) only queues the event.  Worker
+    threads decode the queued events and send the messages in batches, so
+    a slow waveform port does not hold up the event channel.
+
+    Parameters
+    ----------
+    routes : dict or MessageSender or sb.MessageSource
+        The dispatch table from build_dispatch_table.  A single destination
+        receives every message.  Destinations with a send_batch method
+        receive batches of messages, others one sendMessage call per
+        message.
+
+    max_queue : int
+        Maximum number of events waiting to be forwarded
+
+    overflow : str
+        What to do with a new event when the queue is full
+            "block": wait for room (back-pressures the event channel)
+            "drop_oldest": discard the oldest queued event
+            "drop_newest": discard the new event
+
+    batch_size : int
+        Maximum number of messages sent together
+
+    workers : int
+        Number of worker threads.  Messages are only guaranteed to be
+        forwarded in order with a single worker.
     """
-    msg_list = data.value()
-    out_list = []
-    for msg in msg_list:
-        # top level is CORBA.Any the message type
-        print("Message Id = %s"%str(msg.id))
-
-        value = msg.value # Corba.Any
-        typecode = msg.value.typecode() # Properties
-        val_list = msg.value.value()
-        out_dict = {}
-        for val in val_list:
-            out_dict[val.id] = val.value.value()
-        out_list.append(out_dict)
-    return out_list
-
-
-class Forwarder:
-    def __init__(self, msg_src):
-        self._msg_src = msg_src
+    OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest")
+
+    def __init__(self, routes, max_queue=1000, overflow="block",
+            batch_size=100, workers=1):
+        assert overflow in self.OVERFLOW_POLICIES,\
+            "Expecting overflow in %s"%str(self.OVERFLOW_POLICIES)
+        if not isinstance(routes, dict):
+            routes = {None: [routes]}
+        self._table = routes
+        self._decoder = EventDecoder()
+        self._wildcard = routes.get(None, [])
+        self._overflow = overflow
+        self._batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+
+        # counters (events for received/dropped, messages otherwise)
+        self._received = 0
+        self._dropped = 0
         self._msg_count = 0
+        self._filtered = 0
+        self._errors = 0
+
+        self._workers = []
+        for ind in range(workers):
+            worker = threading.Thread(target=self._run)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
 
     def forward(self, data):
-        msg_list = interpret_event(data)
-        for msg in msg_list:
-            # FIXME: this can send messages the waveform is not expecting
-            self._msg_src.sendMessage(msg)
-            self._msg_count += 1
-        return
+        """Subscriber callback, queue the event to be forwarded"""
+        with self._lock:
+            self._received += 1
+        if self._overflow == "block":
+            self._queue.put(data)
+            return
+
+        while True:
+            try:
+                self._queue.put_nowait(data)
+                return
+            except queue.Full:
+                if self._overflow == "drop_newest":
+                    self._count_drop()
+                    return
+            try:
+                # drop_oldest: make room and try again
+                self._queue.get_nowait()
+                self._count_drop()
+            except queue.Empty:
+                pass
+
+    def _count_drop(self):
+        with self._lock:
+            self._dropped += 1
+
+    def _run(self):
+        while True:
+            events = [self._queue.get()]
+            # grab whatever else is already waiting, up to a batch.  Stop
+            # at a _STOP so that each worker takes exactly one of them.
+            while events[-1] is not _STOP and len(events) < self._batch_size:
+                try:
+                    events.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = events[-1] is _STOP
+            if stop:
+                events.pop()
+            self._dispatch(events)
+            if stop:
+                return
 
+    def _dispatch(self, events):
+        """Decode the events and send each message to its destinations"""
+        table = self._table
+        wildcard = self._wildcard
+        decode = self._decoder.decode
+        outgoing = OrderedDict()
+        filtered = 0
+        for data in events:
+            for msg_id, msg in decode(data):
+                dests = table.get(msg_id, wildcard)
+                if not dests:
+                    filtered += 1
+                for dest in dests:
+                    outgoing.setdefault(id(dest), (dest, []))[1].append(
+                        (msg_id, msg))
 
-def forward_event_to_waveform(domain, evt_chan, wave, port, msg_id):
+        if filtered:
+            with self._lock:
+                self._filtered += filtered
+        for dest, msgs in outgoing.values():
+            self._send(dest, msgs)
+
+    def _send(self, dest, msgs):
+        try:
+            if hasattr(dest, "send_batch"):
+                # batch consecutive messages with the same id
+                ind = 0
+                while ind < len(msgs):
+                    msg_id = msgs[ind][0]
+                    end = ind
+                    while end < len(msgs) and end - ind < self._batch_size\
+                            and msgs[end][0] == msg_id:
+                        end += 1
+                    dest.send_batch([msg for _, msg in msgs[ind:end]],
+                        msg_id=msg_id)
+                    ind = end
+            else:
+                for msg_id, msg in msgs:
+                    dest.sendMessage(msg)
+            with self._lock:
+                self._msg_count += len(msgs)
+        except Exception as e:
+            with self._lock:
+                self._errors += 1
+            print("Failed to forward %d messages: %s"%(len(msgs), str(e)))
+
+    def stats(self):
+        """Get the forwarding counters
+
+        Returns
+        -------
+        stats : dict
+            "received" events, "forwarded" messages (counted once per
+            destination), "filtered" messages without a destination,
+            "dropped" events, "errors" (failed sends) and current
+            "queue_depth" (events)
+        """
+        with self._lock:
+            return {
+                "received": self._received,
+                "forwarded": self._msg_count,
+                "filtered": self._filtered,
+                "dropped": self._dropped,
+                "errors": self._errors,
+                "queue_depth": self._queue.qsize(),
+            }
+
+    def close(self):
+        """Forward the queued events and stop the workers"""
+        for worker in self._workers:
+            self._queue.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+
+def forward_routes(domain, routes, max_queue=1000, overflow="block",
+        batch_size=100, workers=1):
+    """Forward messages from event channels to waveform input ports
+
+    Parameters
+    ----------
+    domain : str
+        The name of the active domain.
+
+    routes : list
+        List of route dictionaries with the fields "event_channel",
+        "msg_id" (optional str or list) and "destinations" (list of
+        [waveform, port]).
+
+    max_queue, overflow, batch_size, workers
+        See Forwarder (applied per event channel)
+    """
+    dom = DT.attach(domain)
+
+    # -----------------  one sender per waveform port  ----------------------
+    senders = OrderedDict()
+    channel_routes = OrderedDict()
+    for route in routes:
+        evt_chan = str(route["event_channel"])
+        dests = []
+        for wave, port in route["destinations"]:
+            key = (str(wave), str(port))
+            if key not in senders:
+                wfm = DT.find_waveform_from_domain(domain, key[0])
+                assert wfm is not None, "Cannot find waveform %s"%key[0]
+                senders[key] = MessageSender(port=wfm.getPort(key[1]),
+                    port_name=key[1])
+                senders[key].open()
+            dests.append(senders[key])
+        channel_routes.setdefault(evt_chan, []).append(
+            (route.get("msg_id"), dests))
+
+    # ----------------------  setup to forward messages ---------------------
+    # one forwarder and subscriber per event channel
+    forwarders = OrderedDict()
+    subs = []
+    for evt_chan in channel_routes:
+        forwarders[evt_chan] = Forwarder(
+            build_dispatch_table(channel_routes[evt_chan]),
+            max_queue=max_queue, overflow=overflow,
+            batch_size=batch_size, workers=workers)
+        subs.append(Subscriber(dom, channel_name=evt_chan,
+            dataArrivedCB=forwarders[evt_chan].forward))
+
+    # -----------  run forwarding until user hits enter  --------------------
+    prompt("Hit enter to exit")
+    for sub in subs:
+        sub.terminate()
+    for evt_chan in forwarders:
+        forwarders[evt_chan].close()
+        print("Forwarding stats (%s): %s"%(evt_chan,
+            str(forwarders[evt_chan].stats())))
+    for key in senders:
+        senders[key].close()
+
+def forward_event_to_waveform(domain, evt_chan, wave, port, msg_id,
+        max_queue=1000, overflow="block", batch_size=100, workers=1):
     """Forwards message on an event channel to specified waveform input port
 
+    Only messages with the msg_id are forwarded.
+
     Parameters
     ----------
     domain : str
@@ -95,32 +371,19 @@ def forward_event_to_waveform(domain, evt_chan, wave, port, msg_id):
 
     port : str
         The name of the port on the waveform to forward messages.
-    """
-    # access the event channel and waveform port
-    dom = redhawk.attach(domain)
-    e_chan = DT.find_event_channel_from_domain(domain, evt_chan)
-    wfm = DT.find_waveform_from_domain(domain, wave)
-    port_inst = wfm.getPort(port)
-
-    # setup message source and connect to waveform port
-    # FIXME: there can be multiple messages on an event channnel.
-    #       1) should this filter messages based on this msg id?
-    #       2) Do I need a separate message source per msg_id?
-    msg_src = sb.MessageSource(msg_id)
-    msg_port = msg_src.getPort("msgOut")
-    msg_port.connectPort(port_inst, "conn_" + str(uuid.uuid1()) )
-    msg_src.start()
-
-    # ----------------------  setup to forward messages ---------------------
-    # setup the forwarder
-    f = Forwarder(msg_src)
 
-    # subscribe to channel with the callback in forwarder
-    sub = Subscriber(dom, channel_name=evt_chan, dataArrivedCB=f.forward)
+    msg_id : str
+        The id of the messages to forward
 
-    # -----------  run forwarding until user hits enter  --------------------
-    raw_input("Hit enter to exit")
-    msg_src.releaseObject()
+    max_queue, overflow, batch_size, workers
+        See Forwarder
+    """
+    forward_routes(domain, [{
+            "event_channel": evt_chan,
+            "msg_id": msg_id,
+            "destinations": [[wave, port]],
+        }], max_queue=max_queue, overflow=overflow,
+        batch_size=batch_size, workers=workers)
 
 if __name__ == "__main__":
     # --------------------  parse command-line arguments  -------------------
@@ -128,6 +391,15 @@ if __name__ == "__main__":
     import json
     parser = ArgumentParser(description=__doc__)
     parser.add_argument("json", help="JSon specification")
+    parser.add_argument("--max_queue", default=1000, type=int,
+        help="Maximum number of events waiting to be forwarded")
+    parser.add_argument("--overflow", default="block",
+        choices=Forwarder.OVERFLOW_POLICIES,
+        help="What to do with new events when the queue is full")
+    parser.add_argument("--batch", default=100, type=int,
+        help="Maximum number of messages per push to the waveform")
+    parser.add_argument("--workers", default=1, type=int,
+        help="Number of forwarding threads per event channel")
     args = parser.parse_args()
 
     with open(args.json, "r") as cfg:
@@ -135,15 +407,28 @@ if __name__ == "__main__":
 
         # verify json information
         assert specs.get("domain") is not None, "Expecting a domain field"
-        assert specs.get("event_channel") is not None,\
-            "Expecting an event_channel field"
-        assert specs.get("waveform") is not None, "Expecting a waveform field"
-        assert specs.get("port") is not None, "Expecting a port field"
-        assert specs.get("msg_id") is not None, "Expecting a msg_id field"
+        if specs.get("routes") is None:
+            assert specs.get("event_channel") is not None,\
+                "Expecting an event_channel field"
+            assert specs.get("waveform") is not None,\
+                "Expecting a waveform field"
+            assert specs.get("port") is not None, "Expecting a port field"
+            assert specs.get("msg_id") is not None, "Expecting a msg_id field"
+            specs["routes"] = [{
+                "event_channel": specs["event_channel"],
+                "msg_id": specs["msg_id"],
+                "destinations": [[specs["waveform"], specs["port"]]],
+            }]
+        for route in specs["routes"]:
+            assert route.get("event_channel") is not None,\
+                "Expecting an event_channel field in each route"
+            assert route.get("destinations"),\
+                "Expecting a destinations field in each route"
 
-        forward_event_to_waveform(
+        forward_routes(
             domain=specs["domain"],
-            evt_chan=specs["event_channel"],
-            wave=specs["waveform"],
-            port=specs["port"],
-            msg_id=specs["msg_id"])
\ No newline at end of file
+            routes=specs["routes"],
+            max_queue=args.max_queue,
+            overflow=args.overflow,
+            batch_size=args.batch,
+            workers=args.workers)
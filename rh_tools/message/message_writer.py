@@ -0,0 +1,244 @@
+"""
+Streaming writers for recorded messages.
+
+The recorders in this package historically kept every received message in
+memory until the user ended the capture.  The writers in this module accept
+messages as they arrive, hand them to a background thread through a bounded
+queue and write them to disk immediately.  Memory use is therefore bounded
+by the queue size rather than the length of the capture, and a crash only
+loses what was still queued.
+
+Files can be rotated by size and/or age.  When rotation is enabled, the
+segment number is inserted before the file extension
+(``/tmp/msgs.ndjson`` -> ``/tmp/msgs_0000.ndjson``, ``/tmp/msgs_0001.ndjson``).
+
+Example
+-------
+>>> writer = JsonLinesWriter("/tmp/msgs.ndjson", rotate_bytes=100e6)
+>>> writer.write({"my_msg": {"my_msg::field": 1}})
+>>> writer.close()
+>>> for msg in iter_json_lines(writer.files):
+>>>     print(msg)
+"""
+import json
+import os
+import sys
+import threading
+import time
+if sys.version_info.major == 2:
+    import Queue as queue
+else:
+    import queue
+
+# sentinel placed on the queue to stop the writer thread
+_STOP = object()
+
+def segment_filename(filename, segment):
+    """Insert the segment number before the file extension
+
+    Parameters
+    ----------
+    filename : str
+        The base filename (i.e. "/tmp/msgs.ndjson")
+
+    segment : int
+        The segment number
+
+    Returns
+    -------
+    out : str
+        The filename of the segment (i.e. "/tmp/msgs_0003.ndjson")
+    """
+    base, ext = os.path.splitext(filename)
+    return "%s_%04d%s"%(base, segment, ext)
+
+class StreamingMessageWriter(object):
+    """Write messages from a background thread
+
+    Subclasses implement the file format by overriding ``_open_file``,
+    ``_write_message`` and ``_close_file``.  This class handles the queue,
+    the writer thread, periodic fsync and file rotation.
+
+    Parameters
+    ----------
+    filename : str
+        The output file.  If rotation is enabled, this is the base name of
+        the segments.
+
+    max_queue : int
+        The maximum number of messages waiting to be written.
+
+    block : bool
+        If True, ``write`` blocks when the queue is full.  Otherwise the
+        message is dropped and counted in ``dropped``.
+
+    fsync_interval : float
+        Seconds between fsync calls on the output file.  0 disables fsync
+        (data is still flushed to the OS after every message).
+
+    rotate_bytes : int
+        Start a new file once the current file reaches this size.
+        0 disables size based rotation.
+
+    rotate_seconds : float
+        Start a new file once the current file is this old.
+        0 disables time based rotation.
+    """
+    def __init__(self, filename, max_queue=10000, block=True,
+            fsync_interval=1.0, rotate_bytes=0, rotate_seconds=0):
+        self.filename = filename
+        self.block = block
+        self.fsync_interval = fsync_interval
+        self.rotate_bytes = int(rotate_bytes)
+        self.rotate_seconds = rotate_seconds
+
+        self.files = []
+        self.written = 0
+        self.dropped = 0
+        self.error = None
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._fid = None
+        self._segment = 0
+        self._opened_at = 0
+        self._last_sync = 0
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    # --------------------------  public interface  -------------------------
+    def write(self, msg):
+        """Queue a message to be written
+
+        Parameters
+        ----------
+        msg : dict
+            The message (i.e. from ossie.properties.prop_to_dict)
+
+        Returns
+        -------
+        queued : bool
+            False if the message was dropped because the queue is full
+        """
+        try:
+            self._queue.put(msg, block=self.block)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self):
+        """Write the remaining messages and close the output file"""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    @property
+    def queue_depth(self):
+        """The number of messages waiting to be written"""
+        return self._queue.qsize()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # ---------------------------  writer thread  ---------------------------
+    def _run(self):
+        try:
+            while True:
+                msg = self._queue.get()
+                if msg is _STOP:
+                    break
+                if self._fid is None or self._needs_rotation():
+                    self._rotate()
+                self._write_message(self._fid, msg)
+                self.written += 1
+                self._sync()
+        except Exception as e:
+            # keep the exception for the caller, but do not hang producers
+            self.error = e
+            print("Message writer for %s failed: %s"%(self.filename, str(e)))
+            self.block = False
+        finally:
+            self._finish()
+
+    def _needs_rotation(self):
+        if self.rotate_bytes and self._fid.tell() >= self.rotate_bytes:
+            return True
+        if self.rotate_seconds and\
+                time.time() - self._opened_at >= self.rotate_seconds:
+            return True
+        return False
+
+    def _rotate(self):
+        self._finish()
+        if self.rotate_bytes or self.rotate_seconds:
+            filename = segment_filename(self.filename, self._segment)
+        else:
+            filename = self.filename
+        self._segment += 1
+
+        self._fid = self._open_file(filename)
+        self.files.append(filename)
+        self._opened_at = time.time()
+        self._last_sync = self._opened_at
+
+    def _sync(self):
+        self._fid.flush()
+        if self.fsync_interval:
+            now = time.time()
+            if now - self._last_sync >= self.fsync_interval:
+                os.fsync(self._fid.fileno())
+                self._last_sync = now
+
+    def _finish(self):
+        if self._fid is not None:
+            self._close_file(self._fid)
+            self._fid.flush()
+            os.fsync(self._fid.fileno())
+            self._fid.close()
+            self._fid = None
+
+    # ------------------------  format specific hooks  ----------------------
+    def _open_file(self, filename):
+        raise NotImplementedError("_open_file")
+
+    def _write_message(self, fid, msg):
+        raise NotImplementedError("_write_message")
+
+    def _close_file(self, fid):
+        pass
+
+class JsonLinesWriter(StreamingMessageWriter):
+    """Write one JSON encoded message per line (newline-delimited JSON)"""
+    def _open_file(self, filename):
+        return open(filename, "w")
+
+    def _write_message(self, fid, msg):
+        fid.write(json.dumps(msg, default=str))
+        fid.write("\n")
+
+def iter_json_lines(filenames):
+    """Iterate over the messages in newline-delimited JSON files
+
+    Parameters
+    ----------
+    filenames : str or list
+        The file (or the list of rotated segments) to read from
+
+    Returns
+    -------
+    msgs : generator
+        Generator of the decoded messages in file order
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    for filename in filenames:
+        with open(filename, "r") as fid:
+            for line in fid:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
@@ -8,6 +8,12 @@ The recorded messages are stored in a dictionary with the
 waveform:port name as the keys.  This is serialized into a
 pickle file for further analysis.
 
+For long captures, use the ``--stream`` option.  Each message is then
+written to a newline-delimited JSON file (one per port) as it arrives,
+so memory use does not grow with the length of the capture.
+Adding ``--columnar`` stores the streamed messages in a columnar NumPy
+archive per port instead (see rh_tools.message.columnar).
+
 Example
 -------
 Example JSON file.  This module is only looking for message out ports.
@@ -24,9 +30,15 @@ Example JSON file.  This module is only looking for message out ports.
 import bulkio
 from ossie import properties
 from ossie.utils import redhawk, sb
+from ossie.events import Subscriber
+from rh_tools.domain import domain_tools
 from rh_tools.domain.domain_tools import find_waveform
+from rh_tools.message.message_writer import JsonLinesWriter
+from collections import OrderedDict
 import uuid
+import os
 import sys
+import threading
 import time
 if sys.version_info.major == 2:
     prompt = raw_input
@@ -34,8 +46,20 @@ else:
     prompt = input
 
 class MessageRecorder(object):
-    def __init__(self, name="received"):
+    """Record messages received by a message sink
+
+    Parameters
+    ----------
+    name : str
+        Name used for the timestamp fields added to each message
+
+    writer : StreamingMessageWriter or None
+        If specified, messages are handed to the writer as they arrive
+        instead of being stored in memory.
+    """
+    def __init__(self, name="received", writer=None):
         self.name = name
+        self.writer = writer
         self._msg_queue = []
         self._num_messages = 0
 
@@ -63,7 +87,10 @@ class MessageRecorder(object):
         prop[id]["%s::%s_tfsec"%(id, self.name)] = c_now.tfsec
 
         # -------------------------  store in queue  ------------------------
-        self._msg_queue.append(prop)
+        if self.writer is not None:
+            self.writer.write(prop)
+        else:
+            self._msg_queue.append(prop)
         self._num_messages += 1
 
     def getMessages(self):
@@ -82,9 +109,63 @@ class MessageRecorder(object):
         self._msg_queue = []
         return msgs
 
-def listen_waveform_ports(domain, waveform_ports):
+def connect_recorder(c_wave, c_port, key, writer_factory=None):
+    """Connect a message sink and recorder to a waveform output port
+
+    Parameters
+    ----------
+    c_wave : ossie.utils.redhawk.core.App
+        The waveform
+
+    c_port : str
+        The name of the message output port
+
+    key : str
+        The waveform + port name key
+
+    writer_factory : callable or None
+        See listen_waveform_ports
+
+    Returns
+    -------
+    msg_sink : sb.MessageSink
+
+    msg_record : MessageRecorder
+    """
+    # get the port of interest
+    port_inst = c_wave.getPort(c_port)
+
+    # ---------------  connect to message sink  -----------------------------
+    writer = None
+    if writer_factory is not None:
+        writer = writer_factory(key)
+    msg_record = MessageRecorder(writer=writer)
+    try:
+        # a streaming writer owns the messages, the sink must not keep them
+        msg_sink = sb.MessageSink(
+            messageCallback=msg_record.msgCallback,
+            storeMessages=writer is None
+        )
+        port_inst.connectPort(\
+            msg_sink.getPort("msgIn"),
+            "conn_"+ str(uuid.uuid1()))
+        msg_sink.start()
+    except:
+        if writer is not None:
+            writer.close()
+        raise
+    return msg_sink, msg_record
+
+def listen_waveform_ports(domain, waveform_ports, writer_factory=None,
+        timeout=None, max_interval=2.):
     """Listen to message events on specific waveform ports on domain
 
+    Ports are connected as soon as their waveform appears on the domain.
+    The domain's ODM channel is subscribed to, so a new application
+    triggers a connection attempt right away.  Otherwise the application
+    list is checked again with exponential backoff (0.1 sec doubling up to
+    max_interval).
+
     Parameters
     ----------
     domain : str
@@ -94,6 +175,22 @@ def listen_waveform_ports(domain, waveform_ports):
         This will be a list of ports.  Each tuple is a combination of
         (WAVEFORM_NAME, PORT_NAME)
 
+    writer_factory : callable or None
+        If specified, called with the waveform + port name key to create
+        a StreamingMessageWriter for that port.  Messages are then written
+        as they arrive and the returned lists will be empty.  The writers
+        are closed before returning.
+
+    timeout : float or None
+        Seconds to wait for each port to connect.  Each port has its own
+        deadline, counted from the start and again from when its waveform
+        first appears, so ports of late or slow waveforms do not shorten
+        the wait of the others.  Recording starts with the ports connected
+        so far once every remaining port timed out.  None waits forever.
+
+    max_interval : float
+        Maximum seconds between checks of the application list
+
     Returns
     -------
     my_msgs : dict
@@ -101,60 +198,103 @@ def listen_waveform_ports(domain, waveform_ports):
         The value will be the recorded messages.
     """
     # --------------  connect  ----------------------------------------------
-    dom = redhawk.attach(domain)
+    dom = domain_tools.attach(domain)
+
+    # wake up the connection loop when the domain reports a change
+    changed = threading.Event()
+    try:
+        odm_sub = Subscriber(dom, channel_name="ODM_Channel",
+            dataArrivedCB=lambda data: changed.set())
+    except Exception as e:
+        print("Cannot subscribe to ODM_Channel, polling only (%s)"%str(e))
+        odm_sub = None
 
     # ------------------------  prepare variables  --------------------------
     my_msg_sinks = {}
     my_msgs = {}
     my_msg_recorder = {}
-    waveform_ports_connected = 0
-    print_decimation = 0
-    PRINT_EVERY_NTH_LOOP = 20
-
-    while waveform_ports_connected < len(waveform_ports):
-        if print_decimation == 0:
-            print("Connecting ports ({} of {} complete) ...".format(waveform_ports_connected, len(waveform_ports)))
-        print_decimation = (print_decimation + 1) % PRINT_EVERY_NTH_LOOP
+    pending = OrderedDict()
+    for (c_name, c_port) in waveform_ports:
+        # enforce strings
+        pending[str(c_name) + ":" + str(c_port)] = (str(c_name), str(c_port))
+    failures = OrderedDict()
+    last_error = {}
+    # per port deadline, reset when its waveform first appears
+    deadlines = {}
+    if timeout is not None:
+        deadlines = dict((key, time.time() + timeout) for key in pending)
+    seen = set()
+    interval = 0.1
+
+    while pending:
+        print("Connecting ports ({} of {} complete) ...".format(
+            len(my_msg_sinks), len(waveform_ports)))
 
         # --------------  get applications  ---------------------------------
-        waveforms = dom.applications
+        changed.clear()
+        try:
+            waveforms = dom.applications
+        except Exception as e:
+            waveforms = []
+            print("Failed to list applications: %s"%str(e))
 
         # add a message sink per port
-        for (c_name, c_port) in waveform_ports:
-            # enforce strings
-            c_name = str(c_name)
-            c_port = str(c_port)
-            waveform_port_key = c_name + ":" + c_port
-
-            if not waveform_port_key in my_msg_sinks:
-                # select waveform from the list
-                c_wave = find_waveform(waveforms, c_name)
-
-                try:
-                    # get the port of interest
-                    port_inst = c_wave.getPort(c_port)
-
-                    # ---------------  connect to message sink  ---------------------
-                    msg_record = MessageRecorder()
-                    msg_sink = sb.MessageSink(
-                        messageCallback=msg_record.msgCallback,
-                        storeMessages=True
-                    )
-                    port_inst.connectPort(\
-                        msg_sink.getPort("msgIn"),
-                        "conn_"+ str(uuid.uuid1()))
-                    msg_sink.start()
-
-                    # track sink
-                    my_msg_sinks[waveform_port_key] = msg_sink
-                    my_msg_recorder[waveform_port_key] = msg_record
-                    print("Connected Waveform Name = {}, Port Name = {}".format(str(c_name), str(c_port)))
-                    waveform_ports_connected = waveform_ports_connected + 1
-                except:
-                    pass
-
-        # Wait for a tenth of a second before trying again
-        time.sleep(0.1)
+        for waveform_port_key in list(pending.keys()):
+            c_name, c_port = pending[waveform_port_key]
+
+            # select waveform from the list
+            c_wave = find_waveform(waveforms, c_name)
+            if c_wave is None:
+                last_error[waveform_port_key] = "waveform not found"
+                continue
+            if waveform_port_key not in seen:
+                seen.add(waveform_port_key)
+                if timeout is not None:
+                    deadlines[waveform_port_key] = time.time() + timeout
+
+            try:
+                msg_sink, msg_record = connect_recorder(c_wave, c_port,
+                    waveform_port_key, writer_factory)
+            except Exception as e:
+                last_error[waveform_port_key] = str(e)
+                continue
+
+            # track sink
+            my_msg_sinks[waveform_port_key] = msg_sink
+            my_msg_recorder[waveform_port_key] = msg_record
+            pending.pop(waveform_port_key)
+            print("Connected Waveform Name = {}, Port Name = {}".format(
+                c_name, c_port))
+
+        # ---------------------  give up on late ports  ---------------------
+        now = time.time()
+        if timeout is not None:
+            for waveform_port_key in list(pending.keys()):
+                if now >= deadlines[waveform_port_key]:
+                    failures[waveform_port_key] = last_error.get(
+                        waveform_port_key, "timed out")
+                    pending.pop(waveform_port_key)
+
+        if pending:
+            # wait for a domain event, or back off (up to the next deadline)
+            wait = interval
+            if timeout is not None:
+                wait = max(0, min([wait] + [deadlines[key] - now
+                    for key in pending]))
+            if changed.wait(wait):
+                interval = 0.1
+            else:
+                interval = min(2 * interval, max_interval)
+
+    if odm_sub is not None:
+        odm_sub.terminate()
+
+    # ----------------------  report missing ports  -------------------------
+    if failures:
+        print("Ports not connected (%.1f sec timeout per port):"%timeout)
+        for waveform_port_key in failures:
+            print("    %s (%s)"%(waveform_port_key,
+                failures[waveform_port_key]))
 
     # -----------------------  user prompt to end  --------------------------
     if len(my_msg_sinks) > 0:
@@ -171,8 +311,34 @@ def listen_waveform_ports(domain, waveform_ports):
             my_msg_sinks[key].releaseObject()
         except Exception as e:
             print("Failed to release msg sink: %s"%str(e))
+
+        # flush any streamed messages
+        writer = my_msg_recorder[key].writer
+        if writer is not None:
+            writer.close()
+            print("%s: wrote %d messages (%d dropped) to %s"%(key,
+                writer.written, writer.dropped, ", ".join(writer.files)))
     return my_msgs
 
+def port_filename(filename, key):
+    """Create the per-port output file name
+
+    Parameters
+    ----------
+    filename : str
+        The output file specified by the user (i.e. "/tmp/msgs.ndjson")
+
+    key : str
+        The waveform + port name key (i.e. "Waveform1:port_a")
+
+    Returns
+    -------
+    out : str
+        The file name for the port (i.e. "/tmp/msgs_Waveform1_port_a.ndjson")
+    """
+    base, ext = os.path.splitext(filename)
+    return "%s_%s%s"%(base, key.replace(":", "_").replace("/", "_"), ext)
+
 if __name__ == "__main__":
     # --------------------  parse command-line arguments  -------------------
     from argparse import ArgumentParser
@@ -191,8 +357,40 @@ if __name__ == "__main__":
         help="output file to save messages")
     parser.add_argument("--pickle", action="store_true",
         help="Output the data in pickle format instead of json")
+    parser.add_argument("--timeout", default=None, type=float,
+        help="Seconds to wait for each port to connect (default forever)")
+    parser.add_argument("--stream", action="store_true",
+        help="Write messages as they arrive to newline-delimited JSON "+\
+            "files (one per port) instead of keeping them in memory")
+    parser.add_argument("--queue_size", default=10000, type=int,
+        help="Number of messages buffered per port when streaming")
+    parser.add_argument("--fsync", default=1.0, type=float,
+        help="Seconds between fsync calls when streaming (0 disables)")
+    parser.add_argument("--rotate_mb", default=0, type=float,
+        help="Rotate stream files after this many megabytes (0 disables)")
+    parser.add_argument("--rotate_sec", default=0, type=float,
+        help="Rotate stream files after this many seconds (0 disables)")
+    parser.add_argument("--columnar", action="store_true",
+        help="Stream to columnar .npz archives instead of JSON lines")
+    parser.add_argument("--batch", default=10000, type=int,
+        help="Messages per row group of the columnar archives")
     args = parser.parse_args()
 
+    writer_factory = None
+    if args.stream or args.columnar:
+        args.stream = True
+        def writer_factory(key):
+            kwargs = dict(max_queue=args.queue_size,
+                fsync_interval=args.fsync,
+                rotate_bytes=args.rotate_mb * 1e6,
+                rotate_seconds=args.rotate_sec)
+            if args.columnar:
+                from rh_tools.message.columnar import ColumnarMessageWriter
+                return ColumnarMessageWriter(
+                    port_filename(args.output, key),
+                    batch_size=args.batch, **kwargs)
+            return JsonLinesWriter(port_filename(args.output, key), **kwargs)
+
     # -----------------------  begin processing  ----------------------------
     with open(args.json, "r") as cfg:
         specs = json.load(cfg)
@@ -202,10 +400,11 @@ if __name__ == "__main__":
         assert specs.get("ports") is not None, "Expecting a ports field"
 
         # listen to messages
-        msgs = listen_waveform_ports(specs["domain"], specs["ports"])
+        msgs = listen_waveform_ports(specs["domain"], specs["ports"],
+            writer_factory=writer_factory, timeout=args.timeout)
 
         # record message to file for further analysis
-        if msgs and args.output:
+        if msgs and args.output and not args.stream:
             if args.pickle:
                 import pickle
                 pickle.dump(msgs, open(args.output, "w"))
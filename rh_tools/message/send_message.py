@@ -1,7 +1,255 @@
+"""
+Send messages to a waveform input message port or an event channel.
+
+``send_message`` sends a single message over a short lived connection.
+To inject traffic at a meaningful rate, use a ``MessageSender``.  It keeps
+the connection to the waveform port open, ``send_many`` packs several
+messages into a single CORBA push and ``replay`` sends a list of messages
+at a target rate.
+
+Event channel publishers are pooled per (domain, event_channel) and reused
+by ``publish_to_event_channel`` and ``publish_many``.
+
+Example
+-------
+>>> with MessageSender("my_waveform", "message_in", msg_id="my_msg") as snd:
+>>>     snd.send_many(msgs, batch_size=50)
+>>>     stats = snd.replay(msgs, rate=1000.)
+>>> print("%(rate).1f msgs/sec"%stats)
+"""
 from ossie.utils import sb, redhawk
 from ossie.events import Subscriber, Publisher
+from ossie import properties
+from ossie.cf import CF
+from omniORB import CORBA
+from rh_tools.domain import domain_tools
 from rh_tools.domain.domain_tools import find_waveform_from_domain
+from rh_tools.scene.utils import summarize
+import atexit
+import itertools
+import threading
+import time
 import uuid
+try:
+    from omniORB.COS import CosEventChannelAdmin
+except ImportError:
+    import CosEventChannelAdmin
+
+# publishers keyed by (domain, event_channel), see get_publisher
+_PUBLISHERS = {}
+_PUBLISHERS_LOCK = threading.Lock()
+
+def messages_to_any(msgs, msg_id):
+    """Encode messages into a single message event
+
+    A message event is a CF.Properties where each entry is one message:
+    the id is the message id and the value holds the message fields.
+    This is the structure decoded by interpret_event.
+
+    Parameters
+    ----------
+    msgs : list
+        List of messages.  Each message is a dict of field id to value.
+
+    msg_id : str
+        The id of the messages.
+
+    Returns
+    -------
+    event : CORBA.Any
+    """
+    return CORBA.Any(CF._tc_Properties, [
+        CF.DataType(id=msg_id, value=CORBA.Any(CF._tc_Properties,
+            properties.props_from_dict(msg)))
+        for msg in msgs])
+
+def batches(msgs, batch_size):
+    """Split an iterable of messages into lists of batch_size"""
+    msgs = iter(msgs)
+    while True:
+        batch = list(itertools.islice(msgs, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def paced_send(send, msgs, rate=0, batch_size=1):
+    """Send messages in batches at a target rate
+
+    Batch k is sent no earlier than k * batch_size / rate seconds after
+    the first one, so short delays do not accumulate.
+
+    Parameters
+    ----------
+    send : callable
+        Called with each batch (list of messages).
+
+    msgs : iterable
+        The messages to send
+
+    rate : float
+        Target messages per second.  0 sends as fast as possible.
+
+    batch_size : int
+        Number of messages per call to send.
+
+    Returns
+    -------
+    stats : dict
+        "messages" sent, "batches", "elapsed" seconds, achieved "rate"
+        (messages per second) and per batch "latency" summary (seconds
+        spent in send: "min", "mean", "max", "p95").
+    """
+    latencies = []
+    count = 0
+    tic = time.time()
+    for batch in batches(msgs, batch_size):
+        if rate:
+            delay = tic + count / float(rate) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        t_send = time.time()
+        send(batch)
+        latencies.append(time.time() - t_send)
+        count += len(batch)
+    elapsed = time.time() - tic
+
+    stats = {
+        "messages": count,
+        "batches": len(latencies),
+        "elapsed": elapsed,
+        "rate": count / elapsed if elapsed > 0 else 0.,
+    }
+    stats["latency"] = summarize(latencies)
+    return stats
+
+class MessageSender(object):
+    """Persistent connection to a waveform input message port
+
+    Parameters
+    ----------
+    wvfm : str
+        The name of the waveform to connect to.
+
+    port_name : str
+        The name of the port (on the specified wvfm)
+
+    domain : str
+        Name of the domain to attach and search for the waveform.
+
+    msg_id : str
+        The id of the messages.
+
+    port : CORBA object or None
+        If specified, connect to this port instead of looking up
+        wvfm/port_name on the domain.
+    """
+    def __init__(self, wvfm=None, port_name=None, domain="REDHAWK_DEV",
+            msg_id="default", port=None):
+        self.wvfm = wvfm
+        self.port_name = port_name
+        self.domain = domain
+        self.msg_id = msg_id
+        self.sent = 0
+        self._port = port
+        self._consumer = None
+
+    def open(self):
+        """Connect to the waveform port
+
+        Raises
+        ------
+        RuntimeWarning  If the waveform is not on the domain
+        """
+        if self._consumer is not None:
+            return
+        if self._port is None:
+            wvfm = find_waveform_from_domain(self.domain, self.wvfm)
+            if not wvfm:
+                raise RuntimeWarning("Cannot find waveform on domain")
+            self._port = wvfm.getPort(self.port_name)
+
+        # a message input port is an event channel, push to it directly
+        channel = self._port._narrow(CosEventChannelAdmin.EventChannel)
+        self._consumer = channel.for_suppliers().obtain_push_consumer()
+        self._consumer.connect_push_supplier(None)
+
+    def close(self):
+        """Disconnect from the waveform port"""
+        if self._consumer is not None:
+            try:
+                self._consumer.disconnect_push_consumer()
+            except CORBA.Exception as e:
+                print("Failed to disconnect from %s: %s"%(
+                    str(self.port_name), str(e)))
+            self._consumer = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def send(self, msg):
+        """Send a single message
+
+        Parameters
+        ----------
+        msg : dict
+            The message to transmit
+        """
+        self.send_batch([msg])
+
+    def send_batch(self, msgs, msg_id=None):
+        """Send a list of messages in a single push
+
+        Parameters
+        ----------
+        msgs : list
+            The messages to transmit
+
+        msg_id : str or None
+            The id of the messages, if different from the sender msg_id
+        """
+        if self._consumer is None:
+            self.open()
+        self._consumer.push(messages_to_any(msgs, msg_id or self.msg_id))
+        self.sent += len(msgs)
+
+    def send_many(self, msgs, batch_size=100):
+        """Send messages, batch_size messages per push
+
+        Parameters
+        ----------
+        msgs : iterable
+            The messages to transmit
+
+        batch_size : int
+            Number of messages packed into each push
+        """
+        for batch in batches(msgs, batch_size):
+            self.send_batch(batch)
+
+    def replay(self, msgs, rate=0, batch_size=1):
+        """Send messages at a target rate
+
+        Parameters
+        ----------
+        msgs : iterable
+            The messages to transmit
+
+        rate : float
+            Target messages per second.  0 sends as fast as possible.
+
+        batch_size : int
+            Number of messages packed into each push
+
+        Returns
+        -------
+        stats : dict
+            See paced_send
+        """
+        return paced_send(self.send_batch, msgs, rate, batch_size)
 
 def send_message(msg, wvfm, port_name, domain="REDHAWK_DEV", msg_id="default"):
     """Connect to waveform message in port and send message
@@ -10,6 +258,8 @@ def send_message(msg, wvfm, port_name, domain="REDHAWK_DEV", msg_id="default"):
     2. Searches for wavefor and gets input message port.
     3. Send message
 
+    Use a MessageSender to send more than one message.
+
     Parameters
     ----------
     msg : dict
@@ -27,19 +277,45 @@ def send_message(msg, wvfm, port_name, domain="REDHAWK_DEV", msg_id="default"):
     msg_id : str
         The id of the message.
     """
-    wvfm = find_waveform_from_domain(domain, wvfm)
-    if wvfm:
-        port = wvfm.getPort(port_name)
-        msg_src = sb.MessageSource(msg_id)
-        msg_port = msg_src.getPort("msgOut")
-        #msg_port.connectPort(port, "conn_" + str(uuid.uuid1()))
-        msg_src.connectPort(port, "conn_" + str(uuid.uuid1()))
-        msg_src.start()
-        msg_src.sendMessage(msg)
-        msg_src.releaseObject()
-    else:
-        raise RuntimeWarning("Cannot find waveform on domain")
+    with MessageSender(wvfm, port_name, domain=domain, msg_id=msg_id) as snd:
+        snd.send(msg)
+
+
+def get_publisher(event_channel, domain="REDHAWK_DEV"):
+    """Get the pooled publisher for an event channel
+
+    Publishers are created once per (domain, event_channel) and reused
+    until release_publishers is called.
 
+    Parameters
+    ----------
+    event_channel : str
+        The event channel to publish
+
+    domain : str
+        The name of domain to seek the event channel
+
+    Returns
+    -------
+    pub : ossie.events.Publisher
+    """
+    key = (domain, event_channel)
+    with _PUBLISHERS_LOCK:
+        pub = _PUBLISHERS.get(key)
+        if pub is None:
+            dom = domain_tools.attach(domain)
+            pub = _PUBLISHERS[key] = Publisher(dom, event_channel)
+    return pub
+
+def release_publishers():
+    """Disconnect and forget every pooled publisher"""
+    with _PUBLISHERS_LOCK:
+        for key in list(_PUBLISHERS.keys()):
+            try:
+                _PUBLISHERS.pop(key).terminate()
+            except Exception as e:
+                print("Failed to release publisher %s: %s"%(str(key), str(e)))
+atexit.register(release_publishers)
 
 def publish_to_event_channel(msg, event_channel, domain="REDHAWK_DEV"):
     """Publish message to the event channel
@@ -55,13 +331,74 @@ def publish_to_event_channel(msg, event_channel, domain="REDHAWK_DEV"):
     domain : str
         The name of domain to seek the event channel
     """
-    try:
-        dom = redhawk.attach(domain)
-        pub = Publisher(dom, event_channel)
+    get_publisher(event_channel, domain).push(msg)
+
+def publish_batch(msgs, event_channel, domain="REDHAWK_DEV", msg_id=None):
+    """Publish a list of messages to the event channel
+
+    Parameters
+    ----------
+    msgs : list
+        Messages to publish
+
+    event_channel : str
+        The event channel to publish
+
+    domain : str
+        The name of domain to seek the event channel
+
+    msg_id : str or None
+        If specified, the messages are message structures with this id
+        and are coalesced into a single push (see messages_to_any).
+        Otherwise each message is pushed on its own.
+    """
+    pub = get_publisher(event_channel, domain)
+    if msg_id:
+        pub.push(messages_to_any(msgs, msg_id))
+    else:
+        for msg in msgs:
+            pub.push(msg)
+
+def publish_many(msgs, event_channel, domain="REDHAWK_DEV", msg_id=None,
+        rate=0, batch_size=100):
+    """Publish messages to the event channel at a target rate
+
+    Parameters
+    ----------
+    msgs : iterable
+        Messages to publish
+
+    event_channel : str
+        The event channel to publish
+
+    domain : str
+        The name of domain to seek the event channel
+
+    msg_id : str or None
+        See publish_batch
+
+    rate : float
+        Target messages per second.  0 sends as fast as possible.
+
+    batch_size : int
+        Number of messages per call to publish_batch
+
+    Returns
+    -------
+    stats : dict
+        See paced_send
+    """
+    return paced_send(
+        lambda batch: publish_batch(batch, event_channel, domain, msg_id),
+        msgs, rate, batch_size)
 
-        pub.push(msg)
-    except:
-        raise
+def print_stats(stats):
+    """Print the statistics returned by paced_send"""
+    print("Sent %d messages in %d pushes over %.3f sec (%.1f msgs/sec)"%(
+        stats["messages"], stats["batches"], stats["elapsed"], stats["rate"]))
+    latency = dict((key, 1e3 * val) for key, val in stats["latency"].items())
+    print("Push latency (ms): min %(min).3f, mean %(mean).3f, "\
+        "max %(max).3f, p95 %(p95).3f"%latency)
 
 if __name__ == "__main__":
     from argparse import ArgumentParser
@@ -77,17 +414,48 @@ if __name__ == "__main__":
         help="Event channel to publish")
     parser.add_argument("--msg_id", default="def_msg",
         help="The id of the message")
+    parser.add_argument("--replay", action="store_true",
+        help="The json/yaml file holds a list of messages to send")
+    parser.add_argument("--rate", default=0, type=float,
+        help="Messages per second when replaying (0 is as fast as possible)")
+    parser.add_argument("--batch", default=1, type=int,
+        help="Messages per push when replaying")
+    parser.add_argument("--repeat", default=1, type=int,
+        help="Number of times to replay the list of messages")
+    parser.add_argument("--coalesce", action="store_true",
+        help="When replaying to an event channel, push each batch as one"+\
+            " message event with --msg_id instead of one push per message")
     args = parser.parse_args()
 
     # load message from json
     # NOTE: using yaml to avoid utf strings
     msg = yaml.safe_load(open(args.json, "r"))
 
+    # messages to replay
+    if args.replay:
+        msgs = itertools.chain.from_iterable([msg] * args.repeat)
+        print("Replay %d messages"%(len(msg) * args.repeat))
+        if args.evt_chan and args.waveform and args.port:
+            # the iterator can only be consumed once
+            msgs = list(msgs)
+
     if args.evt_chan:
         print("Publish to event channel %s"%args.evt_chan)
-        publish_to_event_channel(msg, args.evt_chan, args.domain)
+        if args.replay:
+            print_stats(publish_many(msgs, args.evt_chan, args.domain,
+                msg_id=args.msg_id if args.coalesce else None,
+                rate=args.rate, batch_size=args.batch))
+        else:
+            publish_to_event_channel(msg, args.evt_chan, args.domain)
 
     if args.waveform and args.port:
-        print("Push message to specified waveform/port")
-        send_message(msg, wvfm=args.waveform, port_name=args.port,
-            domain=args.domain, msg_id=args.msg_id)
\ No newline at end of file
+        if args.replay:
+            print("Replay to specified waveform/port")
+            with MessageSender(args.waveform, args.port, domain=args.domain,
+                    msg_id=args.msg_id) as sender:
+                print_stats(sender.replay(msgs,
+                    rate=args.rate, batch_size=args.batch))
+        else:
+            print("Push message to specified waveform/port")
+            send_message(msg, wvfm=args.waveform, port_name=args.port,
+                domain=args.domain, msg_id=args.msg_id)
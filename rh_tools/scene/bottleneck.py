@@ -0,0 +1,250 @@
+"""
+Find the throughput bottleneck of a scene from its connections.
+
+Every connection ``[uses_id, uses_port, provides_id, provides_port]`` is
+tapped on both ends: the uses port reports the elements per second sent
+on the connection, the provides port reports the average depth of its
+input queue.  For each instance:
+
+* the input rate is the sum of the rates of the connections into it,
+* the output rate is the sum of the rates of the connections out of it,
+* the queue trend is the slope (per second) of the queue depth of its
+  input ports over the last samples.
+
+An instance is flagged when its input queue keeps growing, or when its
+input rate exceeds its output rate by more than ratio_threshold.  The
+ratio alone is only a hint: a decimating component legitimately outputs
+fewer elements than it receives.
+"""
+from collections import OrderedDict
+import sys
+from rh_tools.scene.connection_graph import topological_layers
+from rh_tools.scene.throughput_helper import ThroughputMonitor, STAT_FIELDS
+from rh_tools.scene.utils import get_instance
+from rh_tools.scene.wiring import is_connection_id
+
+EPS = STAT_FIELDS.index("elementsPerSecond") + 1
+QUEUE_DEPTH = STAT_FIELDS.index("averageQueueDepth") + 1
+
+def trend(samples, column):
+    """Least squares slope of a column of samples over time
+
+    Parameters
+    ----------
+    samples : list
+        Rows of (time, values...)
+
+    column : int
+        Index of the value in a row
+
+    Returns
+    -------
+    slope : float
+        Change per second, 0 with less than 2 samples
+    """
+    if len(samples) < 2:
+        return 0.
+    times = [row[0] for row in samples]
+    values = [row[column] for row in samples]
+    mean_t = sum(times) / float(len(times))
+    mean_v = sum(values) / float(len(values))
+    den = sum((t - mean_t) ** 2 for t in times)
+    if den == 0:
+        return 0.
+    return sum((t - mean_t) * (v - mean_v)
+        for t, v in zip(times, values)) / den
+
+class BottleneckMonitor(object):
+    """Tap every connection of a scene and rank the instances
+
+    Parameters
+    ----------
+    connections : list
+        The scene connections
+
+    comp_dict : OrderedDict
+        The component instances
+
+    wfm_dict : OrderedDict
+        The waveform instances
+
+    history : int
+        Number of samples kept per port
+
+    workers : int
+        Number of ports read at the same time
+
+    window : int
+        Number of samples used for the queue depth trend
+
+    ratio_threshold : float
+        Flag instances whose input rate is this many times the output rate
+
+    port_index : PortIndex or None
+        If specified, the ports are looked up in the shared index
+
+    conn_ids : OrderedDict or None
+        The connection ids of the connections (see wiring.wire_scene).  If
+        None, the ids generated by wiring.connection_id are recognized.
+    """
+    def __init__(self, connections, comp_dict, wfm_dict, history=600,
+            workers=1, window=10, ratio_threshold=2., port_index=None,
+            conn_ids=None):
+        self.window = window
+        self.ratio_threshold = ratio_threshold
+        self.edges = []
+        # connection -> its connection ids
+        edge_ids = None
+        if conn_ids is not None:
+            edge_ids = {}
+            for conn_id, conn in conn_ids.items():
+                edge_ids.setdefault(tuple(str(val) for val in conn[:4]),
+                    set()).add(str(conn_id))
+        ports = OrderedDict()
+        for conn in connections:
+            src, src_port, dst, dst_port = [str(val) for val in conn[:4]]
+            uses_key = "%s:%s"%(src, src_port)
+            provides_key = "%s:%s"%(dst, dst_port)
+            try:
+                for key, unique_id, port_name in [
+                        (uses_key, src, src_port),
+                        (provides_key, dst, dst_port)]:
+                    if key not in ports:
+                        if port_index is not None:
+                            port_inst = port_index.port(unique_id, port_name)
+                        else:
+                            port_inst = get_instance(unique_id, comp_dict,
+                                wfm_dict).getPort(port_name)
+                        if port_inst is None:
+                            raise ValueError("no port %s"%key)
+                        ports[key] = {
+                            "object": unique_id,
+                            "port": port_name,
+                            "instance": port_inst,
+                            "out": sys.stdout,
+                        }
+            except Exception as e:
+                print("Cannot tap connection %s: %s"%(str(conn), str(e)))
+                continue
+            self.edges.append({"src": src, "dst": dst, "uses": uses_key,
+                "provides": provides_key, "conn": (src, src_port, dst,
+                dst_port), "conn_ids": None if edge_ids is None else
+                edge_ids.get((src, src_port, dst, dst_port), set())})
+        self.monitor = ThroughputMonitor(ports, history=history,
+            workers=workers)
+
+        nodes = []
+        for edge in self.edges:
+            nodes += [node for node in (edge["src"], edge["dst"])
+                if node not in nodes]
+        self.order = [node for layer in topological_layers(
+            nodes, connections, sink_first=False) for node in layer]
+
+    def poll(self):
+        """Read every tapped port once (see ThroughputMonitor.poll)"""
+        return self.monitor.poll()
+
+    def edge_rate(self, edge):
+        """Latest elements per second on a connection
+
+        Returns
+        -------
+        eps : float or None
+            None if the port has not been read yet
+        """
+        stats = self.monitor.latest.get(edge["uses"])
+        if stats:
+            for conn_id, values in stats:
+                if edge["conn_ids"] is None:
+                    found = is_connection_id(conn_id, edge["conn"])
+                else:
+                    found = str(conn_id) in edge["conn_ids"]
+                if found:
+                    return values[EPS - 1]
+            if len(stats) == 1:
+                return stats[0][1][EPS - 1]
+        # uses port does not report the connection, use the receiving end
+        stats = self.monitor.latest.get(edge["provides"])
+        if stats:
+            return stats[0][1][EPS - 1]
+        return None
+
+    def analyze(self):
+        """Rates and queue depth per instance
+
+        Returns
+        -------
+        report : OrderedDict
+            Dictionary of unique id (sources first) to a dictionary with
+            in_eps, out_eps, ratio (in / out, None if undefined),
+            queue_depth, queue_trend and bottleneck (bool)
+        """
+        report = OrderedDict((node, {"in_eps": 0., "out_eps": 0.,
+            "queue_depth": 0., "queue_trend": 0., "inputs": set()})
+            for node in self.order)
+        for edge in self.edges:
+            eps = self.edge_rate(edge)
+            if eps is not None:
+                report[edge["src"]]["out_eps"] += eps
+                report[edge["dst"]]["in_eps"] += eps
+            report[edge["dst"]]["inputs"].add(edge["provides"])
+
+        for node, entry in report.items():
+            for key in sorted(entry.pop("inputs")):
+                samples = self.monitor.samples(key)[-self.window:]
+                if samples:
+                    entry["queue_depth"] = max(entry["queue_depth"],
+                        samples[-1][QUEUE_DEPTH])
+                    entry["queue_trend"] = max(entry["queue_trend"],
+                        trend(samples, QUEUE_DEPTH))
+            has_in = any(edge["dst"] == node for edge in self.edges)
+            has_out = any(edge["src"] == node for edge in self.edges)
+            entry["ratio"] = None
+            if has_in and has_out and entry["out_eps"] > 0:
+                entry["ratio"] = entry["in_eps"] / entry["out_eps"]
+            elif has_in and has_out and entry["in_eps"] > 0:
+                # receiving but sending nothing
+                entry["ratio"] = float("inf")
+            entry["bottleneck"] = (entry["queue_trend"] > 0 and
+                entry["queue_depth"] > 0) or (entry["ratio"] is not None and
+                entry["ratio"] >= self.ratio_threshold)
+        return report
+
+    def bottleneck(self, report=None):
+        """The most likely bottleneck
+
+        Growing queues rank first (fastest growth), then the largest
+        input/output ratio.
+
+        Returns
+        -------
+        unique_id : str or None
+            None if no instance is flagged
+        """
+        if report is None:
+            report = self.analyze()
+        flagged = [node for node in report if report[node]["bottleneck"]]
+        if not flagged:
+            return None
+        return max(flagged, key=lambda node: (report[node]["queue_trend"],
+            report[node]["ratio"] or 0.))
+
+    def print_report(self):
+        """Print the per instance rates, flagging the bottleneck"""
+        report = self.analyze()
+        if not report:
+            return
+        worst = self.bottleneck(report)
+        width = max(len(node) for node in report)
+        print("%-*s %14s %14s %8s %12s %12s"%(width, "Instance",
+            "in (eps)", "out (eps)", "in/out", "queue depth", "trend (/s)"))
+        for node, entry in report.items():
+            ratio = "-" if entry["ratio"] is None else "%.2f"%entry["ratio"]
+            flag = ""
+            if node == worst:
+                flag = "  <-- bottleneck"
+            elif entry["bottleneck"]:
+                flag = "  <--"
+            print("%-*s %14.1f %14.1f %8s %12.2f %12.3f%s"%(width, node,
+                entry["in_eps"], entry["out_eps"], ratio,
+                entry["queue_depth"], entry["queue_trend"], flag))
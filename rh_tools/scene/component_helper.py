@@ -1,5 +1,11 @@
 from collections import OrderedDict
-from rh_tools.scene.utils import convert_dict
+from rh_tools.bulkio.capture_replay import CaptureReplay
+from rh_tools.scene.utils import convert_dict, run_in_pool
+
+# component keys run in this process instead of launched by the sandbox
+LOCAL_COMPONENTS = {
+    "rh_tools.capture_replay": CaptureReplay,
+}
 
 def start_in_reverse_order(my_comps):
     """Start the ordered list of components in reversed order
@@ -9,6 +15,9 @@ def start_in_reverse_order(my_comps):
     first, and the first component last.  Thus sinks will start prior
     to the sources.
 
+    .. note:: connection_graph.start_scene derives the order from the
+        scene connections instead.
+
     Parameters
     ----------
     my_comps : OrderedDict
@@ -38,9 +47,91 @@ def stop_in_order(my_comps):
             print("Error stopping %s"%str(key))
             print(e)
 
-def launch_components(sb, comp_specs):
+def launch_component(sb, comp, c_comp, instance_name=None):
+    """Launch a single component
+
+    Parameters
+    ----------
+    sb : module
+        The ossie.utils sandbox module
+
+    comp : str
+        The unique id of the component (used as instance name)
+
+    c_comp : dict
+        The component specification (see launch_components)
+
+    instance_name : str or None
+        Overrides the instance name (i.e. for component_pool)
+
+    Returns
+    -------
+    comp_inst : sandbox component
+    """
+    i_name = str(instance_name or comp)
+
+    # in-process components have no stdout to redirect
+    if c_comp["key"] in LOCAL_COMPONENTS:
+        return LOCAL_COMPONENTS[c_comp["key"]](instanceName=i_name)
+
+    # check for log entry
+    log_entry = c_comp.get("log", {})
+    log_file = log_entry.get("out_file", None)
+    if log_file:
+        # default to append
+        access = log_entry.get("access", "a")
+        assert access in ["a", "w"], "Access should be in {'a','w'}"
+        log_file = open(log_file, access)
+
+    # launch component
+    # the SPD file resolved by scene_cache saves the catalog lookup
+    return sb.launch(c_comp.get("spd") or c_comp["key"], instanceName=i_name,
+        stdout=log_file)
+
+def configure_component(comp_inst, comp, c_comp):
+    """Configure a launched component and apply its log level
+
+    Parameters
+    ----------
+    comp_inst : sandbox component
+        The instance from launch_component
+
+    comp : str
+        The unique id of the component
+
+    c_comp : dict
+        The component specification (see launch_components)
+    """
+    i_name = str(comp)
+    log_entry = c_comp.get("log", {})
+
+    # -------------------------  configure  -----------------------------
+    # FIXME : potentially may want to control the order of this.
+    # remove unicode
+    new_dict = convert_dict(c_comp["val"])
+    comp_inst.configure(new_dict)
+
+    # ------------------ if log level specified, update  ----------------
+    if log_entry:
+        log_lvl = log_entry.get("level")
+
+        if log_lvl:
+            # NOTE:
+            #   rh.FileSource needs to be specified with string ("WARN")
+            #   some components need to be specified with a number (40000)
+            if isinstance(log_lvl, long) or isinstance(log_lvl, int):
+                #comp_inst.ref.setLogLevel(i_name, log_lvl)
+                comp_inst.ref.log_level = log_lvl
+            else:
+                comp_inst.setLogLevel(i_name, log_lvl)
+
+def launch_components(sb, comp_specs, workers=1, timing=None, pool=None):
     """Launch the components in the specs
 
+    With workers > 1, the components are launched concurrently by a pool
+    of threads.  Once every component is up, they are configured (and
+    their log level set) by the same pool.
+
     .. warning::Log to file seems to work for rh.fileReader, but
         fails on custom made component.
 
@@ -53,55 +144,98 @@ def launch_components(sb, comp_specs):
         The dictionary of component specifications.
         The keys are the unique id of the component.
         Each element will have fields:
-            "key": name of the component in sb.catalog()
+            "key": name of the component in sb.catalog() (or of
+                LOCAL_COMPONENTS, i.e. "rh_tools.capture_replay")
+            "spd": optional path of the SPD file, launched instead of key
             "vals": the dictionary config for the component
             "log": specify the log level to run component.
 
+    workers : int
+        Number of components launched/configured at the same time
+
+    timing : dict or None
+        If specified, updated with the unique id of each component mapped
+        to a dictionary of "launch" and "configure" seconds.
+
+    pool : ComponentPool or None
+        If specified, idle components of the pool are reused instead of
+        launching new ones (see component_pool)
+
     Returns
     -------
     comp_dict : OrderedDict
         The dictionary pointing to the component instances.
         The keys of this dictionary should match the keys of the
         comp_specs
+
+    Raises
+    ------
+    Exception   The first error of a component that failed to launch or
+        configure (after every other component has been processed).  The
+        components already launched are released (or returned to the
+        pool) first.
     """
+    if timing is None:
+        timing = OrderedDict()
+    comps = list(comp_specs.keys())
+
     # ---------------------------  load components  -------------------------
+    if pool is not None:
+        launch = lambda comp: pool.acquire(comp, comp_specs[comp])
+    else:
+        launch = lambda comp: launch_component(sb, comp, comp_specs[comp])
+    results = run_in_pool(launch, comps, workers)
     comp_dict = OrderedDict()
-    for comp in comp_specs:
-        c_comp = comp_specs[comp]
-        i_name = str(comp)
-
-        # check for log entry
-        log_entry = c_comp.get("log", {})
-        log_file = log_entry.get("out_file", None)
-        if log_file:
-            # default to append
-            access = log_entry.get("access", "a")
-            assert access in ["a", "w"], "Access should be in {'a','w'}"
-            log_file = open(log_file, access)
-
-        # launch component
-        comp_dict[comp] = sb.launch(c_comp["key"], instanceName=i_name,
-            stdout=log_file)
-
-        # -------------------------  configure  -----------------------------
-        # FIXME : potentially may want to control the order of this.
-        # remove unicode
-        new_dict = convert_dict(c_comp["val"])
-        comp_dict[comp].configure(new_dict)
-
-        # ------------------ if log level specified, update  ----------------
-        if log_entry:
-            log_lvl = log_entry.get("level")
-
-            if log_lvl:
-                # NOTE:
-                #   rh.FileSource needs to be specified with string ("WARN")
-                #   some components need to be specified with a number (40000)
-                if isinstance(log_lvl, long) or isinstance(log_lvl, int):
-                    #comp_dict[comp].ref.setLogLevel(i_name, log_lvl)
-                    comp_dict[comp].ref.log_level = log_lvl
-                else:
-                    comp_dict[comp].setLogLevel(i_name, log_lvl)
+    errors = []
+    for comp, (comp_inst, error, elapsed) in zip(comps, results):
+        timing[comp] = OrderedDict([("launch", elapsed)])
+        if error is not None:
+            print("Failed to launch %s: %s"%(str(comp), str(error)))
+            errors.append(error)
+        else:
+            comp_dict[comp] = comp_inst
+    if errors:
+        release_components(comp_dict, workers, pool)
+        raise errors[0]
+
+    # -------------------------  configure  ---------------------------------
+    results = run_in_pool(
+        lambda comp: configure_component(comp_dict[comp], comp,
+            comp_specs[comp]),
+        comps, workers)
+    for comp, (_, error, elapsed) in zip(comps, results):
+        timing[comp]["configure"] = elapsed
+        if error is not None:
+            print("Failed to configure %s: %s"%(str(comp), str(error)))
+            errors.append(error)
+    if errors:
+        release_components(comp_dict, workers, pool)
+        raise errors[0]
 
     return comp_dict
 
+def release_components(comp_dict, workers=1, pool=None):
+    """Release components (or return them to a pool)
+
+    Errors are printed, every component is attempted.
+
+    Parameters
+    ----------
+    comp_dict : OrderedDict
+        The component instances
+
+    workers : int
+        Number of components released at the same time
+
+    pool : ComponentPool or None
+        If specified, the components are returned to the pool
+    """
+    if pool is not None:
+        pool.release_all(comp_dict, workers=workers)
+        return
+    comps = list(comp_dict.keys())
+    results = run_in_pool(lambda comp: comp_dict[comp].releaseObject(),
+        comps, workers)
+    for comp, (_, error, _) in zip(comps, results):
+        if error is not None:
+            print("Failed to release %s: %s"%(str(comp), str(error)))
@@ -0,0 +1,259 @@
+"""
+Keep sandbox components alive between scenes.
+
+Launching a component starts a process and waits for it to register,
+which dominates the setup of small scenes.  A ComponentPool keeps the
+components of a finished scene idle, keyed by their catalog name, and
+hands them to the next scene asking for the same key:
+
+1. on release, the component is stopped and every connection of its uses
+   ports is disconnected,
+2. on acquire, an idle component of the same key is reused (most recently
+   released first), otherwise a new one is launched.  launch_components
+   then configures it with the "val" of the new scene as usual.
+
+The idle components are bounded per key (max_per_key) and in total
+(max_idle); the least recently released ones are released first.
+
+.. note:: A reused component keeps the instance name, stdout and the
+    property values of its previous scene.  Properties absent from the new
+    "val" are not reset to their defaults (a warning lists them), so a
+    sweep should list every property it changes in each scene.  Components run in this process
+    (component_helper.LOCAL_COMPONENTS) are cheap to create and are not
+    pooled.
+"""
+from collections import OrderedDict
+import itertools
+import threading
+import warnings
+from rh_tools.scene.component_helper import launch_component, LOCAL_COMPONENTS
+from rh_tools.scene.port_index import fetch_port_set
+from rh_tools.scene.utils import run_in_pool
+
+def disconnect_ports(instance):
+    """Disconnect every connection of the uses ports of an instance
+
+    Parameters
+    ----------
+    instance : sandbox component
+
+    Returns
+    -------
+    count : int
+        The number of connections disconnected
+    """
+    ports = fetch_port_set(instance)
+    if ports is None:
+        return 0
+    count = 0
+    for entry in ports.values():
+        if entry.direction and entry.direction.lower() == "provides":
+            continue
+        try:
+            # ExtendedCF.QueryablePort
+            connections = entry.obj_ptr._get_connections()
+        except Exception:
+            continue
+        for conn in connections:
+            try:
+                entry.obj_ptr.disconnectPort(conn.connectionId)
+                count += 1
+            except Exception as e:
+                print("Failed to disconnect %s from %s: %s"%(
+                    str(conn.connectionId), entry.name, str(e)))
+    return count
+
+class ComponentPool(object):
+    """Idle sandbox components reused across scenes
+
+    Parameters
+    ----------
+    sb : module
+        The ossie.utils sandbox module
+
+    max_idle : int
+        Maximum number of idle components kept
+
+    max_per_key : int
+        Maximum number of idle components kept per catalog name
+    """
+    def __init__(self, sb, max_idle=16, max_per_key=4):
+        self.sb = sb
+        self.max_idle = max_idle
+        self.max_per_key = max_per_key
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.closed = False
+        # (key, sequence) -> instance, least recently released first
+        self._idle = OrderedDict()
+        # id of every instance launched by the pool -> (key, instance name)
+        self._keys = {}
+        # id of an instance -> the properties set by its last scene
+        self._props = {}
+        self._names = set()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Number of idle components"""
+        with self._lock:
+            return len(self._idle)
+
+    def acquire(self, comp, c_comp):
+        """Get a component for a scene (see launch_components)
+
+        Parameters
+        ----------
+        comp : str
+            The unique id of the component in the scene
+
+        c_comp : dict
+            The component specification
+
+        Returns
+        -------
+        comp_inst : sandbox component
+            Either an idle component of the same key (stopped and
+            disconnected) or a newly launched one
+        """
+        key = str(c_comp["key"])
+        if key in LOCAL_COMPONENTS:
+            return launch_component(self.sb, comp, c_comp)
+        with self._lock:
+            comp_inst = None
+            for item in reversed(self._idle):
+                if item[0] == key:
+                    comp_inst = self._idle.pop(item)
+                    break
+            if comp_inst is not None:
+                self.hits += 1
+                stale = sorted(self._props.get(id(comp_inst), set()) -
+                    set(c_comp.get("val", {})))
+            else:
+                self.misses += 1
+                # a name may still be held by an idle component
+                name = str(comp)
+                if name in self._names:
+                    name = "%s_%d"%(name, next(self._sequence))
+                self._names.add(name)
+        if comp_inst is None:
+            try:
+                comp_inst = launch_component(self.sb, comp, c_comp,
+                    instance_name=name)
+            except Exception:
+                with self._lock:
+                    self._names.discard(name)
+                raise
+            with self._lock:
+                self._keys[id(comp_inst)] = (key, name)
+        elif stale:
+            warnings.warn("%s reuses a %s that keeps the values of %s from "%(
+                str(comp), key, ", ".join(stale)) + "its previous scene")
+        with self._lock:
+            self._props[id(comp_inst)] = set(c_comp.get("val", {}))
+        return comp_inst
+
+    def release(self, comp_inst):
+        """Return a component to the pool
+
+        The component is stopped and disconnected, then kept idle (or
+        released if it was not launched by the pool, or the pool is
+        closed).  The least recently released components are evicted
+        beyond the size limits.
+
+        Parameters
+        ----------
+        comp_inst : sandbox component
+        """
+        with self._lock:
+            key_name = self._keys.get(id(comp_inst))
+            closed = self.closed
+        if key_name is None:
+            # local components, or not launched by this pool
+            self._release_object(comp_inst)
+            return
+        if closed:
+            self._evict(comp_inst, count=False)
+            return
+        try:
+            comp_inst.stop()
+        except Exception as e:
+            print("Failed to stop %s: %s"%(key_name[1], str(e)))
+        try:
+            disconnect_ports(comp_inst)
+        except Exception as e:
+            # not safe to reuse
+            print("Failed to reset %s: %s"%(key_name[1], str(e)))
+            self._evict(comp_inst)
+            return
+
+        evicted = []
+        with self._lock:
+            closed = self.closed
+            if not closed:
+                self._idle[(key_name[0], next(self._sequence))] = comp_inst
+                same_key = [item for item in self._idle
+                    if item[0] == key_name[0]]
+                for item in same_key[:max(len(same_key) - self.max_per_key,
+                        0)]:
+                    evicted.append(self._idle.pop(item))
+                while len(self._idle) > self.max_idle:
+                    evicted.append(self._idle.popitem(last=False)[1])
+        if closed:
+            # closed while this one was being reset
+            self._evict(comp_inst, count=False)
+        for inst in evicted:
+            self._evict(inst)
+
+    def release_all(self, comp_dict, workers=1):
+        """Return every component of a scene to the pool
+
+        Parameters
+        ----------
+        comp_dict : OrderedDict
+            The component instances (see launch_components)
+
+        workers : int
+            Number of components released at the same time
+        """
+        instances = list(comp_dict.values())
+        results = run_in_pool(self.release, instances, workers)
+        for comp, (_, error, _) in zip(comp_dict.keys(), results):
+            if error is not None:
+                print("Failed to release %s: %s"%(str(comp), str(error)))
+
+    def close(self):
+        """Release every idle component
+
+        Components still in use are released when they are returned.
+        """
+        with self._lock:
+            self.closed = True
+            instances = list(self._idle.values())
+            self._idle.clear()
+        for comp_inst in instances:
+            self._evict(comp_inst, count=False)
+
+    def stats(self):
+        """Hits, misses, evictions and number of idle components"""
+        with self._lock:
+            return OrderedDict([("hits", self.hits), ("misses", self.misses),
+                ("evictions", self.evictions), ("idle", len(self._idle))])
+
+    def _evict(self, comp_inst, count=True):
+        with self._lock:
+            key_name = self._keys.pop(id(comp_inst), None)
+            self._props.pop(id(comp_inst), None)
+            if key_name is not None:
+                self._names.discard(key_name[1])
+            if count:
+                self.evictions += 1
+        self._release_object(comp_inst)
+
+    @staticmethod
+    def _release_object(comp_inst):
+        try:
+            comp_inst.releaseObject()
+        except Exception as e:
+            print("Failed to release component: %s"%str(e))
@@ -0,0 +1,199 @@
+"""
+Dependency graph of a scene derived from its connections.
+
+Each connection ``[uses_id, uses_port, provides_id, provides_port]`` is an
+edge from the instance sending data to the instance receiving it.  The
+graph is split into layers with Kahn's algorithm:
+
+* sink-first layers start receivers before the instances feeding them,
+* source-first layers stop the instances feeding data before the
+  receivers, so queued data can drain.
+
+Instances in one layer do not depend on each other and are started or
+stopped in parallel.  Instances in a layer are sorted by name, so the
+schedule does not depend on the order of the JSON keys.  Instances on a
+cycle cannot be ordered and are placed in a final layer.
+"""
+from collections import OrderedDict
+from rh_tools.scene.utils import run_in_pool
+
+def build_graph(nodes, connections):
+    """Build the adjacency lists of the scene
+
+    Parameters
+    ----------
+    nodes : list
+        The unique ids of the components and waveforms
+
+    connections : list
+        The scene connections [uses_id, uses_port, provides_id,
+        provides_port].  Connections to unknown ids are ignored.
+
+    Returns
+    -------
+    downstream : OrderedDict
+        Dictionary of unique id to the sorted list of ids it sends to
+
+    upstream : OrderedDict
+        Dictionary of unique id to the sorted list of ids it receives from
+    """
+    downstream = OrderedDict((str(node), set()) for node in nodes)
+    upstream = OrderedDict((str(node), set()) for node in nodes)
+    for conn in connections:
+        src = str(conn[0])
+        dst = str(conn[2])
+        if src in downstream and dst in downstream and src != dst:
+            downstream[src].add(dst)
+            upstream[dst].add(src)
+    for graph in (downstream, upstream):
+        for node in graph:
+            graph[node] = sorted(graph[node])
+    return downstream, upstream
+
+def topological_layers(nodes, connections, sink_first=True):
+    """Split the scene into dependency layers
+
+    Parameters
+    ----------
+    nodes : list
+        The unique ids of the components and waveforms
+
+    connections : list
+        The scene connections (see build_graph)
+
+    sink_first : bool
+        If True, the first layer holds the sinks (instances that do not
+        send to anything).  Otherwise the first layer holds the sources.
+
+    Returns
+    -------
+    layers : list
+        List of sorted lists of unique ids
+    """
+    downstream, upstream = build_graph(nodes, connections)
+    if sink_first:
+        # a node is ready once everything it sends to is scheduled
+        waits_on, unlocks = downstream, upstream
+    else:
+        waits_on, unlocks = upstream, downstream
+
+    remaining = dict((node, len(waits_on[node])) for node in waits_on)
+    layer = sorted(node for node in remaining if remaining[node] == 0)
+    layers = []
+    while layer:
+        layers.append(layer)
+        next_layer = []
+        for node in layer:
+            del remaining[node]
+            for other in unlocks[node]:
+                remaining[other] -= 1
+                if remaining[other] == 0:
+                    next_layer.append(other)
+        layer = sorted(next_layer)
+
+    if remaining:
+        # cycle, no further ordering possible
+        layers.append(sorted(remaining))
+    return layers
+
+def run_layers(layers, actions, workers=1, label="run"):
+    """Run an action on each instance, one layer at a time
+
+    Parameters
+    ----------
+    layers : list
+        The layers from topological_layers
+
+    actions : dict
+        Dictionary of unique id to a callable taking no arguments
+
+    workers : int
+        Number of instances of a layer processed at the same time
+
+    label : str
+        Used in the error messages (i.e. "start")
+
+    Returns
+    -------
+    errors : OrderedDict
+        Dictionary of unique id to the exception it raised
+    """
+    errors = OrderedDict()
+    for layer in layers:
+        layer = [node for node in layer if node in actions]
+        results = run_in_pool(lambda node: actions[node](), layer, workers)
+        for node, (_, error, _) in zip(layer, results):
+            if error is not None:
+                print("Failed to %s %s: %s"%(label, node, str(error)))
+                errors[node] = error
+    return errors
+
+def start_scene(comp_dict, wfm_dict, connections, workers=1, layers=None):
+    """Start components and waveforms, sinks first
+
+    Parameters
+    ----------
+    comp_dict : OrderedDict
+        The component instances
+
+    wfm_dict : OrderedDict
+        The waveform instances
+
+    connections : list
+        The scene connections
+
+    workers : int
+        Number of instances of a layer started at the same time
+
+    layers : list or None
+        Precomputed sink-first layers (i.e. from scene_cache)
+
+    Raises
+    ------
+    RuntimeError    If any instance failed to start
+    """
+    actions = OrderedDict()
+    for key in wfm_dict:
+        actions[str(key)] = wfm_dict[key].start
+    for key in comp_dict:
+        actions[str(key)] = comp_dict[key].start
+
+    if layers is None:
+        layers = topological_layers(actions.keys(), connections,
+            sink_first=True)
+    errors = run_layers(layers, actions, workers, label="start")
+    if errors:
+        raise RuntimeError("Failed to start %s"%", ".join(errors.keys()))
+
+def stop_scene(comp_dict, wfm_dict, connections, workers=1, layers=None):
+    """Stop components and waveforms, sources first
+
+    Errors are printed, every instance is attempted.
+
+    Parameters
+    ----------
+    comp_dict : OrderedDict
+        The component instances
+
+    wfm_dict : OrderedDict
+        The waveform instances
+
+    connections : list
+        The scene connections
+
+    workers : int
+        Number of instances of a layer stopped at the same time
+
+    layers : list or None
+        Precomputed source-first layers (i.e. from scene_cache)
+    """
+    actions = OrderedDict()
+    for key in wfm_dict:
+        actions[str(key)] = wfm_dict[key].ref.stop
+    for key in comp_dict:
+        actions[str(key)] = comp_dict[key].stop
+
+    if layers is None:
+        layers = topological_layers(actions.keys(), connections,
+            sink_first=False)
+    run_layers(layers, actions, workers, label="stop")
@@ -1,11 +1,16 @@
 from collections import OrderedDict
 from pprint import pprint
+import csv
+import itertools
 import json
 import pickle
 import pandas
+import re
 import uuid
+from rh_tools.message.columnar import write_columnar, load_columnar
+from rh_tools.message.message_writer import iter_json_lines
 from rh_tools.scene.waveform_helper import get_port
-def connect_msg_sinks(sb, comp_dict, wfm_dict, debug):
+def connect_msg_sinks(sb, comp_dict, wfm_dict, debug, port_index=None):
     """Connect message sinks to the components and waveforms
 
     Parameters
@@ -25,6 +30,10 @@ def connect_msg_sinks(sb, comp_dict, wfm_dict, debug):
         This dictionary support throughput and message
         sinks to connect at various output ports of the
         components/waveforms.
+
+    port_index : PortIndex or None
+        If specified, waveform ports are looked up in the shared index
+        instead of fetching the port set per sink.
     """
     # initialize output
     msg_sinks = OrderedDict()
@@ -41,7 +50,10 @@ def connect_msg_sinks(sb, comp_dict, wfm_dict, debug):
                 usesPortName=str(msink[1]))
 
         elif msink[0] in wfm_dict:
-            tmp_p = get_port(wfm_dict[str(msink[0])], msink[1])
+            if port_index is not None:
+                tmp_p = port_index.get(msink[0], msink[1])
+            else:
+                tmp_p = get_port(wfm_dict[str(msink[0])], msink[1])
             tmp_p.obj_ptr.connectPort(
                 msg_sinks[new_key].getPort("msgIn"),
                 "msink_conn_" + str(uuid.uuid1()))
@@ -104,12 +116,17 @@ def save_messages(msg_store):
         Dictionary with the keys being the unique id of port
         The value should be another dictionary with fields:
             'filename' the filepath to save to
-            'format' from {'json', 'pickle'}
+            'format' from {'json', 'pickle', 'npz'}
             'messages' the list of messages stored from the
                 given port.
     """
     for key in msg_store:
-        if msg_store[key]["filename"] != "":
+        if msg_store[key]["format"] == "npz" and msg_store[key]["filename"]:
+            # columnar archive (see rh_tools.message.columnar)
+            write_columnar(msg_store[key]["messages"],
+                msg_store[key]["filename"])
+
+        elif msg_store[key]["filename"] != "":
             # save to file
             with open(msg_store[key]["filename"], "w") as fid:
                 if msg_store[key]["format"] == "json":
@@ -121,12 +138,20 @@ def save_messages(msg_store):
                         "save_messages does not support format ()"\
                         %str(msg_store[key]["format"]))
 
-def messages_to_csv(message_list, output_csv_file, remove_msg_name=True):
+def messages_to_csv(message_list, output_csv_file, remove_msg_name=True,
+        chunk_size=10000):
     """Store messages to CSV
 
+    The messages are written in chunks as they are consumed, so
+    message_list can be a generator (i.e. from iter_message_file) and the
+    whole recording never has to be in memory.  The columns are derived
+    once from the first message.  Fields that are missing in a later
+    message are left empty, fields that are not in the first message are
+    ignored.
+
     Parameters
     ----------
-    message_list : list
+    message_list : list or iterable
         List of stored messages.  Typically the element will be a dictionary
         with the key being the name of the message type.  The fields of that
         dictionary would be the fields of the message.  This usually is in the
@@ -139,85 +164,399 @@ def messages_to_csv(message_list, output_csv_file, remove_msg_name=True):
     remove_msg_name : bool
         Specify whether to clear the message name from the field name.
 
+    chunk_size : int
+        Number of rows to buffer between writes
+
     Raises
     ------
     RuntimeError    If the list is empty
     """
-    if len(message_list) > 0:
-        msg_name = str(message_list[0].keys()[0])
-        new_msg_list = []
-        for elem in message_list:
-            c_msg = elem[msg_name]
+    messages = iter(message_list)
+    try:
+        first = next(messages)
+    except StopIteration:
+        raise RuntimeError("Why are you giving me an empty list?")
+
+    # ----------------  derive the schema from the first message  ------------
+    msg_name = str(list(first.keys())[0])
+    fields = sorted(first[msg_name].keys())
+    if remove_msg_name:
+        # remove 'message_name::' from keys
+        header = [key.replace("%s::"%msg_name, "") for key in fields]
+    else:
+        # keep msg name in fields
+        header = fields
 
-            # -------------------  reformat field names  --------------------
-            if remove_msg_name:
-                # remove 'message_name::' from keys
-                new_msg = {}
-                for key in c_msg:
-                    new_key = key.replace("%s::"%msg_name, "")
-                    new_msg[new_key] = c_msg[key]
+    # -------------------------  write in chunks  ---------------------------
+    with open(output_csv_file, "w") as fid:
+        writer = csv.writer(fid)
+        # leading empty column is the row index (as written by pandas)
+        writer.writerow([""] + header)
 
-                # store new list
-                new_msg_list.append(new_msg)
+        rows = []
+        for ind, elem in enumerate(itertools.chain([first], messages)):
+            c_msg = elem[msg_name]
+            rows.append([ind] + [c_msg.get(key) for key in fields])
+            if len(rows) >= chunk_size:
+                writer.writerows(rows)
+                rows = []
+        writer.writerows(rows)
+
+class _JsonStream(object):
+    """Incrementally decode a JSON file made of nested arrays and objects
+
+    Only the containers being walked are parsed by hand.  Every element is
+    decoded with the C accelerated json decoder, so only one element has to
+    be in memory at a time.
+    """
+    WHITESPACE = " \t\r\n"
+    # characters changing the nesting level, or starting a string
+    SPECIAL = re.compile(r'["\[\]{}]')
+    STRING = re.compile(r'"(?:[^"\\]|\\.)*"', re.S)
+
+    def __init__(self, fid, chunk_size=1 << 20):
+        self._fid = fid
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        chunk = self._fid.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self):
+        """Skip whitespace and return the next character (None at the end)"""
+        while True:
+            while self._pos < len(self._buf) and\
+                    self._buf[self._pos] in self.WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return None
+
+    def expect(self, chars):
+        """Consume the next character, which should be one of chars"""
+        char = self.peek()
+        if char is None or char not in chars:
+            raise ValueError("Expecting one of %r at offset %d, found %r"%(
+                chars, self._pos, char))
+        self._pos += 1
+        return char
+
+    def value(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                obj, end = self._decoder.raw_decode(self._buf, self._pos)
+                # a number at the end of the buffer may be truncated
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return obj
+            except ValueError:
+                if self._eof:
+                    raise
+            self._fill()
+
+    def skip(self):
+        """Skip the next JSON value without decoding it
+
+        Containers are scanned for their closing bracket with regular
+        expressions, so nothing is built for the skipped elements.
+        """
+        char = self.peek()
+        if char is None:
+            raise ValueError("Unexpected end of file")
+        if char not in "[{":
+            # scalar
+            self.value()
+            return
+        depth = 0
+        while True:
+            match = self.SPECIAL.search(self._buf, self._pos)
+            if match is None:
+                # nothing of interest left in the buffer
+                self._pos = len(self._buf)
+                if not self._fill():
+                    raise ValueError("Unexpected end of file")
+                continue
+            if match.group() == '"':
+                string = self.STRING.match(self._buf, match.start())
+                if string is None:
+                    # string continues in the next chunk
+                    self._pos = match.start()
+                    if not self._fill():
+                        raise ValueError("Unterminated string")
+                    continue
+                self._pos = string.end()
+                continue
+            self._pos = match.end()
+            depth += 1 if match.group() in "[{" else -1
+            if depth == 0:
+                return
+
+    def iter_array(self):
+        """Iterate over the elements of the array starting at this point"""
+        self.expect("[")
+        if self.peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+    def iter_object(self):
+        """Iterate over the keys of the object starting at this point
+
+        The caller must consume the value (value or iter_array) after
+        each key.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.expect(",}") == "}":
+                return
+
+def _wanted(key, keys):
+    """Whether a key passes the keys filter of iter_message_file"""
+    if keys is None:
+        return True
+    if callable(keys):
+        return keys(key)
+    return key in keys
+
+def iter_message_file(filename, fmt="json", keys=None):
+    """Iterate over the messages saved in a file
+
+    Supports the list of messages saved by the run_custom message sinks,
+    the dictionary of waveform:port to list of messages saved by
+    rh_tools.message.record_waveform, and the newline-delimited JSON
+    files from record_waveform --stream.  The "json" and "ndjson" formats
+    are decoded incrementally.
+
+    Parameters
+    ----------
+    filename : str
+        File to load from
+
+    fmt : str
+        The format from {'json', 'ndjson', 'pickle'}
+
+    keys : container, callable or None
+        For dictionary files, only yield the messages of these keys (or of
+        the keys for which keys(key) is True, called once per key in file
+        order).  In "json" files the messages of other keys are skipped
+        without being decoded.
+
+    Returns
+    -------
+    msgs : generator
+        Generator of (key, message).  The key is None for files holding
+        a list of messages.
+    """
+    if fmt == "ndjson":
+        for msg in iter_json_lines(filename):
+            yield None, msg
+
+    elif fmt == "json":
+        with open(filename, "r") as fid:
+            stream = _JsonStream(fid)
+            if stream.peek() == "[":
+                for msg in stream.iter_array():
+                    yield None, msg
             else:
-                # keep msg name in fields
-                new_msg_list.append(c_msg)
+                for key in stream.iter_object():
+                    if _wanted(key, keys):
+                        for msg in stream.iter_array():
+                            yield key, msg
+                    else:
+                        stream.skip()
+
+    elif fmt == "pickle":
+        my_list = pickle.load(open(filename, "rb"))
+        if isinstance(my_list, list):
+            for msg in my_list:
+                yield None, msg
+        else:
+            for key in my_list:
+                if _wanted(key, keys):
+                    for msg in my_list[key]:
+                        yield key, msg
 
-        df = pandas.DataFrame(new_msg_list)
-        df.to_csv(open(output_csv_file, "w"))
     else:
-        raise RuntimeError("Why are you giving me an empty list?")
+        raise RuntimeError("Unexpected format %s"%str(fmt))
+
+def convert_message_file(filename, file_out, fmt="json",
+        remove_msg_name=True, job=0, jobs=1):
+    """Convert a saved message file into CSV files
+
+    A list of messages is saved to file_out + ".csv".  A dictionary of
+    lists of messages is saved to file_out + "_KEY.csv" per key.
+
+    Parameters
+    ----------
+    filename : str
+        File to load from
+
+    file_out : str
+        Base path of the output CSV files (without extension)
+
+    fmt : str
+        The format from {'json', 'ndjson', 'pickle'}
+
+    remove_msg_name : bool
+        Specify whether to clear the message name from the field name.
+
+    job, jobs : int
+        Convert only every jobs-th key of a dictionary file, starting at
+        key number job.  Used to split one file across processes; the
+        messages of the other keys are skipped, not decoded.
+
+    Returns
+    -------
+    outputs : list
+        The CSV files written
+    """
+    outputs = []
+    # called once per key of a dictionary file, in file order
+    key_num = itertools.count()
+    mine = lambda key: next(key_num) % jobs == job
+
+    # a list of messages (key None) is converted by the first job
+    msgs = (item for item in iter_message_file(filename, fmt, keys=mine)
+        if item[0] is not None or job == 0)
+    for key, group in itertools.groupby(msgs, key=lambda item: item[0]):
+        if key is None:
+            # NOTE: Running rh_tools.scene.run_custom with the debug option
+            #       for messages saves files as a list of message dictionaries
+            out_file = file_out + ".csv"
+        else:
+            # NOTE: rh_tools.message.record_waveform saves a dictionary
+            #       The keys are the waveform/port name.  Each of these
+            #       stores the list of messages received.
+            out_file = file_out + "_%s.csv"%key
+        messages_to_csv((msg for _, msg in group),
+            output_csv_file=out_file,
+            remove_msg_name=remove_msg_name)
+        outputs.append(out_file)
+    return outputs
+
+def _convert_task(task):
+    """Pool entry point for convert_message_file"""
+    filename, file_out, kwargs = task
+    try:
+        return convert_message_file(filename, file_out, **kwargs)
+    except RuntimeError as e:
+        print("Failed to process %s"%str(filename))
+        print(e)
+        return []
+
+def columnar_to_csv(filenames, output_csv_file, remove_msg_name=True):
+    """Store a columnar message archive to CSV
+
+    Parameters
+    ----------
+    filenames : str or list
+        The .npz archive (or rotated segments) from
+        rh_tools.message.columnar
+
+    output_csv_file : str
+        The path to save the CSV file
+
+    remove_msg_name : bool
+        Specify whether to clear the message name from the field name.
+
+    Raises
+    ------
+    RuntimeError    If the archive is empty
+    """
+    cols = load_columnar(filenames)
+    if not cols:
+        raise RuntimeError("No messages in %s"%str(filenames))
+
+    # like messages_to_csv, the first message id determines the table
+    msg_name = list(cols.keys())[0].split("::", 1)[0]
+    keys = [key for key in cols if key.startswith(msg_name + "::")]
+
+    # one row per message, in arrival order
+    df = pandas.DataFrame(OrderedDict(
+        (key, list(cols[key]) if cols[key].ndim > 1 else cols[key])
+        for key in keys))
+    df = df.set_index("%s::__index__"%msg_name).sort_index()
+    if remove_msg_name:
+        df.columns = [key.replace("%s::"%msg_name, "") for key in df.columns]
+    df.to_csv(open(output_csv_file, "w"))
 
 if __name__ == "__main__":
     from argparse import ArgumentParser
+    import multiprocessing
+    import os
     parser = ArgumentParser(
         description="Load a save message file and convert to CSV")
-    parser.add_argument("file", help="File to load from")
+    parser.add_argument("file", nargs="+", help="File(s) to load from")
     parser.add_argument("--format", default="json",
-        help="Format from {'json', 'pickle'")
+        help="Format from {'json', 'ndjson', 'pickle', 'npz'}")
     parser.add_argument("outdir", default="/tmp",
         help="Output directory")
     parser.add_argument("--keep_msg_name", action="store_true")
+    parser.add_argument("--jobs", default=1, type=int,
+        help="Number of processes converting files (or the waveform:port"+\
+            " entries of a record_waveform file) in parallel")
     args = parser.parse_args()
+    rm_msg = not args.keep_msg_name
 
-    # ----------------------------  output file  ----------------------------
-    if args.format == "json":
-        my_list = json.load(open(args.file, "r"))
-    elif args.format == "pickle":
-        my_list = pickle.load(open(args.file, "r"))
-    else:
-        raise RuntimeError("Unexpected format %s"%str(args.format))
-
-    import os
-    base_name = os.path.basename(args.file)
-    ext_ind = base_name.rfind(".")
+    # ---------------------------  build tasks  -----------------------------
+    tasks = []
+    for filename in args.file:
+        base_name = os.path.basename(filename)
+        ext_ind = base_name.rfind(".")
 
-    # create the base file name for output, matching the input json/pickle file
-    file_out = args.outdir + '/' + base_name[:ext_ind]
+        # create the base file name for output, matching the input file
+        file_out = args.outdir + '/' + base_name[:ext_ind]
 
-    try:
-        rm_msg = not args.keep_msg_name
-        if isinstance(my_list, list):
-            # --------  operate on a list of messages (list of dict)  -------
-            # NOTE: Running rh_tools.scene.run_custom with the debug option
-            #       for messages saves files as a list of message dictionaries
-            messages_to_csv(my_list,
-                output_csv_file=file_out+".csv",
-                remove_msg_name=rm_msg)
-
-        elif isinstance(my_list, dict):
-            # NOTE: rh_tools.message.record_waveform saves a dictionary
-            #       The keys are the waveform/port name.  Each of these
-            #       stores the list of messages received.
-            for key in my_list:
-                out_file = args.outdir + "/" + key
-                tmp_msg_list = my_list[key]
-
-                # save each list of message to separate file
-                messages_to_csv(tmp_msg_list,
-                    output_csv_file=file_out+"_%s.csv"%key,
+        if args.format == "npz":
+            try:
+                columnar_to_csv(filename,
+                    output_csv_file=file_out+".csv",
                     remove_msg_name=rm_msg)
+            except RuntimeError as e:
+                print("Failed to process %s"%str(filename))
+                print(e)
+            continue
+
+        # split the keys of a single record_waveform file across the jobs
+        n_split = 1
+        if args.format == "json":
+            with open(filename, "r") as fid:
+                if _JsonStream(fid, chunk_size=4096).peek() == "{":
+                    n_split = args.jobs
+        for job in range(n_split):
+            tasks.append((filename, file_out, dict(fmt=args.format,
+                remove_msg_name=rm_msg, job=job, jobs=n_split)))
+
+    # ----------------------------  convert  --------------------------------
+    if args.jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(args.jobs)
+        results = pool.map(_convert_task, tasks)
+        pool.close()
+        pool.join()
+    else:
+        results = [_convert_task(task) for task in tasks]
 
-    except RuntimeError as e:
-        print("Failed to process %s"%str(args.file))
-        print(e)
\ No newline at end of file
+    for outputs in results:
+        for out_file in outputs:
+            print("Wrote %s"%out_file)
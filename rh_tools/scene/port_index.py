@@ -0,0 +1,172 @@
+"""
+Index of the ports of the instances of a scene.
+
+getPortSet returns every external port of a component or waveform
+(name, obj_ptr, direction, repid) in one remote call.  PortIndex fetches
+it once per instance and answers every later lookup from memory, so the
+scene helpers (connections, message sinks, throughput taps) share one
+fetch per instance instead of one call per port lookup.
+
+Instances without getPortSet (i.e. the in-process sources of
+rh_tools.bulkio) are looked up with getPort, once per port.
+"""
+from collections import namedtuple, OrderedDict
+import threading
+from rh_tools.scene.utils import get_instance, run_in_pool
+
+PortEntry = namedtuple("PortEntry",
+    ["name", "obj_ptr", "direction", "repid", "description"])
+
+def fetch_port_set(instance):
+    """Get the port set of a component or waveform
+
+    Parameters
+    ----------
+    instance : sandbox component or waveform
+
+    Returns
+    -------
+    ports : OrderedDict or None
+        Dictionary of port name to PortEntry.  None if the instance does
+        not support getPortSet (or the call failed).
+    """
+    for obj in (instance, getattr(instance, "ref", None)):
+        get_port_set = getattr(obj, "getPortSet", None)
+        if get_port_set is None:
+            continue
+        try:
+            port_set = get_port_set()
+        except Exception as e:
+            # i.e. resources older than the PortSet interface
+            print("getPortSet failed (%s), looking up ports by name"%str(e))
+            continue
+        ports = OrderedDict()
+        for port in port_set:
+            ports[str(port.name)] = PortEntry(str(port.name), port.obj_ptr,
+                str(port.direction), str(port.repid),
+                str(getattr(port, "description", "")))
+        return ports
+    return None
+
+class PortIndex(object):
+    """Port lookups of the scene instances, fetched once per instance
+
+    Parameters
+    ----------
+    comp_dict : OrderedDict
+        The component instances
+
+    wfm_dict : OrderedDict
+        The waveform instances
+    """
+    def __init__(self, comp_dict, wfm_dict):
+        self.comp_dict = comp_dict
+        self.wfm_dict = wfm_dict
+        self.fetches = 0
+        self._ports = {}
+        self._complete = set()
+        self._lock = threading.Lock()
+
+    def build(self, workers=1):
+        """Fetch the port set of every instance
+
+        Parameters
+        ----------
+        workers : int
+            Number of instances fetched at the same time
+
+        Returns
+        -------
+        errors : OrderedDict
+            Dictionary of unique id to the exception of a failed fetch
+        """
+        ids = list(self.wfm_dict.keys()) + list(self.comp_dict.keys())
+        results = run_in_pool(self.ports, ids, workers)
+        errors = OrderedDict()
+        for unique_id, (_, error, _) in zip(ids, results):
+            if error is not None:
+                print("Failed to get the ports of %s: %s"%(unique_id,
+                    str(error)))
+                errors[unique_id] = error
+        return errors
+
+    def ports(self, unique_id):
+        """The ports of an instance (fetched on first use)
+
+        Returns
+        -------
+        ports : OrderedDict
+            Dictionary of port name to PortEntry.  For instances without
+            getPortSet, only the ports looked up so far.
+        """
+        unique_id = str(unique_id)
+        with self._lock:
+            if unique_id in self._ports:
+                return self._ports[unique_id]
+        instance = get_instance(unique_id, self.comp_dict, self.wfm_dict)
+        if instance is None:
+            raise KeyError("No component or waveform %s"%unique_id)
+        ports = fetch_port_set(instance)
+        with self._lock:
+            self.fetches += 1
+            if ports is None:
+                # looked up one port at a time (see get)
+                ports = OrderedDict()
+            else:
+                self._complete.add(unique_id)
+            return self._ports.setdefault(unique_id, ports)
+
+    def get(self, unique_id, port_name):
+        """Look up a port
+
+        Parameters
+        ----------
+        unique_id : str
+            The component or waveform
+
+        port_name : str
+            The name of the port
+
+        Returns
+        -------
+        entry : PortEntry or None
+            None if the instance or the port does not exist.  direction
+            and repid are None for instances without getPortSet.
+        """
+        port_name = str(port_name)
+        try:
+            ports = self.ports(unique_id)
+        except KeyError:
+            return None
+        entry = ports.get(port_name)
+        if entry is None:
+            if str(unique_id) in self._complete:
+                # the port set is complete, the port does not exist
+                return None
+            instance = get_instance(str(unique_id), self.comp_dict,
+                self.wfm_dict)
+            try:
+                obj_ptr = instance.getPort(port_name)
+            except Exception:
+                return None
+            if obj_ptr is None:
+                return None
+            entry = PortEntry(port_name, obj_ptr, None, None, "")
+            with self._lock:
+                entry = ports.setdefault(port_name, entry)
+        return entry
+
+    def port(self, unique_id, port_name):
+        """The port object (obj_ptr) or None (see get)"""
+        entry = self.get(unique_id, port_name)
+        return None if entry is None else entry.obj_ptr
+
+    def invalidate(self, unique_id=None):
+        """Forget the ports of an instance (or of every instance)"""
+        with self._lock:
+            if unique_id is None:
+                self._ports.clear()
+                self._complete.clear()
+            else:
+                self._ports.pop(str(unique_id), None)
+                self._complete.discard(str(unique_id))
@@ -34,6 +34,8 @@ JSON Format:
 >>>        "throughput":[
 >>>            ["Source0", "dataFloat_out"],
 >>>         ],
+>>>         "throughput_history": "throughput.csv",
+>>>         "bottleneck": 10,
 >>>         "message_sink":[
 >>>             ["Source", "output_msg_port_name"]
 >>>         ]
@@ -41,19 +43,25 @@ JSON Format:
 >>> }
 """
 from ossie.utils import sb, redhawk
-import json
 from collections import OrderedDict
 import time
 import sys
-import uuid
 from pprint import pprint
 import time
 import warnings
-from rh_tools.scene.utils import convert_dict, get_instance
+from rh_tools.domain import domain_tools
+from rh_tools.scene.utils import print_timing
 from rh_tools.scene import component_helper
+from rh_tools.scene.component_pool import ComponentPool
+from rh_tools.scene import connection_graph
 from rh_tools.scene import waveform_helper
+from rh_tools.scene import wiring
 from rh_tools.scene import message_helper
+from rh_tools.scene import scene_cache
 from rh_tools.scene import throughput_helper
+from rh_tools.scene.bottleneck import BottleneckMonitor
+from rh_tools.scene.port_index import PortIndex
+from rh_tools.scene.sampler import Sampler
 if sys.version_info.major == "2":
     # Python2 user prompt
     user_prompt = raw_input
@@ -62,11 +70,12 @@ else:
     user_prompt = input
 TIME_INC = 1 # 1 sec updates
 
-def setup_domains(domain_dict, delay=5):
+def setup_domains(domain_dict, timeout=60.):
     """Setup domains specified
 
     Attempts to attach or kick start a list of domains with the
-    specified device managers.
+    specified device managers.  A kick started domain is polled until
+    its device managers and their devices are registered.
 
     .. warning:: Currently does not support launching device managers
         when attaching to a domain
@@ -77,6 +86,15 @@ def setup_domains(domain_dict, delay=5):
         Dictionary of domain specs.  The key will be the domain name.
         The supported fields include:
             devices_managers : list
+            timeout : float (seconds to wait for the domain, overrides
+                the timeout parameter)
+
+    timeout : float
+        Default number of seconds to wait for each kick started domain.
+
+    Raises
+    ------
+    RuntimeError    If a kick started domain is not ready in time
     """
     active_domains = redhawk.scan()
 
@@ -87,7 +105,7 @@ def setup_domains(domain_dict, delay=5):
         # -----------------------  setup domain instance  -------------------
         if domain in active_domains:
             # attach to active domain
-            dom = redhawk.attach(domain)
+            dom = domain_tools.attach(domain)
 
         else:
             # kick start domain
@@ -97,20 +115,21 @@ def setup_domains(domain_dict, delay=5):
                 # no device managers.. just launch domain
                 dom = redhawk.kickDomain(domain, kick_device_managers=False)
 
-            # allow delay x number of device managers to load
-            time.sleep(delay * len(dev_mgrs))
+            # wait only as long as the device managers need to register
+            tic = time.time()
+            dom = domain_tools.wait_for_domain(domain, dev_mgrs,
+                timeout=domain_dict[domain].get("timeout", timeout))
+            print("Domain %s ready in %.2f sec"%(domain, time.time() - tic))
 
         # -----------------------  check device managers  -------------------
-        if dev_mgrs:
-            # check if device managers have been loaded
-            for dev_mgr in dev_mgrs:
-                if dev_mgr not in dom.devMgrs:
-                    warnings.warn("Have not implemented setting up device"+\
-                        " managers on an active domain")
+        if domain_tools.missing_device_managers(dom, dev_mgrs):
+            warnings.warn("Have not implemented setting up device"+\
+                " managers on an active domain")
 
 
 
-def load_and_run_scenario(json_file, time_inc=1, wfm=""):
+def load_and_run_scenario(json_file, time_inc=1, wfm="", workers=1,
+        tp_inc=None, msg_inc=None, cache_dir=None, pool=None):
     """Load a scenario and run
 
     Parameters
@@ -121,15 +140,40 @@ def load_and_run_scenario(json_file, time_inc=1, wfm=""):
 
     time_inc : float
         Time increment to run simulation.  After each increment, check
-        the debug (throughput)
+        the debug (throughput and messages)
 
     wfm : str
         Specify a file to save the scenario to waveform.
         Don't save if empty string
+
+    workers : int
+        Number of components/waveforms launched, started, stopped
+        (and waveforms released), and of connections made, concurrently
+
+    tp_inc : float or None
+        Seconds between throughput samples (time_inc if None)
+
+    msg_inc : float or None
+        Seconds between message sink checks (time_inc if None)
+
+    cache_dir : str or None
+        Directory caching the compiled scene files (see scene_cache).
+        None compiles the scene on every run.
+
+    pool : ComponentPool or None
+        If specified, components are taken from the pool and returned to
+        it at the end of the scene (see component_pool)
     """
+    start_layers = stop_layers = None
     if isinstance(json_file, str):
-        settings = json.load(open(json_file), encoding='ascii')
-        settings = convert_dict(settings)
+        # parse, validate and precompute (or load all of it from the cache)
+        tic = time.time()
+        compiled, cached = scene_cache.load_scene(json_file, cache_dir)
+        print("Scene %s in %.3f sec"%("loaded from cache" if cached else
+            "compiled", time.time() - tic))
+        settings = compiled["settings"]
+        start_layers = compiled["start_layers"]
+        stop_layers = compiled["stop_layers"]
     elif isinstance(json_file, dict):
         settings = json_file
     else:
@@ -147,32 +191,45 @@ def load_and_run_scenario(json_file, time_inc=1, wfm=""):
         setup_domains(domain_specs)
 
     # ---------------------------  load components  -------------------------
-    comp_dict = component_helper.launch_components(sb, comp_specs)
+    timing = OrderedDict()
+    comp_dict = component_helper.launch_components(sb, comp_specs,
+        workers=workers, timing=timing, pool=pool)
+    print_timing("Component startup (sec)", timing)
 
     # --------------------------  load waveforms  ---------------------------
-    wfm_dict = waveform_helper.launch_waveforms(wave_specs)
+    wfm_timing = OrderedDict()
+    wfm_dict = waveform_helper.launch_waveforms(wave_specs,
+        workers=workers, timing=wfm_timing)
+    print_timing("Waveform startup (sec)", wfm_timing)
+
+    # ------------------  index the ports of every instance  ----------------
+    port_index = PortIndex(comp_dict, wfm_dict)
+    port_index.build(workers)
 
     # ----------------------  connect message sinks  ------------------------
     msg_sinks, msg_store = message_helper.connect_msg_sinks(
-        sb, comp_dict, wfm_dict, debug)
+        sb, comp_dict, wfm_dict, debug, port_index=port_index)
 
     # -------------------------  setup connections  -------------------------
-    for conn in conns:
-        try:
-            obj_1 = get_instance(conn[0], comp_dict, wfm_dict)
-            port_1 = obj_1.getPort(str(conn[1]))
-            obj_2 = get_instance(conn[2], comp_dict, wfm_dict)
-            port_2 = obj_2.getPort(str(conn[3]))
-            port_1.connectPort(port_2,
-                "conn_%s_to_%s_"%(str(conn[0]), str(conn[2]))\
-                + str(uuid.uuid1()))
-        except Exception as e:
-            print("Error running connection %s"%str(conn))
-            raise
+    # resolve and check every connection, then connect concurrently
+    conn_ids = wiring.wire_scene(conns, port_index, workers)
+
     # ---------------------------  setup debug  ---------------------------
     throughput_ports = throughput_helper.setup_throughput(
         debug.get("throughput", []),
-        comp_dict=comp_dict, wfm_dict=wfm_dict)
+        comp_dict=comp_dict, wfm_dict=wfm_dict, port_index=port_index)
+    monitor = throughput_helper.ThroughputMonitor(throughput_ports,
+        workers=workers)
+
+    # tap every connection to find the bottleneck ("bottleneck": true or
+    # the seconds between reports)
+    bottleneck = None
+    report_period = debug.get("bottleneck", False)
+    if report_period:
+        bottleneck = BottleneckMonitor(conns, comp_dict, wfm_dict,
+            workers=workers, port_index=port_index, conn_ids=conn_ids)
+        if isinstance(report_period, bool):
+            report_period = 10.
 
     # --------------------------  save waveform  ----------------------------
     if wfm:
@@ -185,22 +242,32 @@ def load_and_run_scenario(json_file, time_inc=1, wfm=""):
     # --------------------------  run simulation  ---------------------------
     if simm["type"].lower() in ["time"]:
         print("In time simulation")
-        waveform_helper.start_waveforms(wfm_dict)
-        component_helper.start_in_reverse_order(comp_dict)
-
-        tic = time.time()
-        while time.time() - tic < simm["value"]["duration"]:
-            # show message being passed
-            message_helper.show_messages(msg_sinks, msg_store)
-
-            # show port throughput statistics
-            throughput_helper.show_throughput(throughput_ports)
-
-            # sleep a little
-            time.sleep(time_inc)
-
-        component_helper.stop_in_order(comp_dict)
-        waveform_helper.stop_waveforms(wfm_dict)
+        # start sinks first, independent instances in parallel
+        connection_graph.start_scene(comp_dict, wfm_dict, conns, workers,
+            layers=start_layers)
+
+        # sample the debug taps in the background at fixed rates
+        sampler = Sampler()
+        if msg_sinks:
+            sampler.add("messages", lambda: message_helper.show_messages(
+                msg_sinks, msg_store), msg_inc or time_inc)
+        if throughput_ports:
+            sampler.add("throughput", lambda: (monitor.poll(), monitor.show()),
+                tp_inc or time_inc)
+        if bottleneck is not None:
+            sampler.add("bottleneck", bottleneck.poll, tp_inc or time_inc)
+            sampler.add("bottleneck_report", bottleneck.print_report,
+                report_period)
+        sampler.start()
+        time.sleep(simm["value"]["duration"])
+        sampler.stop()
+        sampler.print_timing()
+        if bottleneck is not None:
+            bottleneck.print_report()
+
+        # stop sources first, so data drains through the scene
+        connection_graph.stop_scene(comp_dict, wfm_dict, conns, workers,
+            layers=stop_layers)
         #sb.stop()
 
     elif simm["type"].lower() in ["user"]:
@@ -216,21 +283,57 @@ def load_and_run_scenario(json_file, time_inc=1, wfm=""):
     if msg_store:
         message_helper.save_messages(msg_store)
 
-    # TODO: release components/waveforms/devices/domains
-    waveform_helper.release_waveforms(wfm_dict)
+    # TODO: release devices/domains (and components without a pool)
+    wfm_timing = OrderedDict()
+    waveform_helper.release_waveforms(wfm_dict, workers=workers,
+        timing=wfm_timing)
+    print_timing("Waveform release (sec)", wfm_timing)
+    if pool is not None:
+        # stopped and disconnected, kept for the next scene
+        pool.release_all(comp_dict, workers=workers)
+    monitor.print_summary()
+    if debug.get("throughput_history") and monitor.history:
+        monitor.save(debug["throughput_history"])
     throughput_helper.close(throughput_ports)
 
 if __name__ == "__main__":
     # ------------------------  parse input arguments  ----------------------
     from argparse import ArgumentParser
     parser = ArgumentParser()
-    parser.add_argument("json", help="Scene config stored in json")
+    parser.add_argument("json", nargs="+",
+        help="Scene config stored in json (several run one after the other)")
     parser.add_argument("--time_inc", default=1, type=float,
         help="Time inc to run")
     parser.add_argument("--out", default="",
         help="The output file to save waveform")
+    parser.add_argument("--workers", default=1, type=int,
+        help="Number of components/waveforms launched concurrently")
+    parser.add_argument("--tp_inc", default=None, type=float,
+        help="Seconds between throughput samples (default time_inc)")
+    parser.add_argument("--msg_inc", default=None, type=float,
+        help="Seconds between message sink checks (default time_inc)")
+    parser.add_argument("--cache", default=None,
+        help="Directory caching the compiled scene (skip parsing/validation)")
+    parser.add_argument("--pool", default=None, type=int,
+        help="Idle components kept between scenes (default 16 with several"+\
+            " scenes, 0 to launch every component)")
     args = parser.parse_args()
 
     # ---------------------------------  process  ---------------------------
-    # run the simulation
-    load_and_run_scenario(args.json, time_inc=args.time_inc, wfm=args.out)
\ No newline at end of file
+    # run the simulations, reusing the components of the previous scenes
+    max_idle = args.pool
+    if max_idle is None:
+        max_idle = 16 if len(args.json) > 1 else 0
+    pool = ComponentPool(sb, max_idle=max_idle) if max_idle > 0 else None
+    try:
+        for json_file in args.json:
+            print("Running %s"%json_file)
+            load_and_run_scenario(json_file, time_inc=args.time_inc,
+                wfm=args.out, workers=args.workers, tp_inc=args.tp_inc,
+                msg_inc=args.msg_inc, cache_dir=args.cache, pool=pool)
+            if pool is not None:
+                print("Component pool: %s"%", ".join("%s %d"%item
+                    for item in pool.stats().items()))
+    finally:
+        if pool is not None:
+            pool.close()
\ No newline at end of file
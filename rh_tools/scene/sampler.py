@@ -0,0 +1,141 @@
+"""
+Run debug taps periodically in background threads.
+
+Each task of a Sampler runs in its own daemon thread at a fixed rate.  Ticks
+are scheduled from the start time (start + n * period), so the time spent
+in the task does not stretch the period.  A pass that overruns its period
+skips the ticks it missed instead of running back to back.
+"""
+from collections import OrderedDict
+import threading
+import time
+from rh_tools.scene.utils import summarize
+
+class SampledTask(object):
+    """A function called at a fixed rate
+
+    Parameters
+    ----------
+    name : str
+        Name used in the timing table
+
+    func : callable
+        Function called with no arguments on each tick
+
+    period : float
+        Seconds between ticks
+    """
+    def __init__(self, name, func, period):
+        if period <= 0:
+            raise ValueError("Expecting a positive period for %s"%name)
+        self.name = name
+        self.func = func
+        self.period = period
+        self.durations = []
+        self.skipped = 0
+        self.errors = 0
+
+    def run_once(self):
+        """Call the function, recording how long it took"""
+        tic = time.time()
+        try:
+            self.func()
+        except Exception as e:
+            self.errors += 1
+            print("Sampling %s failed: %s"%(self.name, str(e)))
+        self.durations.append(time.time() - tic)
+
+    def run(self, stop_event):
+        """Call the function every period until stop_event is set"""
+        next_tick = time.time()
+        while not stop_event.is_set():
+            self.run_once()
+            next_tick += self.period
+            now = time.time()
+            if now > next_tick:
+                # overran, skip the missed ticks to stay on the grid
+                missed = int((now - next_tick) / self.period) + 1
+                self.skipped += missed
+                next_tick += missed * self.period
+            stop_event.wait(next_tick - now)
+
+class Sampler(object):
+    """Run several SampledTask in background threads"""
+    def __init__(self):
+        self.tasks = OrderedDict()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def add(self, name, func, period):
+        """Add a task (before start)
+
+        Parameters
+        ----------
+        name : str
+            Unique name of the task
+
+        func : callable
+            Function called with no arguments on each tick
+
+        period : float
+            Seconds between ticks
+        """
+        self.tasks[name] = SampledTask(name, func, period)
+
+    def start(self):
+        """Start a thread per task"""
+        self._stop.clear()
+        for task in self.tasks.values():
+            thread = threading.Thread(target=task.run, args=(self._stop,),
+                name="sampler_" + task.name)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, flush=True):
+        """Stop the threads
+
+        Parameters
+        ----------
+        flush : bool
+            Run each task one last time after its thread stopped, so data
+            received since the last tick is collected.
+        """
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if flush:
+            for task in self.tasks.values():
+                task.run_once()
+
+    def timing(self):
+        """Statistics of the time spent per pass
+
+        Returns
+        -------
+        timing : OrderedDict
+            Dictionary of task name to dictionary with passes, skipped,
+            errors and the min/mean/max/p95 seconds of a pass
+        """
+        timing = OrderedDict()
+        for name, task in self.tasks.items():
+            stats = summarize(task.durations)
+            stats.update(passes=len(task.durations), skipped=task.skipped,
+                errors=task.errors)
+            timing[name] = stats
+        return timing
+
+    def print_timing(self):
+        """Print the pass timing as a table"""
+        timing = self.timing()
+        if not timing:
+            return
+        width = max(len(name) for name in timing)
+        print("%-*s %7s %7s %7s %10s %10s %10s %10s"%(width, "Sampling",
+            "passes", "skipped", "errors", "min (s)", "mean (s)", "max (s)",
+            "p95 (s)"))
+        for name, stats in timing.items():
+            print("%-*s %7d %7d %7d %10.4f %10.4f %10.4f %10.4f"%(width, name,
+                stats["passes"], stats["skipped"], stats["errors"],
+                stats["min"], stats["mean"], stats["max"], stats["p95"]))
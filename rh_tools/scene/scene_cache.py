@@ -0,0 +1,189 @@
+"""
+Compile scene files once and cache the result on disk.
+
+Compiling a scene parses and normalizes the JSON (see utils.load_json),
+validates it, resolves the component catalog names to their SPD files in
+$SDRROOT and computes the start/stop layers of the connection graph.  The
+compiled scene is pickled under a key hashed from the file content and
+$SDRROOT, so repeated runs of an unchanged scene go straight to launching.
+Editing the scene changes the key, stale entries are simply not used.
+"""
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+from rh_tools.scene.connection_graph import topological_layers
+from rh_tools.scene.utils import parse_json
+
+# bump when the compiled representation changes
+COMPILE_VERSION = 1
+
+def default_sdrroot():
+    """$SDRROOT, or the REDHAWK default"""
+    return os.environ.get("SDRROOT", "/var/redhawk/sdr")
+
+def scene_hash(text, sdrroot=None):
+    """Cache key of a scene file content
+
+    Parameters
+    ----------
+    text : str or bytes
+        The content of the scene file
+
+    sdrroot : str or None
+        The SDR root the catalog names are resolved against
+
+    Returns
+    -------
+    key : str
+        Hex digest
+    """
+    if not isinstance(text, bytes):
+        text = text.encode("utf-8")
+    digest = hashlib.sha1()
+    digest.update(("%d:%s:"%(COMPILE_VERSION, sdrroot or "")).encode("utf-8"))
+    digest.update(text)
+    return digest.hexdigest()
+
+def resolve_spd(key, sdrroot):
+    """Path of the SPD file of a component catalog name
+
+    Components are installed as $SDRROOT/dom/components/<a>/<b>/<b>.spd.xml
+    for the name "a.b".
+
+    Returns
+    -------
+    spd : str or None
+        None if the file does not exist (sb.launch then resolves the name)
+    """
+    parts = str(key).split(".")
+    spd = os.path.join(sdrroot, "dom", "components", *parts)
+    spd = os.path.join(spd, parts[-1] + ".spd.xml")
+    return spd if os.path.isfile(spd) else None
+
+def validate_scene(settings):
+    """Check the structure of a scene
+
+    Parameters
+    ----------
+    settings : dict
+        The scene (see run_custom)
+
+    Returns
+    -------
+    errors : list
+        Description of every problem found
+    """
+    errors = []
+    for field in ("connections", "simulation"):
+        if field not in settings:
+            errors.append("missing \"%s\""%field)
+    comps = settings.get("components", {})
+    wfms = settings.get("waveforms", {})
+    for unique_id in set(comps) & set(wfms):
+        errors.append("%s is both a component and a waveform"%unique_id)
+    for unique_id in comps:
+        if "key" not in comps[unique_id]:
+            errors.append("component %s has no \"key\""%unique_id)
+    known = set(comps) | set(wfms)
+    for conn in settings.get("connections", []):
+        if len(conn) != 4:
+            errors.append("connection %s should be [uses_id, uses_port, "
+                "provides_id, provides_port]"%str(conn))
+            continue
+        for unique_id in (conn[0], conn[2]):
+            if unique_id not in known:
+                errors.append("connection %s: unknown instance %s"%(
+                    str(conn), unique_id))
+    simm = settings.get("simulation", {})
+    if "simulation" in settings and str(simm.get("type", "")).lower()\
+            not in ("time", "user"):
+        errors.append("simulation type should be \"time\" or \"user\"")
+    return errors
+
+def compile_scene(settings, sdrroot=None):
+    """Validate a scene and precompute what does not depend on a run
+
+    Parameters
+    ----------
+    settings : dict
+        The normalized scene
+
+    sdrroot : str or None
+        Where to resolve the component SPD files (default_sdrroot if None)
+
+    Returns
+    -------
+    compiled : dict
+        "settings" (each component spec gets an "spd" entry when its SPD
+        file was found), "start_layers" and "stop_layers"
+
+    Raises
+    ------
+    ValueError  Listing every problem of an invalid scene
+    """
+    errors = validate_scene(settings)
+    if errors:
+        raise ValueError("Invalid scene:\n    " + "\n    ".join(errors))
+    sdrroot = sdrroot or default_sdrroot()
+
+    for spec in settings.get("components", {}).values():
+        spd = resolve_spd(spec["key"], sdrroot)
+        if spd:
+            spec["spd"] = spd
+
+    nodes = list(settings.get("waveforms", {}).keys()) +\
+        list(settings.get("components", {}).keys())
+    conns = settings["connections"]
+    return OrderedDict([
+        ("settings", settings),
+        ("start_layers", topological_layers(nodes, conns, sink_first=True)),
+        ("stop_layers", topological_layers(nodes, conns, sink_first=False)),
+    ])
+
+def load_scene(filename, cache_dir=None, sdrroot=None):
+    """Load a compiled scene, from the cache when possible
+
+    Parameters
+    ----------
+    filename : str
+        The scene JSON file
+
+    cache_dir : str or None
+        Directory of the cache.  None compiles without caching.
+
+    sdrroot : str or None
+        See compile_scene
+
+    Returns
+    -------
+    compiled : dict
+        See compile_scene
+
+    cached : bool
+        True if loaded from the cache
+    """
+    sdrroot = sdrroot or default_sdrroot()
+    with open(filename, "rb") as fid:
+        text = fid.read()
+
+    path = None
+    if cache_dir:
+        path = os.path.join(cache_dir, scene_hash(text, sdrroot) + ".pickle")
+        if os.path.isfile(path):
+            try:
+                with open(path, "rb") as fid:
+                    return pickle.load(fid), True
+            except Exception as e:
+                print("Ignoring unreadable scene cache %s: %s"%(path, str(e)))
+
+    compiled = compile_scene(parse_json(text.decode("utf-8")), sdrroot)
+    if path:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # write then rename, concurrent runs never read a partial file
+        tmp = "%s.%d.tmp"%(path, os.getpid())
+        with open(tmp, "wb") as fid:
+            pickle.dump(compiled, fid, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)
+    return compiled, False
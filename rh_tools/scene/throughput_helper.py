@@ -1,6 +1,23 @@
+"""
+Throughput measurements of bulkio ports.
+
+show_throughput prints the elements per second of the first connection of
+each port.  ThroughputMonitor reads the full BULKIO PortStatistics of every
+port (concurrently), keeps a timestamped history per port in a ring
+buffer and summarizes or saves it.
+"""
+from collections import deque, OrderedDict
+import csv
 import sys
-from rh_tools.scene.utils import get_instance
-def setup_throughput(tp_list, comp_dict, wfm_dict):
+import threading
+import time
+import numpy
+from rh_tools.scene.utils import get_instance, run_in_pool, summarize
+
+# fields of BULKIO::PortStatistics recorded by ThroughputMonitor
+STAT_FIELDS = ("elementsPerSecond", "bitsPerSecond", "callsPerSecond",
+    "averageQueueDepth", "timeSinceLastCall")
+def setup_throughput(tp_list, comp_dict, wfm_dict, port_index=None):
     """Setup the throughput ports dictionary
 
     The dictionary will describe the input source
@@ -19,6 +36,9 @@ def setup_throughput(tp_list, comp_dict, wfm_dict):
         This can be a 2 tuple (component_id, port_name)
         If 4, (component_id, port_name, out_file, file_access)
 
+    port_index : PortIndex or None
+        If specified, the ports are looked up in the shared index
+
     Returns
     -------
     tp_ports : dict
@@ -46,7 +66,8 @@ def setup_throughput(tp_list, comp_dict, wfm_dict):
             throughput_ports[tmp_name] = {
                 "object": tmp_c,
                 "port": tmp_p,
-                "instance":instance.getPort(tmp_p),
+                "instance":instance.getPort(tmp_p) if port_index is None\
+                    else port_index.port(tmp_c, tmp_p),
                 "out":fid,
             }
 
@@ -91,10 +112,204 @@ def write_header(tp_ports):
 def close(tp_ports):
     """Close the file out
 
+    Standard output/error (the default output) are left open, so later
+    scenes and prints of the same process can still use them.
+
     Parameters
     ----------
     throughput_ports : dict
         Dictionary of throughput ports from setup_throughput
     """
     for key in tp_ports:
-        tp_ports[key]["out"].close()
+        fid = tp_ports[key]["out"]
+        if fid in (sys.stdout, sys.stderr, sys.__stdout__, sys.__stderr__):
+            fid.flush()
+        else:
+            fid.close()
+
+def read_statistics(port_inst):
+    """Read the statistics of a bulkio port
+
+    Uses ports report a UsesPortStatistics per connection, provides ports
+    report a single PortStatistics.
+
+    Parameters
+    ----------
+    port_inst : bulkio port
+        The port (from getPort)
+
+    Returns
+    -------
+    stats : list
+        List of (connection id, values) where values follow STAT_FIELDS.
+        The connection id of a provides port is "".
+    """
+    port_stats = port_inst.statistics
+    if hasattr(port_stats, "elementsPerSecond"):
+        port_stats = [("", port_stats)]
+    else:
+        port_stats = [(str(conn.connectionId), conn.statistics)
+            for conn in port_stats]
+    return [(conn_id, tuple(float(getattr(stats, field))
+            for field in STAT_FIELDS))
+        for conn_id, stats in port_stats]
+
+class ThroughputMonitor(object):
+    """Poll the statistics of throughput ports into a ring buffer
+
+    Parameters
+    ----------
+    tp_ports : dict
+        Throughput ports from setup_throughput
+
+    history : int
+        Number of samples kept per port connection
+
+    workers : int
+        Number of ports read at the same time
+    """
+    def __init__(self, tp_ports, history=3600, workers=1):
+        self.ports = tp_ports
+        self.workers = workers
+        self.history = OrderedDict()
+        self._maxlen = history
+        self.errors = OrderedDict((key, 0) for key in tp_ports)
+        self.latest = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _read(self, key):
+        stats = read_statistics(self.ports[key]["instance"])
+        return time.time(), stats
+
+    def poll(self):
+        """Read the statistics of every port once
+
+        Returns
+        -------
+        elapsed : float
+            Seconds spent reading the ports
+        """
+        tic = time.time()
+        keys = list(self.ports)
+        results = run_in_pool(self._read, keys, self.workers)
+        for key, (result, error, _) in zip(keys, results):
+            if error is not None:
+                self.errors[key] += 1
+                print("Failed to read statistics of %s: %s"%(key, str(error)))
+                continue
+            timestamp, stats = result
+            with self._lock:
+                self.latest[key] = stats
+                for conn_id, values in stats:
+                    label = "%s[%s]"%(key, conn_id) if conn_id else key
+                    if label not in self.history:
+                        self.history[label] = deque(maxlen=self._maxlen)
+                    self.history[label].append((timestamp,) + values)
+        return time.time() - tic
+
+    def samples(self, label=None):
+        """Copy of the history (safe while another thread polls)
+
+        Parameters
+        ----------
+        label : str or None
+            The port (and connection).  None copies every port.
+
+        Returns
+        -------
+        samples : list or OrderedDict
+            List of (time,) + STAT_FIELDS values for a label, otherwise
+            a dictionary of label to such list
+        """
+        with self._lock:
+            if label is not None:
+                return list(self.history.get(label, []))
+            return OrderedDict((key, list(rows))
+                for key, rows in self.history.items())
+
+    def show(self):
+        """Write the last elements per second of each port
+
+        Same output as show_throughput (first connection of each port),
+        without reading the ports again.
+        """
+        for key in self.ports:
+            stats = self.latest.get(key)
+            if not stats:
+                continue
+            c_port = self.ports[key]
+            c_port["out"].write("%s,%s,%s\n"%(c_port["object"], c_port["port"],
+                str(stats[0][1][0])))
+
+    def summary(self, field="elementsPerSecond", window=None):
+        """Summarize a statistic over the history
+
+        Parameters
+        ----------
+        field : str
+            One of STAT_FIELDS
+
+        window : int or None
+            Only use the last window samples.  None uses the whole history.
+
+        Returns
+        -------
+        summaries : OrderedDict
+            Dictionary of port (and connection) to the min, mean, max and
+            p95 of the field
+        """
+        col = STAT_FIELDS.index(field) + 1
+        summaries = OrderedDict()
+        for label, samples in self.samples().items():
+            if window:
+                samples = samples[-window:]
+            summaries[label] = summarize([row[col] for row in samples])
+        return summaries
+
+    def print_summary(self, field="elementsPerSecond", window=None):
+        """Print the summary of a statistic as a table"""
+        summaries = self.summary(field, window)
+        if not summaries:
+            return
+        width = max(len(label) for label in summaries)
+        print("%-*s %14s %14s %14s %14s"%(width, field,
+            "min", "mean", "max", "p95"))
+        for label, values in summaries.items():
+            print("%-*s %14.1f %14.1f %14.1f %14.1f"%(width, label,
+                values["min"], values["mean"], values["max"], values["p95"]))
+
+    def to_array(self):
+        """The history as a NumPy structured array
+
+        Returns
+        -------
+        samples : numpy.ndarray
+            Fields are time, port and the STAT_FIELDS, sorted by time
+        """
+        history = self.samples()
+        width = max([len(label) for label in history] + [1])
+        dtype = numpy.dtype([("time", numpy.float64), ("port", "U%d"%width)] +
+            [(field, numpy.float64) for field in STAT_FIELDS])
+        rows = [(row[0], label) + tuple(row[1:])
+            for label, samples in history.items() for row in samples]
+        samples = numpy.array(rows, dtype=dtype)
+        return numpy.sort(samples, order=["time", "port"])
+
+    def save(self, filename):
+        """Save the history as a time series
+
+        Parameters
+        ----------
+        filename : str
+            A ".npy" file stores the structured array of to_array,
+            anything else is written as CSV.
+        """
+        samples = self.to_array()
+        if filename.endswith(".npy"):
+            numpy.save(filename, samples)
+            return
+        with open(filename, "w") as fid:
+            writer = csv.writer(fid)
+            writer.writerow(samples.dtype.names)
+            for row in samples.tolist():
+                writer.writerow(row)
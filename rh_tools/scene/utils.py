@@ -1,4 +1,14 @@
 from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+import array
+import json
+import sys
+import time
+import numpy
+if sys.version_info.major > 2:
+    # json already returns str
+    unicode = str
+    long = int
 def convert_dict(my_dict):
     """Convert dictionary from json load.
 
@@ -108,4 +118,255 @@ def get_instance(unique_id, comp_dict, wfm_dict):
     elif unique_id in wfm_dict:
         return wfm_dict[unique_id]
     else:
-        return None
\ No newline at end of file
+        return None
+
+def run_in_pool(func, items, workers=1):
+    """Call func on each item using a pool of threads
+
+    Parameters
+    ----------
+    func : callable
+        Function called with a single item
+
+    items : list
+        The items to process
+
+    workers : int
+        Number of threads.  1 (or a single item) runs in the calling
+        thread.
+
+    Returns
+    -------
+    results : list
+        List of (result, exception, elapsed seconds) in the order of
+        items.  result is None if func raised.
+    """
+    def timed(item):
+        tic = time.time()
+        try:
+            return func(item), None, time.time() - tic
+        except Exception as e:
+            return None, e, time.time() - tic
+
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [timed(item) for item in items]
+
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        return pool.map(timed, items)
+    finally:
+        pool.close()
+        pool.join()
+
+def print_timing(title, timing):
+    """Print a table of per-instance timing
+
+    Parameters
+    ----------
+    title : str
+        Title of the table
+
+    timing : OrderedDict
+        Dictionary of unique id to dictionary of step name to seconds
+    """
+    if not timing:
+        return
+    steps = []
+    for key in timing:
+        steps += [step for step in timing[key] if step not in steps]
+    width = max(len(str(key)) for key in timing)
+    print("%s\n%s"%(title, "-" * len(title)))
+    print("%-*s %s"%(width, "", " ".join("%10s"%step for step in steps)))
+    for key in timing:
+        print("%-*s %s"%(width, str(key), " ".join(
+            "%10.3f"%timing[key][step] if step in timing[key] else " " * 10
+            for step in steps)))
+
+def summarize(values):
+    """Get the min, mean, max and 95th percentile of a list of values"""
+    if not values:
+        return {"min": 0., "mean": 0., "max": 0., "p95": 0.}
+    ordered = sorted(values)
+    return {
+        "min": ordered[0],
+        "mean": sum(ordered) / float(len(ordered)),
+        "max": ordered[-1],
+        "p95": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+    }
+
+# ------------------------------  json loading  -----------------------------
+def _numeric_array(values, arrays):
+    """Pack a list of numbers
+
+    Returns None if it is not all numbers, or if they do not fit the
+    array type.
+    """
+    is_float = False
+    for val in values:
+        if val.__class__ is float:
+            is_float = True
+        elif val.__class__ is not int and val.__class__ is not long:
+            # bool, str, list, dict or None
+            return None
+    try:
+        if arrays == "numpy":
+            return numpy.array(values,
+                dtype=numpy.float64 if is_float else numpy.int64)
+        return array.array("d" if is_float else "l", values)
+    except OverflowError:
+        # integers beyond int64/C long, kept as a list
+        return None
+
+def _convert_list_values(values, arrays, min_array):
+    """Convert the strings (and numeric arrays) of a decoded list in place
+
+    Dictionaries in the list are already converted by the object hook.
+    """
+    if arrays and len(values) >= min_array:
+        packed = _numeric_array(values, arrays)
+        if packed is not None:
+            return packed
+    for ind, val in enumerate(values):
+        if val.__class__ is unicode:
+            values[ind] = str(val)
+        elif val.__class__ is list:
+            values[ind] = _convert_list_values(val, arrays, min_array)
+    return values
+
+def parse_json(text, arrays=None, min_array=16):
+    """Decode JSON into OrderedDict with str keys and values
+
+    The conversion is done by the decoder's object_pairs_hook while the
+    text is parsed, so the result is not copied a second time as with
+    convert_dict.
+
+    Parameters
+    ----------
+    text : str
+        The JSON text
+
+    arrays : str or None
+        "array" stores lists of numbers as array.array ("d" or "l"),
+        "numpy" as NumPy arrays (float64 or int64).  None keeps lists.
+
+    min_array : int
+        Shorter lists of numbers stay lists
+
+    Returns
+    -------
+    out : OrderedDict, list or value
+        Same structure as convert_dict(json.loads(text))
+    """
+    py2 = unicode is not str
+    if not py2 and not arrays:
+        # nothing to convert, let the decoder build the OrderedDicts
+        return json.loads(text, object_pairs_hook=OrderedDict)
+
+    def hook(pairs):
+        out = OrderedDict()
+        for key, val in pairs:
+            cls = val.__class__
+            if cls is unicode:
+                val = str(val)
+            elif cls is list:
+                val = _convert_list_values(val, arrays, min_array)
+            out[str(key) if py2 else key] = val
+        return out
+
+    out = json.loads(text, object_pairs_hook=hook)
+    if out.__class__ is list:
+        out = _convert_list_values(out, arrays, min_array)
+    elif out.__class__ is unicode:
+        out = str(out)
+    return out
+
+def load_json(filename, arrays=None, min_array=16):
+    """Load a JSON file (see parse_json)
+
+    Parameters
+    ----------
+    filename : str
+        Path of the JSON file
+
+    arrays : str or None
+        See parse_json
+
+    min_array : int
+        See parse_json
+
+    Returns
+    -------
+    out : OrderedDict, list or value
+    """
+    with open(filename, "r") as fid:
+        return parse_json(fid.read(), arrays, min_array)
+
+def benchmark_load(n_components=2000, n_props=10, array_size=256, repeat=3):
+    """Time load_json against json.loads + convert_dict on a synthetic scene
+
+    Parameters
+    ----------
+    n_components : int
+        Number of components in the scene
+
+    n_props : int
+        String properties per component
+
+    array_size : int
+        Length of the numeric array property of each component
+
+    repeat : int
+        Number of runs, the best is reported
+
+    Returns
+    -------
+    results : OrderedDict
+        Dictionary of loader name to seconds
+    """
+    scene = OrderedDict([("components", OrderedDict(
+        ("comp_%d"%ind, OrderedDict([("key", "rh.Component"), ("val",
+            OrderedDict([("prop_%d"%prop, "value_%d"%prop)
+                for prop in range(n_props)] +
+            [("taps", [0.5 * tap for tap in range(array_size)])]))]))
+        for ind in range(n_components))),
+        ("connections", [["comp_%d"%ind, "out", "comp_%d"%(ind + 1), "in"]
+            for ind in range(n_components - 1)])])
+    text = json.dumps(scene)
+
+    runs = [
+        ("convert_dict", lambda: convert_dict(json.loads(text))),
+        ("load_json", lambda: parse_json(text)),
+        ("load_json (array)", lambda: parse_json(text, arrays="array")),
+        ("load_json (numpy)", lambda: parse_json(text, arrays="numpy")),
+    ]
+    results = OrderedDict()
+    for name, func in runs:
+        best = None
+        for ind in range(repeat):
+            tic = time.time()
+            func()
+            elapsed = time.time() - tic
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = best
+    return results
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="Benchmark the scene JSON loaders")
+    parser.add_argument("--components", default=2000, type=int,
+        help="Number of components in the synthetic scene")
+    parser.add_argument("--props", default=10, type=int,
+        help="String properties per component")
+    parser.add_argument("--array", default=256, type=int,
+        help="Length of the numeric array property")
+    parser.add_argument("--repeat", default=3, type=int,
+        help="Number of runs per loader (best is reported)")
+    args = parser.parse_args()
+
+    results = benchmark_load(args.components, args.props, args.array,
+        args.repeat)
+    base = results["convert_dict"]
+    for name in results:
+        print("%-18s %10.4f sec  (x%.2f)"%(name, results[name],
+            base / results[name]))
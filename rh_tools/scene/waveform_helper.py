@@ -1,7 +1,9 @@
 from collections import OrderedDict
 from ossie.utils import redhawk
+from rh_tools.domain import domain_tools
+from rh_tools.scene.utils import run_in_pool
 import bulkio
-def get_domain(domain, devices=[]):
+def get_domain(domain, devices=[], active_domains=None, timeout=60.):
     """Get the domain
 
     .. warn:: Enforcing device list has not been implemented
@@ -14,8 +16,19 @@ def get_domain(domain, devices=[]):
 
     devices : list
         List of devices to launch with the domain.
+
+    active_domains : list or None
+        The result of redhawk.scan(), if already known.
+
+    timeout : float
+        Seconds to wait for a kick started domain to be ready
+
+    Raises
+    ------
+    RuntimeError    If a kick started domain is not ready in time
     """
-    active_domains = redhawk.scan()
+    if active_domains is None:
+        active_domains = redhawk.scan()
     if domain in active_domains:
         # domain exists, just attach
         dom = redhawk.attach(domain)
@@ -26,12 +39,17 @@ def get_domain(domain, devices=[]):
         else:
             dom = redhawk.kickDomain(domain, kick_device_managers=False)
 
+        # wait for the domain and device managers to register (by the
+        # name of the domain kicked, domain may be None for the default)
+        dom = domain_tools.wait_for_domain(str(dom.name), devices,
+            timeout=timeout)
+
     # TODO: check that devices is available, otherwise launch them now
     pass
 
     return dom
 
-def launch_waveform(wfm_name, wfm_config, domain=None, devices=[]):
+def launch_waveform(wfm_name, wfm_config, domain=None, devices=[], dom=None):
     """Launch waveform and return waveform instance
 
     .. warn:: Waveforms require an active GPP node on the domain.
@@ -50,6 +68,10 @@ def launch_waveform(wfm_name, wfm_config, domain=None, devices=[]):
     devices : list
         Devices to launch.
 
+    dom : ossie.utils.redhawk.core.Domain or None
+        The domain instance, if already attached.  domain and devices
+        are then ignored.
+
     Returns
     -------
     wfm_inst : ossie.utils.redhawk.core.App
@@ -63,7 +85,8 @@ def launch_waveform(wfm_name, wfm_config, domain=None, devices=[]):
     ApplicationInstallationError Invalid name or waveform not installed
     """
     # get the domain to launch waveform from
-    dom = get_domain(domain, devices)
+    if dom is None:
+        dom = get_domain(domain, devices)
 
     # get a unique name
     ts = bulkio.timestamp.now()
@@ -81,6 +104,9 @@ def launch_waveform(wfm_name, wfm_config, domain=None, devices=[]):
 def get_port(wfm_inst, port_name):
     """Get the port from the waveform described by the name
 
+    .. note:: This fetches the whole port set on every call, use
+        port_index.PortIndex for repeated lookups.
+
     Parameters
     ----------
     wfm_inst : ossie.utils.redhawk.core.App
@@ -100,13 +126,21 @@ def get_port(wfm_inst, port_name):
     # return None, if port not found
     return None
 
-def release_waveforms(wfm_dict):
+def release_waveforms(wfm_dict, workers=1, timing=None):
     """Release waveforms
 
     Parameters
     ----------
     wfm_dict : dict
-        A dictionary of waveform instances
+        A dictionary of waveform instances.  Released waveforms are
+        removed from the dictionary.
+
+    workers : int
+        Number of waveforms released at the same time
+
+    timing : dict or None
+        If specified, the "release" seconds of each waveform are added
+        (see launch_waveforms)
 
     Raises
     ------
@@ -117,20 +151,25 @@ def release_waveforms(wfm_dict):
         "Expecting a dictionary of waveform instances"
 
     # ------------------------  release waveforms  --------------------------
-    for wfm in wfm_dict:
-        try:
-            # remove for dict
-            wfm_inst = wfm_dict.pop(wfm)
-
-            # release from domain
-            wfm_inst.ref.releaseObject()
-        except Exception as e:
+    wfms = list(wfm_dict.keys())
+    results = run_in_pool(lambda wfm: wfm_dict[wfm].ref.releaseObject(),
+        wfms, workers)
+    for wfm, (_, error, elapsed) in zip(wfms, results):
+        if timing is not None:
+            timing.setdefault(wfm, OrderedDict())["release"] = elapsed
+        if error is not None:
             print("Issue with releasing %s"%wfm)
-            print(e)
+            print(error)
+        else:
+            # remove for dict
+            wfm_dict.pop(wfm)
 
-def launch_waveforms(wfm_specs):
+def launch_waveforms(wfm_specs, workers=1, timing=None):
     """Launch waveforms
 
+    Each domain is scanned/attached once.  With workers > 1 the
+    applications are created concurrently.
+
     Parameters
     ----------
     wfm_specs : dict
@@ -143,27 +182,69 @@ def launch_waveforms(wfm_specs):
             'domain': domain to launch waveform
             'devices': devices to launch on the domain.
 
+    workers : int
+        Number of applications created at the same time
+
+    timing : dict or None
+        If specified, updated with the unique id of each waveform mapped
+        to a dictionary of "launch" seconds.
+
     Returns
     -------
     wfm_dict : OrderdDict
         The dictionary of waveform instances.  Each value is
         a ossie.utils.redhawk.core.App
+
+    Raises
+    ------
+    Exception   The first error of a waveform that failed to launch
+        (after every other waveform has been processed)
     """
     wfm_dict = OrderedDict()
+    if not wfm_specs:
+        return wfm_dict
+    if timing is None:
+        timing = OrderedDict()
 
+    # ------------------  attach to each domain once  -----------------------
+    dom_devices = OrderedDict()
     for wfm_id in wfm_specs:
-        wfm_inst, wfm_uid = launch_waveform(
+        devices = dom_devices.setdefault(
+            wfm_specs[wfm_id].get("domain", None), [])
+        devices += [dev for dev in wfm_specs[wfm_id].get("devices", [])
+            if dev not in devices]
+    active_domains = redhawk.scan()
+    doms = {}
+    for domain in dom_devices:
+        doms[domain] = get_domain(domain, dom_devices[domain],
+            active_domains=active_domains)
+
+    # ---------------------  create applications  ---------------------------
+    wfm_ids = list(wfm_specs.keys())
+    results = run_in_pool(
+        lambda wfm_id: launch_waveform(
             wfm_name=wfm_specs[wfm_id]["key"],
             wfm_config=wfm_specs[wfm_id]["val"],
-            domain=wfm_specs[wfm_id].get("domain", None),
-            devices=wfm_specs[wfm_id].get("devices", [])
-        )
+            dom=doms[wfm_specs[wfm_id].get("domain", None)])[0],
+        wfm_ids, workers)
+
+    errors = []
+    for wfm_id, (wfm_inst, error, elapsed) in zip(wfm_ids, results):
+        timing[wfm_id] = OrderedDict([("launch", elapsed)])
+        if error is not None:
+            print("Failed to launch %s: %s"%(str(wfm_id), str(error)))
+            errors.append(error)
+            continue
         wfm_dict[wfm_id] = wfm_inst
 
         log_specs = wfm_specs[wfm_id].get("log", {})
         for key in log_specs:
             wfm_inst.setLogLevel(key, log_specs[key])
 
+    if errors:
+        # do not leave the launched waveforms running
+        release_waveforms(wfm_dict, workers)
+        raise errors[0]
     return wfm_dict
 
 def start_waveforms(wfm_dict):
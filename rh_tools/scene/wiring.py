@@ -0,0 +1,167 @@
+"""
+Connect the ports of a scene.
+
+Wiring runs in two stages:
+
+1. every connection ``[uses_id, uses_port, provides_id, provides_port]`` is
+   resolved through the PortIndex and checked: both ports exist, the
+   first one is a uses port, the second one a provides port and the
+   provides port implements the interface (repid) of the uses port: the
+   same one, or a derived one according to ``_is_a``.  Nothing is
+   connected if any check fails, all the problems are reported at once.
+2. the connectPort calls are issued by a bounded pool of threads.  Every
+   connection is attempted, the failures are reported together.
+
+Checks needing the direction or repid are skipped for ports whose
+instance does not report them (see port_index).  Differing repids that
+cannot be checked with ``_is_a`` only raise a warning.
+"""
+from collections import OrderedDict
+import time
+import uuid
+import warnings
+from rh_tools.scene.utils import run_in_pool
+
+def connection_id(conn):
+    """Unique id of a connection (conn_<uses_id>_to_<provides_id>_<uuid>)"""
+    return "conn_%s_to_%s_"%(str(conn[0]), str(conn[2])) + str(uuid.uuid1())
+
+def is_connection_id(conn_id, conn):
+    """Whether conn_id was generated by connection_id for a connection
+
+    The whole id is checked, so the connections of "B" and "B_x" are not
+    mistaken for one another.
+    """
+    prefix = "conn_%s_to_%s_"%(str(conn[0]), str(conn[2]))
+    conn_id = str(conn_id)
+    if not conn_id.startswith(prefix):
+        return False
+    try:
+        return str(uuid.UUID(conn_id[len(prefix):])) == conn_id[len(prefix):]
+    except ValueError:
+        return False
+
+def implements(provides, repid):
+    """Whether a provides port implements an interface
+
+    Parameters
+    ----------
+    provides : PortEntry
+        The provides port
+
+    repid : str
+        The repository id of the interface (of the uses port)
+
+    Returns
+    -------
+    result : bool or None
+        None if it cannot be told (no _is_a, or the call failed)
+    """
+    if not repid or not provides.repid or repid == provides.repid:
+        return True
+    is_a = getattr(provides.obj_ptr, "_is_a", None)
+    if is_a is None:
+        return None
+    try:
+        return bool(is_a(repid))
+    except Exception:
+        return None
+
+def resolve_connections(connections, port_index):
+    """Resolve and check the ports of every connection
+
+    Parameters
+    ----------
+    connections : list
+        The scene connections
+
+    port_index : PortIndex
+        The ports of the scene instances
+
+    Returns
+    -------
+    resolved : list
+        List of (connection, uses PortEntry, provides PortEntry)
+
+    errors : list
+        Description of every problem found
+    """
+    resolved = []
+    errors = []
+    for conn in connections:
+        desc = "%s:%s -> %s:%s"%tuple(str(val) for val in conn[:4])
+        uses = port_index.get(conn[0], conn[1])
+        provides = port_index.get(conn[2], conn[3])
+        problems = []
+        if uses is None:
+            problems.append("no port %s:%s"%(str(conn[0]), str(conn[1])))
+        elif uses.direction and uses.direction.lower() == "provides":
+            problems.append("%s is a provides port"%str(conn[1]))
+        if provides is None:
+            problems.append("no port %s:%s"%(str(conn[2]), str(conn[3])))
+        elif provides.direction and provides.direction.lower() == "uses":
+            problems.append("%s is a uses port"%str(conn[3]))
+        if uses is not None and provides is not None:
+            compatible = implements(provides, uses.repid)
+            if compatible is None:
+                warnings.warn("%s: interfaces differ (%s, %s), "%(desc,
+                    uses.repid, provides.repid) + "connecting anyway")
+            elif not compatible:
+                problems.append("interfaces differ (%s, %s)"%(uses.repid,
+                    provides.repid))
+
+        if problems:
+            errors.append("%s: %s"%(desc, ", ".join(problems)))
+        else:
+            resolved.append((conn, uses, provides))
+    return resolved, errors
+
+def wire_scene(connections, port_index, workers=1):
+    """Connect every connection of a scene
+
+    Parameters
+    ----------
+    connections : list
+        The scene connections
+
+    port_index : PortIndex
+        The ports of the scene instances
+
+    workers : int
+        Number of connectPort calls issued at the same time
+
+    Returns
+    -------
+    conn_ids : OrderedDict
+        Dictionary of connection id to the connection
+
+    Raises
+    ------
+    RuntimeError    Listing every invalid connection (nothing connected),
+        or every connectPort that failed
+    """
+    tic = time.time()
+    resolved, errors = resolve_connections(connections, port_index)
+    if errors:
+        raise RuntimeError("Invalid connections, nothing connected:\n    " +
+            "\n    ".join(errors))
+
+    def connect(item):
+        conn, uses, provides = item
+        conn_id = connection_id(conn)
+        uses.obj_ptr.connectPort(provides.obj_ptr, conn_id)
+        return conn_id
+
+    results = run_in_pool(connect, resolved, workers)
+    conn_ids = OrderedDict()
+    for (conn, _, _), (conn_id, error, _) in zip(resolved, results):
+        if error is not None:
+            errors.append("%s:%s -> %s:%s: %s"%(tuple(
+                str(val) for val in conn[:4]) + (str(error),)))
+        else:
+            conn_ids[conn_id] = conn
+    print("Wired %d of %d connections in %.3f sec"%(len(conn_ids),
+        len(connections), time.time() - tic))
+    if errors:
+        raise RuntimeError("Failed connections:\n    " + "\n    ".join(errors))
+    return conn_ids
@@ -0,0 +1,76 @@
+from collections import OrderedDict
+from rh_tools.scene.bottleneck import BottleneckMonitor
+from rh_tools.scene.wiring import connection_id
+
+class Stats(object):
+    def __init__(self, eps, depth=0.):
+        self.elementsPerSecond = eps
+        self.bitsPerSecond = 32 * eps
+        self.callsPerSecond = 1.
+        self.averageQueueDepth = depth
+        self.timeSinceLastCall = 0.
+
+class Connection(object):
+    def __init__(self, conn_id, eps):
+        self.connectionId = conn_id
+        self.statistics = Stats(eps)
+
+class UsesPort(object):
+    def __init__(self, conn_id, eps):
+        self.statistics = [Connection(conn_id, eps)]
+
+class ProvidesPort(object):
+    def __init__(self, depth_step):
+        self.depth = 0.
+        self.depth_step = depth_step
+
+    @property
+    def statistics(self):
+        self.depth += self.depth_step
+        return Stats(0., self.depth)
+
+class Component(object):
+    def __init__(self, ports):
+        self.ports = ports
+
+    def getPort(self, name):
+        return self.ports[name]
+
+def test_growing_queue_is_bottleneck():
+    comps = {
+        "Source": Component({"out": UsesPort("conn_Source_to_Filter_1", 1e6)}),
+        "Filter": Component({"in": ProvidesPort(5.),
+            "out": UsesPort("conn_Filter_to_Sink_1", 2e5)}),
+        "Sink": Component({"in": ProvidesPort(0.)}),
+    }
+    conns = [["Sink", "out", "Nowhere", "in"],
+        ["Source", "out", "Filter", "in"],
+        ["Filter", "out", "Sink", "in"]]
+    monitor = BottleneckMonitor(conns, comps, {}, workers=2)
+    # the connection to an unknown instance is skipped
+    assert len(monitor.edges) == 2
+    for ind in range(4):
+        monitor.poll()
+
+    report = monitor.analyze()
+    assert list(report) == ["Source", "Filter", "Sink"]
+    assert report["Filter"]["in_eps"] == 1e6
+    assert report["Filter"]["ratio"] == 5.
+    assert report["Filter"]["queue_trend"] > 0
+    assert not report["Sink"]["bottleneck"]
+    assert monitor.bottleneck(report) == "Filter"
+
+def test_edges_of_prefixed_names():
+    conns = [["A", "out", "B", "in"], ["A", "out", "B_x", "in"]]
+    ids = [connection_id(conn) for conn in conns]
+    uses = UsesPort(ids[1], 20.)
+    # the id of B_x first: "conn_A_to_B_" is a prefix of it
+    uses.statistics.append(Connection(ids[0], 10.))
+    comps = {"A": Component({"out": uses}),
+        "B": Component({"in": ProvidesPort(0.)}),
+        "B_x": Component({"in": ProvidesPort(0.)})}
+    for conn_ids in (None, OrderedDict(zip(ids, conns))):
+        monitor = BottleneckMonitor(conns, comps, {}, conn_ids=conn_ids)
+        monitor.poll()
+        assert [monitor.edge_rate(edge) for edge in monitor.edges] ==\
+            [10., 20.]
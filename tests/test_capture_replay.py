@@ -0,0 +1,28 @@
+import time
+import numpy
+import pytest
+from rh_tools.bulkio.capture_replay import CaptureReplay, iter_blocks, pace,\
+    prefetch
+
+def test_blocks_across_segments():
+    segments = [numpy.arange(0, 10), numpy.arange(10, 13), numpy.arange(13, 25)]
+    blocks = list(prefetch(iter_blocks(segments, 4)))
+    assert [len(block) for block in blocks] == [4] * 6 + [1]
+    assert list(numpy.concatenate(blocks)) == list(range(25))
+
+def test_pace_speed():
+    blocks = [numpy.zeros(100)] * 5
+    # 1000 samples/sec at 2x real time: 400 samples before the last block
+    tic = time.time()
+    firsts = [first for _, first in pace(blocks, 1000., speed=2.)]
+    assert time.time() - tic >= 0.2
+    assert firsts == [0, 100, 200, 300, 400]
+    # as fast as possible
+    tic = time.time()
+    list(pace(blocks, 1000., speed=0))
+    assert time.time() - tic < 0.1
+
+def test_unknown_port_name():
+    replay = CaptureReplay("Replay")
+    with pytest.raises(ValueError):
+        replay.getPort("dataout")
@@ -0,0 +1,57 @@
+import os
+import numpy
+from rh_tools.message.columnar import RowGroup, write_columnar, load_columnar
+
+def test_row_group_pads_fields():
+    group = RowGroup(start_index=5)
+    group.append({"m": {"m::a": 1}})
+    group.append({"m": {"m::b": 2.}})
+    group.append({"n": {"n::c": "x"}})
+    arrays = group.arrays()
+    assert list(arrays["m::__index__"]) == [5, 6]
+    assert list(arrays["m::a"]) == [1, None]
+    assert list(arrays["m::b"]) == [None, 2.]
+    assert list(arrays["n::__index__"]) == [7]
+
+def test_fields_across_row_groups(tmpdir):
+    filename = os.path.join(str(tmpdir), "msgs.npz")
+    msgs = [{"m": {"m::a": ind}} for ind in range(3)] +\
+        [{"m": {"m::a": ind, "m::b": ind}} for ind in range(3, 6)] +\
+        [{"m": {"m::a": ind}} for ind in range(6, 8)]
+    write_columnar(msgs, filename, batch_size=3)
+
+    cols = load_columnar(filename)
+    assert list(cols["m::__index__"]) == list(range(8))
+    assert list(cols["m::a"]) == list(range(8))
+    assert list(cols["m::b"]) == [None] * 3 + [3, 4, 5] + [None] * 2
+
+    cols = load_columnar(filename, columns=["m::b"])
+    assert list(cols.keys()) == ["m::b"] and len(cols["m::b"]) == 8
+
+def test_interleaved_messages(tmpdir):
+    filename = os.path.join(str(tmpdir), "msgs.npz")
+    msgs = [{"m": {"m::a": 1.5}}, {"n": {"n::v": [1, 2]}},
+        {"m": {"m::a": 2.5}}, {"n": {"n::v": [3, 4]}}]
+    write_columnar(msgs, filename, batch_size=3)
+    cols = load_columnar(filename)
+    assert list(cols["m::__index__"]) == [0, 2]
+    assert numpy.allclose(cols["m::a"].astype(float), [1.5, 2.5])
+    assert list(cols["n::__index__"]) == [1, 3]
+    assert [list(val) for val in cols["n::v"]] == [[1, 2], [3, 4]]
+
+def test_sequence_shapes_across_row_groups(tmpdir):
+    filename = os.path.join(str(tmpdir), "msgs.npz")
+    msgs = [{"n": {"n::v": [1, 2]}}, {"n": {"n::v": [1, 2]}},
+        {"n": {"n::v": [1, 2, 3]}}, {"n": {"n::v": [1, 2, 3]}}]
+    write_columnar(msgs, filename, batch_size=2)
+    cols = load_columnar(filename)
+    assert [list(val) for val in cols["n::v"]] == [[1, 2]] * 2 + [[1, 2, 3]] * 2
+
+    # sequence field missing from a row group
+    msgs = [{"n": {"n::v": [1, 2], "n::x": 0}}, {"n": {"n::v": [3, 4],
+        "n::x": 1}}, {"n": {"n::x": 2}}, {"n": {"n::x": 3}}]
+    write_columnar(msgs, filename, batch_size=2)
+    cols = load_columnar(filename)
+    assert list(cols["n::x"]) == [0, 1, 2, 3]
+    assert list(cols["n::v"][:2]) == [[1, 2], [3, 4]]
+    assert list(cols["n::v"][2:]) == [None, None]
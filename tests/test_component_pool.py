@@ -0,0 +1,111 @@
+import pytest
+from collections import OrderedDict
+from rh_tools.scene.component_helper import launch_components
+from rh_tools.scene.component_pool import ComponentPool
+
+class Connection(object):
+    def __init__(self, connection_id):
+        self.connectionId = connection_id
+
+class UsesPort(object):
+    def __init__(self):
+        self.connections = {"conn_a": None}
+
+    def _get_connections(self):
+        return [Connection(key) for key in self.connections]
+
+    def disconnectPort(self, connection_id):
+        del self.connections[connection_id]
+
+class PortInfo(object):
+    def __init__(self, name, obj_ptr, direction):
+        self.name = name
+        self.obj_ptr = obj_ptr
+        self.direction = direction
+        self.repid = ""
+
+class Component(object):
+    def __init__(self, name):
+        self.name = name
+        self.props = {}
+        self.released = False
+        self.out = UsesPort()
+
+    def getPortSet(self):
+        return [PortInfo("out", self.out, "Uses"),
+            PortInfo("in", None, "Provides")]
+
+    def configure(self, props):
+        self.props.update(props)
+
+    def stop(self):
+        pass
+
+    def releaseObject(self):
+        self.released = True
+
+class Sandbox(object):
+    def __init__(self):
+        self.launched = []
+        self.instances = []
+
+    def launch(self, key, instanceName=None, stdout=None):
+        if key == "rh.broken":
+            raise RuntimeError("cannot launch")
+        self.launched.append(instanceName)
+        self.instances.append(Component(instanceName))
+        return self.instances[-1]
+
+def test_reuse_and_evict():
+    sb = Sandbox()
+    pool = ComponentPool(sb, max_idle=2, max_per_key=1)
+    specs = OrderedDict([
+        ("A", {"key": "rh.SigGen", "val": {"freq": 1}}),
+        ("B", {"key": "rh.SigGen", "val": {"freq": 2}}),
+        ("C", {"key": "rh.agc", "val": {}}),
+    ])
+    first = launch_components(sb, specs, workers=2, pool=pool)
+    assert sorted(sb.launched) == ["A", "B", "C"]
+    pool.release_all(first)
+    # one rh.SigGen kept per key, the other one released
+    assert len(pool) == 2 and pool.evictions == 1
+    assert first["C"].out.connections == {}
+
+    specs = OrderedDict([
+        ("A", {"key": "rh.SigGen", "val": {"freq": 3}}),
+        ("D", {"key": "rh.SigGen", "val": {"freq": 4}}),
+    ])
+    second = launch_components(sb, specs, pool=pool)
+    assert pool.hits == 1 and pool.misses == 4
+    reused = [comp for comp in second.values() if comp in first.values()]
+    assert len(reused) == 1 and reused[0].props["freq"] in (3, 4)
+    # the new component does not take the name of an idle one
+    assert len(set(sb.launched)) == len(sb.launched) == 4
+
+    pool.close()
+    assert len(pool) == 0 and first["C"].released
+
+def test_failed_launch_releases_others():
+    sb = Sandbox()
+    specs = OrderedDict([
+        ("A", {"key": "rh.SigGen", "val": {}}),
+        ("B", {"key": "rh.broken", "val": {}}),
+    ])
+    with pytest.raises(RuntimeError):
+        launch_components(sb, specs)
+    assert len(sb.instances) == 1 and sb.instances[0].released
+
+def test_release_after_close_and_stale_props():
+    sb = Sandbox()
+    pool = ComponentPool(sb)
+    first = pool.acquire("A", {"key": "rh.SigGen", "val": {"freq": 1,
+        "amp": 2}})
+    pool.release(first)
+    with pytest.warns(UserWarning, match="amp"):
+        again = pool.acquire("A", {"key": "rh.SigGen", "val": {"freq": 3}})
+    assert again is first
+
+    # still in use when the pool is closed
+    pool.close()
+    pool.release(again)
+    assert again.released and len(pool) == 0
@@ -0,0 +1,24 @@
+from rh_tools.scene.connection_graph import topological_layers
+
+CONNS = [
+    ["Source", "out", "Filter", "in"],
+    ["Source", "out", "Tap", "in"],
+    ["Filter", "out", "Sink", "in"],
+]
+
+def test_sink_first_layers():
+    nodes = ["Sink", "Tap", "Filter", "Source"]
+    assert topological_layers(nodes, CONNS) ==\
+        [["Sink", "Tap"], ["Filter"], ["Source"]]
+
+def test_source_first_layers_ignore_key_order():
+    for nodes in (["Source", "Filter", "Tap", "Sink"],
+            ["Sink", "Tap", "Filter", "Source"]):
+        assert topological_layers(nodes, CONNS, sink_first=False) ==\
+            [["Source"], ["Filter", "Tap"], ["Sink"]]
+
+def test_cycle_in_last_layer():
+    conns = CONNS + [["Sink", "out", "Filter", "in2"]]
+    nodes = ["Source", "Filter", "Tap", "Sink"]
+    assert topological_layers(nodes, conns) ==\
+        [["Tap"], ["Filter", "Sink", "Source"]]
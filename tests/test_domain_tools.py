@@ -0,0 +1,99 @@
+import pytest
+pytest.importorskip("ossie")
+from rh_tools.domain import domain_tools
+
+class App(object):
+    def __init__(self, name):
+        self.name = name
+        self.released = False
+
+    def _non_existent(self):
+        return self.released
+
+class Domain(object):
+    def __init__(self, apps):
+        self.listings = 0
+        self._apps = apps
+
+    @property
+    def apps(self):
+        self.listings += 1
+        return list(self._apps)
+
+class Redhawk(object):
+    def __init__(self, dom):
+        self.dom = dom
+        self.attaches = 0
+
+    def attach(self, name):
+        self.attaches += 1
+        if isinstance(self.dom, Exception):
+            raise self.dom
+        return self.dom
+
+@pytest.fixture
+def domain(monkeypatch):
+    dom = Domain([App("Wfm_1"), App("Other_2")])
+    fake = Redhawk(dom)
+    monkeypatch.setattr(domain_tools, "redhawk", fake)
+    return dom, fake
+
+def test_cache_hits_and_ttl(domain, monkeypatch):
+    dom, fake = domain
+    session = domain_tools.DomainSession("REDHAWK_DEV", ttl=10.)
+    now = [100.]
+    monkeypatch.setattr(domain_tools.time, "time", lambda: now[0])
+    assert session.find_waveform("Wfm").name == "Wfm_1"
+    assert session.find_waveform("Wfm").name == "Wfm_1"
+    assert session.find_waveform("Other_2").name == "Other_2"
+    assert dom.listings == 1 and fake.attaches == 1
+
+    now[0] += 11.
+    session.find_waveform("Wfm")
+    assert dom.listings == 2
+
+def test_missing_names_cached(domain, monkeypatch):
+    dom, fake = domain
+    session = domain_tools.DomainSession("REDHAWK_DEV", ttl=10.)
+    now = [100.]
+    monkeypatch.setattr(domain_tools.time, "time", lambda: now[0])
+    assert session.find_waveform("Missing") is None
+    assert dom.listings == 2
+    assert session.find_waveform("Missing") is None
+    assert dom.listings == 2
+
+    # listed again once the index expires
+    dom._apps = dom._apps + [App("Missing_4")]
+    now[0] += 11.
+    assert session.find_waveform("Missing").name == "Missing_4"
+
+def test_cached_object_not_probed(domain):
+    dom, fake = domain
+    session = domain_tools.DomainSession("REDHAWK_DEV")
+    old = session.find_waveform("Wfm")
+    old.released = True
+    assert session.find_waveform("Wfm") is old
+    assert dom.listings == 1
+
+def test_released_object_not_returned(domain):
+    dom, fake = domain
+    session = domain_tools.DomainSession("REDHAWK_DEV", verify=True)
+    old = session.find_waveform("Wfm")
+    old.released = True
+    dom._apps = [App("Wfm_3"), dom._apps[1]]
+    assert session.find_waveform("Wfm").name == "Wfm_3"
+    assert dom.listings == 2
+
+    # released and no longer listed
+    dom._apps[0].released = True
+    dom._apps = dom._apps[1:]
+    assert session.find_waveform("Wfm") is None
+
+def test_reattach_on_failure(domain):
+    dom, fake = domain
+    session = domain_tools.DomainSession("REDHAWK_DEV", ttl=0)
+    assert session.find_waveform("Wfm") is not None
+    # the cached handle fails, the session attaches again
+    session._dom = Domain(None)
+    assert session.find_waveform("Other").name == "Other_2"
+    assert fake.attaches == 2
@@ -0,0 +1,41 @@
+from rh_tools.message.event_decoder import EventDecoder, StructuredBuffer,\
+    decode_event, synthetic_event
+
+def test_decoders_agree():
+    decoder = EventDecoder()
+    for seed in range(3):
+        data = synthetic_event(n_msgs=4, n_fields=3, seed=seed)
+        assert decoder.decode(data) == decode_event(data)
+
+def test_structured_buffer():
+    buf = StructuredBuffer("bench_msg", capacity=2, chunk=3)
+    for seed in range(5):
+        buf.append(synthetic_event(n_msgs=2, n_fields=3, seed=seed * 6))
+    arr = buf.array()
+    assert len(arr) == 10
+    assert list(arr["bench_msg::field_0"]) == [3. * ind for ind in range(10)]
+
+def test_layout_change():
+    decoder = EventDecoder()
+    for n_fields in (3, 3, 4, 2):
+        data = synthetic_event(n_msgs=2, n_fields=n_fields)
+        assert decoder.decode(data) == decode_event(data)
+    # same number of fields, other ids
+    data = synthetic_event(msg_id="bench_msg", n_msgs=1, n_fields=2)
+    data.value()[0].value.value()[0].id = "bench_msg::other"
+    assert decoder.decode(data) == decode_event(data)
+    # same first id, other ids after it
+    data = synthetic_event(msg_id="bench_msg", n_msgs=1, n_fields=2)
+    data.value()[0].value.value()[1].id = "bench_msg::other"
+    assert decoder.decode(data) == decode_event(data)
+
+
+def test_structured_buffer_layout_change():
+    buf = StructuredBuffer("bench_msg", capacity=4, chunk=1)
+    for seed, n_fields in enumerate((3, 3, 4, 3)):
+        buf.append(synthetic_event(n_msgs=2, n_fields=n_fields, seed=seed * 2))
+    arr = buf.array()
+    assert len(arr) == 8
+    # field_0 of the rows of each event is seed, seed + n_fields
+    assert list(arr["bench_msg::field_0"]) == [0., 3., 2., 5., 4., 8., 6., 9.]
+    assert list(arr["bench_msg::field_3"]) == [0.] * 4 + [7., 11.] + [0.] * 2
@@ -0,0 +1,29 @@
+import threading
+import pytest
+pytest.importorskip("ossie")
+pytest.importorskip("omniORB")
+from rh_tools.message.event_decoder import synthetic_event
+from rh_tools.message.event_channel_to_waveform_forwarding import Forwarder
+
+class Destination(object):
+    def __init__(self):
+        self.msgs = []
+        self.lock = threading.Lock()
+
+    def sendMessage(self, msg):
+        with self.lock:
+            self.msgs.append(msg)
+
+def test_close_with_several_workers():
+    dest = Destination()
+    forwarder = Forwarder(dest, batch_size=10, workers=4)
+    for seed in range(50):
+        forwarder.forward(synthetic_event(n_msgs=2, n_fields=1, seed=seed))
+
+    closer = threading.Thread(target=forwarder.close)
+    closer.daemon = True
+    closer.start()
+    closer.join(5.)
+    assert not closer.is_alive(), "close() did not return"
+    assert len(dest.msgs) == 100
+    assert forwarder.stats()["forwarded"] == 100
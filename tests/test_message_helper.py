@@ -0,0 +1,62 @@
+import csv
+import io
+import json
+import os
+import pytest
+pytest.importorskip("pandas")
+pytest.importorskip("ossie")
+from rh_tools.scene.message_helper import _JsonStream, iter_message_file,\
+    messages_to_csv, convert_message_file
+
+RECORD = {
+    "wfm:port_a": [{"a": {"a::x": ind, "a::s": "}]\\\"[{"}} for ind in range(5)],
+    "wfm:port_b": [{"b": {"b::y": [ind, {"z": [1]}]}} for ind in range(3)],
+    "wfm:port_c": [],
+}
+
+def test_json_stream_chunk_boundaries():
+    text = json.dumps(RECORD)
+    for chunk_size in (1, 2, 3, 7, 1 << 20):
+        stream = _JsonStream(io.StringIO(text), chunk_size=chunk_size)
+        found = {}
+        for key in stream.iter_object():
+            if key == "wfm:port_b":
+                stream.skip()
+            else:
+                found[key] = list(stream.iter_array())
+        assert found == {"wfm:port_a": RECORD["wfm:port_a"], "wfm:port_c": []}
+        assert stream.peek() is None
+
+def test_iter_message_file(tmpdir):
+    filename = os.path.join(str(tmpdir), "record.json")
+    with open(filename, "w") as fid:
+        json.dump(RECORD, fid)
+    msgs = list(iter_message_file(filename, keys=["wfm:port_b"]))
+    assert msgs == [("wfm:port_b", msg) for msg in RECORD["wfm:port_b"]]
+
+    filename = os.path.join(str(tmpdir), "list.json")
+    with open(filename, "w") as fid:
+        json.dump(RECORD["wfm:port_a"], fid)
+    assert [msg for _, msg in iter_message_file(filename)] ==\
+        RECORD["wfm:port_a"]
+
+def test_convert_jobs(tmpdir):
+    filename = os.path.join(str(tmpdir), "record.json")
+    with open(filename, "w") as fid:
+        json.dump(RECORD, fid)
+    out = os.path.join(str(tmpdir), "out")
+    first = convert_message_file(filename, out, job=0, jobs=2)
+    second = convert_message_file(filename, out, job=1, jobs=2)
+    assert first == [out + "_wfm:port_a.csv"]
+    assert second == [out + "_wfm:port_b.csv"]
+
+def test_messages_to_csv_chunks(tmpdir):
+    filename = os.path.join(str(tmpdir), "msgs.csv")
+    msgs = ({"m": {"m::a": ind, "m::b": ind * 2}} for ind in range(7))
+    messages_to_csv(msgs, filename, chunk_size=3)
+    with open(filename) as fid:
+        rows = list(csv.reader(fid))
+    assert rows[0] == ["", "a", "b"]
+    assert rows[1:] == [[str(ind), str(ind), str(ind * 2)] for ind in range(7)]
+    with pytest.raises(RuntimeError):
+        messages_to_csv(iter([]), filename)
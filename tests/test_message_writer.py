@@ -0,0 +1,15 @@
+import os
+from rh_tools.message.message_writer import JsonLinesWriter, iter_json_lines
+
+def test_json_lines_rotation(tmpdir):
+    filename = os.path.join(str(tmpdir), "msgs.ndjson")
+    writer = JsonLinesWriter(filename, max_queue=4, rotate_bytes=100)
+    msgs = [{"my_msg": {"my_msg::count": ind}} for ind in range(20)]
+    for msg in msgs:
+        writer.write(msg)
+    writer.close()
+
+    assert writer.written == len(msgs)
+    assert writer.dropped == 0
+    assert len(writer.files) > 1
+    assert list(iter_json_lines(writer.files)) == msgs
@@ -0,0 +1,36 @@
+from rh_tools.scene.port_index import PortIndex
+
+class PortInfo(object):
+    def __init__(self, name, direction):
+        self.name = name
+        self.obj_ptr = "ptr_" + name
+        self.direction = direction
+        self.repid = "IDL:BULKIO/dataFloat:1.0"
+        self.description = ""
+
+class Waveform(object):
+    calls = 0
+
+    def getPortSet(self):
+        self.calls += 1
+        return [PortInfo("data_in", "Provides"), PortInfo("data_out", "Uses")]
+
+class LocalSource(object):
+    calls = 0
+
+    def getPort(self, name):
+        self.calls += 1
+        return "local_" + name
+
+def test_port_set_fetched_once():
+    wfm = Waveform()
+    src = LocalSource()
+    index = PortIndex({"Source": src}, {"Wfm": wfm})
+    assert index.build(workers=2) == {}
+    for ind in range(3):
+        assert index.port("Wfm", "data_out") == "ptr_data_out"
+        assert index.get("Wfm", "data_in").direction == "Provides"
+        assert index.port("Source", "dataOut") == "local_dataOut"
+    assert index.get("Wfm", "missing") is None
+    assert index.get("Nobody", "data_in") is None
+    assert wfm.calls == 1 and src.calls == 1
@@ -0,0 +1,17 @@
+import time
+from rh_tools.scene.sampler import Sampler
+
+def test_fixed_rate_and_skipped_ticks():
+    calls = []
+    sampler = Sampler()
+    sampler.add("fast", lambda: calls.append(time.time()), 0.02)
+    sampler.add("slow", lambda: time.sleep(0.05), 0.02)
+    sampler.start()
+    time.sleep(0.3)
+    sampler.stop(flush=False)
+
+    timing = sampler.timing()
+    # slow task does not hold back the fast one
+    assert timing["fast"]["passes"] >= 10
+    assert timing["slow"]["skipped"] > 0
+    assert timing["slow"]["mean"] >= 0.05
@@ -0,0 +1,46 @@
+import json
+import pytest
+from rh_tools.scene.scene_cache import load_scene
+
+SCENE = {
+    "components": {
+        "Source": {"key": "rh.SigGen", "val": {}},
+        "Sink": {"key": "rh.DataConverter", "val": {}},
+    },
+    "connections": [["Source", "out", "Sink", "in"]],
+    "simulation": {"type": "time", "value": {"duration": 1.0}},
+}
+
+def test_compile_and_cache(tmpdir):
+    sdrroot = tmpdir.mkdir("sdr")
+    sdrroot.mkdir("dom").mkdir("components").mkdir("rh").mkdir("SigGen")\
+        .join("SigGen.spd.xml").write("<softpkg/>")
+    filename = str(tmpdir.join("scene.json"))
+    with open(filename, "w") as fid:
+        json.dump(SCENE, fid)
+    cache = str(tmpdir.join("cache"))
+
+    compiled, cached = load_scene(filename, cache, str(sdrroot))
+    assert not cached
+    assert compiled["start_layers"] == [["Sink"], ["Source"]]
+    comps = compiled["settings"]["components"]
+    assert comps["Source"]["spd"].endswith("rh/SigGen/SigGen.spd.xml")
+    assert "spd" not in comps["Sink"]
+
+    again, cached = load_scene(filename, cache, str(sdrroot))
+    assert cached and again == compiled
+
+    # a changed scene is compiled again
+    with open(filename, "w") as fid:
+        json.dump(dict(SCENE, connections=[]), fid)
+    assert not load_scene(filename, cache, str(sdrroot))[1]
+
+def test_invalid_scene(tmpdir):
+    filename = str(tmpdir.join("scene.json"))
+    with open(filename, "w") as fid:
+        json.dump(dict(SCENE, connections=[["Source", "out", "Nope", "in"],
+            ["Source", "out"]]), fid)
+    with pytest.raises(ValueError) as err:
+        load_scene(filename)
+    assert "unknown instance Nope" in str(err.value)
+    assert "['Source', 'out']" in str(err.value)
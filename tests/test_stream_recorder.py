@@ -0,0 +1,89 @@
+import json
+import numpy
+from rh_tools.bulkio.stream_recorder import SegmentedRecorder, INDEX_DTYPE,\
+    FLAG_QUEUE_FLUSHED
+
+def test_rotation_index_and_meta(tmpdir):
+    filename = str(tmpdir.join("cap.bin"))
+    with SegmentedRecorder(filename, numpy.float32, rotate_bytes=400) as rec:
+        rec.add_sri({"streamID": "s1", "xdelta": 1e-3})
+        for ind in range(5):
+            rec.write(numpy.arange(40, dtype=numpy.float32) + 40 * ind,
+                twsec=100. + ind, queue_flushed=ind == 3)
+        # bytes are viewed without conversion
+        rec.write(numpy.arange(3, dtype=numpy.float32).tobytes())
+
+    # 100 elements per segment, one packet of 40 does not fit after 2
+    assert [len(numpy.fromfile(name, numpy.float32)) for name in rec.files]\
+        == [80, 80, 43]
+    index = numpy.fromfile(str(tmpdir.join("cap.idx")), INDEX_DTYPE)
+    assert list(index["segment"]) == [0, 0, 1, 1, 2, 2]
+    assert list(index["offset"]) == [0, 40, 0, 40, 0, 40]
+    assert index["flags"][3] == FLAG_QUEUE_FLUSHED
+    last = numpy.fromfile(rec.files[1], numpy.float32)
+    assert last[-1] == 159.
+
+    meta = json.load(open(str(tmpdir.join("cap.json"))))
+    assert meta["packets"] == 6 and meta["queue_flushes"] == 1
+    assert meta["sri"][0]["streamID"] == "s1"
+    assert meta["segments"] == ["cap_0000.bin", "cap_0001.bin", "cap_0002.bin"]
+
+def test_single_segment_grows(tmpdir):
+    filename = str(tmpdir.join("cap.bin"))
+    with SegmentedRecorder(filename, numpy.int16, grow_bytes=64) as rec:
+        for ind in range(10):
+            rec.write(numpy.full(25, ind, dtype=numpy.int16))
+    data = numpy.fromfile(rec.files[0], numpy.int16)
+    assert len(rec.files) == 1 and len(data) == 250
+    assert (data[::25] == numpy.arange(10)).all()
+
+def test_capture_reader_time_slice(tmpdir):
+    from rh_tools.bulkio.capture_reader import CaptureReader
+    filename = str(tmpdir.join("cap.bin"))
+    # 100 samples per packet at 1 ms, 2 packets per segment
+    with SegmentedRecorder(filename, numpy.float32, rotate_bytes=800) as rec:
+        rec.add_sri({"xdelta": 1e-3, "mode": 0})
+        for ind in range(6):
+            rec.write(numpy.arange(100) + 100 * ind, twsec=1000., tfsec=0.1 * ind)
+
+    cap = CaptureReader(filename)
+    view = cap.time_slice(1000.105, 1000.115)
+    assert isinstance(view, numpy.memmap)
+    assert list(view) == list(range(105, 115))
+    # spans segments 0 to 2
+    assert list(cap.time_slice(1000.15, 1000.45)) == list(range(150, 450))
+    assert len(cap.packets(1000.15, 1000.45)) == 4
+    assert len(cap.time_slice(999., 2000.)) == 600
+
+def test_bluefile_index(tmpdir):
+    import struct
+    from rh_tools.bulkio.capture_reader import CaptureReader, index_bluefile,\
+        J1950_TO_UNIX
+    filename = str(tmpdir.join("blue.tmp"))
+    hcb = bytearray(512)
+    hcb[0:12] = b"BLUEEEEIEEEI"
+    hcb[32:48] = struct.pack("<dd", 512., 1000 * 8.)
+    hcb[48:52] = struct.pack("<i", 1000)
+    hcb[52:54] = b"CF"
+    hcb[56:64] = struct.pack("<d", J1950_TO_UNIX + 50.)
+    hcb[256:272] = struct.pack("<dd", 0., 0.01)
+    with open(filename, "wb") as fid:
+        fid.write(bytes(hcb))
+        fid.write(numpy.arange(2000, dtype=numpy.float32).tobytes())
+
+    assert index_bluefile(filename, block=300) == 4
+    cap = CaptureReader(filename)
+    # complex samples, 2 elements per sample
+    assert list(cap.time_slice(53.0, 53.02)) == [600., 601., 602., 603.]
+
+def test_meta_written_on_rollover(tmpdir):
+    filename = str(tmpdir.join("cap.bin"))
+    rec = SegmentedRecorder(filename, numpy.float32, rotate_bytes=160)
+    for ind in range(3):
+        rec.write(numpy.zeros(40, dtype=numpy.float32), twsec=float(ind))
+    # not closed (i.e. the recorder crashed), the segments are listed
+    meta = json.load(open(str(tmpdir.join("cap.json"))))
+    assert meta["segments"] == ["cap_0000.bin", "cap_0001.bin", "cap_0002.bin"]
+    index = numpy.fromfile(str(tmpdir.join("cap.idx")), INDEX_DTYPE)
+    assert len(index) == 2
+    rec.close()
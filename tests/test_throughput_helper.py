@@ -0,0 +1,56 @@
+import os
+import sys
+from rh_tools.scene.throughput_helper import ThroughputMonitor, STAT_FIELDS,\
+    close
+
+class Stats(object):
+    def __init__(self, eps):
+        self.elementsPerSecond = eps
+        self.bitsPerSecond = 32 * eps
+        self.callsPerSecond = 10.
+        self.averageQueueDepth = 0.
+        self.timeSinceLastCall = 0.1
+
+class Connection(object):
+    def __init__(self, conn_id, eps):
+        self.connectionId = conn_id
+        self.statistics = Stats(eps)
+
+class Port(object):
+    """uses port with two connections"""
+    def __init__(self):
+        self.calls = 0
+
+    @property
+    def statistics(self):
+        self.calls += 1
+        return [Connection("a", 100. * self.calls), Connection("b", 1.)]
+
+class ProvidesPort(object):
+    statistics = Stats(5.)
+
+def test_monitor_history_and_summary(tmpdir):
+    ports = {"src_out": {"instance": Port()},
+        "sink_in": {"instance": ProvidesPort()}}
+    monitor = ThroughputMonitor(ports, history=3, workers=2)
+    for ind in range(5):
+        monitor.poll()
+
+    assert sorted(monitor.history) == ["sink_in", "src_out[a]", "src_out[b]"]
+    summary = monitor.summary()
+    # ring buffer keeps the last 3 samples
+    assert summary["src_out[a]"]["min"] == 300.
+    assert summary["src_out[a]"]["max"] == 500.
+    assert summary["sink_in"]["mean"] == 5.
+
+    samples = monitor.to_array()
+    assert len(samples) == 9
+    assert samples.dtype.names[2:] == STAT_FIELDS
+    filename = str(tmpdir.join("tp.csv"))
+    monitor.save(filename)
+    assert len(open(filename).readlines()) == 10
+
+def test_close_keeps_stdout(tmpdir):
+    fid = open(os.path.join(str(tmpdir), "tp.csv"), "w")
+    close({"a_out": {"out": sys.stdout}, "b_out": {"out": fid}})
+    assert fid.closed and not sys.stdout.closed
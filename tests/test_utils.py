@@ -0,0 +1,27 @@
+import array
+import json
+from rh_tools.scene.utils import convert_dict, parse_json
+
+TEXT = json.dumps({"components": {"b": {"key": "rh.X", "val": {
+    "taps": [0.5, 1, 2.5] * 10, "ids": [1, 2, 3], "flags": [True] * 20,
+    "nested": [["a", {"c": "d"}]]}}}, "a": "text"})
+
+def test_parse_json_matches_convert_dict():
+    assert parse_json(TEXT) == convert_dict(json.loads(TEXT))
+    assert list(parse_json(TEXT).keys()) == ["components", "a"]
+
+def test_numeric_arrays():
+    val = parse_json(TEXT, arrays="array")["components"]["b"]["val"]
+    assert isinstance(val["taps"], array.array) and val["taps"].typecode == "d"
+    # short or non numeric lists stay lists
+    assert val["ids"] == [1, 2, 3]
+    assert val["flags"] == [True] * 20
+    assert val["nested"] == [["a", {"c": "d"}]]
+    val = parse_json(TEXT, arrays="numpy")["components"]["b"]["val"]
+    assert val["taps"].dtype.name == "float64"
+
+def test_large_integers_stay_lists():
+    text = json.dumps({"ids": [2 ** 70] + list(range(20))})
+    for arrays in ("array", "numpy"):
+        assert parse_json(text, arrays=arrays)["ids"] == [2 ** 70] +\
+            list(range(20))
@@ -0,0 +1,83 @@
+import pytest
+from rh_tools.scene.port_index import PortEntry
+from rh_tools.scene.wiring import wire_scene
+
+FLOAT = "IDL:BULKIO/dataFloat:1.0"
+MSG = "IDL:ExtendedEvent/MessageEvent:1.0"
+# derived from dataFloat
+FE = "IDL:FRONTEND/dataFloat:1.0"
+
+class Port(object):
+    def __init__(self, fail=False):
+        self.connections = []
+        self.fail = fail
+
+    def connectPort(self, other, conn_id):
+        if self.fail:
+            raise Exception("refused")
+        self.connections.append((other, conn_id))
+
+class ProvidesPort(Port):
+    def __init__(self, interfaces):
+        super(ProvidesPort, self).__init__()
+        self.interfaces = interfaces
+
+    def _is_a(self, repid):
+        return repid in self.interfaces
+
+class Index(object):
+    def __init__(self, ports):
+        self.ports = ports
+
+    def get(self, unique_id, port_name):
+        return self.ports.get((unique_id, port_name))
+
+def make_index(fail=False):
+    return Index({
+        ("Src", "out"): PortEntry("out", Port(fail), "Uses", FLOAT, ""),
+        ("Flt", "in"): PortEntry("in", Port(), "Provides", FLOAT, ""),
+        ("Flt", "out"): PortEntry("out", Port(), "Uses", FLOAT, ""),
+        ("Snk", "in"): PortEntry("in", Port(), "Provides", FLOAT, ""),
+        ("Snk", "msg_in"): PortEntry("msg_in", ProvidesPort([MSG]),
+            "Provides", MSG, ""),
+        ("Snk", "fe_in"): PortEntry("fe_in", ProvidesPort([FE, FLOAT]),
+            "Provides", FE, ""),
+        ("Snk", "any_in"): PortEntry("any_in", Port(), "Provides", FE, ""),
+    })
+
+def test_wire_concurrently():
+    index = make_index()
+    conns = [["Src", "out", "Flt", "in"], ["Flt", "out", "Snk", "in"]]
+    conn_ids = wire_scene(conns, index, workers=2)
+    assert list(conn_ids.values()) == conns
+    assert len(index.ports[("Src", "out")].obj_ptr.connections) == 1
+
+def test_all_problems_reported_before_connecting():
+    index = make_index()
+    conns = [["Src", "out", "Flt", "in"], ["Flt", "in", "Snk", "in"],
+        ["Flt", "out", "Snk", "msg_in"], ["Flt", "out", "Nope", "in"]]
+    with pytest.raises(RuntimeError) as err:
+        wire_scene(conns, index, workers=2)
+    msg = str(err.value)
+    assert "in is a provides port" in msg
+    assert "interfaces differ" in msg
+    assert "no port Nope:in" in msg
+    # nothing connected
+    assert index.ports[("Src", "out")].obj_ptr.connections == []
+
+def test_connect_failures_consolidated():
+    index = make_index(fail=True)
+    conns = [["Src", "out", "Flt", "in"], ["Flt", "out", "Snk", "in"]]
+    with pytest.raises(RuntimeError) as err:
+        wire_scene(conns, index, workers=2)
+    assert "Src:out -> Flt:in: refused" in str(err.value)
+    assert len(index.ports[("Flt", "out")].obj_ptr.connections) == 1
+
+def test_derived_interface_connected():
+    index = make_index()
+    conns = [["Flt", "out", "Snk", "fe_in"]]
+    assert list(wire_scene(conns, index).values()) == conns
+    # cannot be checked, connected with a warning
+    conns = [["Flt", "out", "Snk", "any_in"]]
+    with pytest.warns(UserWarning):
+        assert list(wire_scene(conns, index).values()) == conns